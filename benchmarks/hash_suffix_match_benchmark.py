@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+"""Compare hash-suffix matching through a prefix index built once with the
+previous scan of every extra key for each unmatched rendered resource.
+
+Usage:
+    python benchmarks/hash_suffix_match_benchmark.py [--configmaps 500,1000,2000,4000] [--revisions 3]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from utils.helm_utils import HashSuffixKeyIndex
+
+
+def legacy_find_first_same_object_key_with_different_hash(keys, object_key: str) -> str:
+    for key in keys:
+        if len(key) != len(object_key):
+            continue
+        key_parts = key.rsplit("-", 1)
+        object_key_parts = object_key.rsplit("-", 1)
+        if len(key_parts) != 2 or len(object_key_parts) != 2:
+            continue
+        if key_parts[0] != object_key_parts[0]:
+            continue
+        if any(c not in '0123456789abcdef' for c in key_parts[1].lower()) or \
+                any(c not in '0123456789abcdef' for c in object_key_parts[1].lower()):
+            continue
+        return key
+    return None
+
+
+def config_map_key(index: int, revision: int) -> str:
+    digest = hashlib.sha256(f'{index}:{revision}'.encode('utf-8')).hexdigest()[:10]
+    return f'ConfigMap:demo:app-{index}-config-{digest}'
+
+
+def build_keys(configmaps: int, revisions: int) -> tuple:
+    """集群中保留每个 ConfigMap 前几次发布的版本，渲染结果是新的 hash"""
+    extra_keys = {config_map_key(index, revision)
+                  for index in range(configmaps) for revision in range(revisions)}
+    rendered_keys = [config_map_key(index, revisions) for index in range(configmaps)]
+    return extra_keys, rendered_keys
+
+
+def measure_legacy(extra_keys: set, rendered_keys: list) -> tuple:
+    extra_keys = set(extra_keys)
+    started = time.perf_counter()
+    matched = 0
+    for rendered_key in rendered_keys:
+        same_key = legacy_find_first_same_object_key_with_different_hash(extra_keys, rendered_key)
+        if same_key is not None:
+            extra_keys.discard(same_key)
+            matched += 1
+    return matched, time.perf_counter() - started
+
+
+def measure_index(extra_keys: set, rendered_keys: list) -> tuple:
+    extra_keys = set(extra_keys)
+    started = time.perf_counter()
+    index = HashSuffixKeyIndex(sorted(extra_keys))
+    matched = 0
+    for rendered_key in rendered_keys:
+        same_key = index.find(rendered_key)
+        if same_key is not None:
+            extra_keys.discard(same_key)
+            index.discard(same_key)
+            matched += 1
+    return matched, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--configmaps', default='500,1000,2000,4000',
+                        help='comma-separated ConfigMap counts')
+    parser.add_argument('--revisions', type=int, default=3,
+                        help='old hash-suffixed revisions kept in the cluster per ConfigMap')
+    args = parser.parse_args()
+
+    print(f'{"configmaps":>10} {"extra keys":>10} {"legacy scan":>12} {"prefix index":>13} {"speedup":>8}')
+    for configmaps in (int(value) for value in args.configmaps.split(',')):
+        extra_keys, rendered_keys = build_keys(configmaps, args.revisions)
+        legacy_matched, legacy_seconds = measure_legacy(extra_keys, rendered_keys)
+        index_matched, index_seconds = measure_index(extra_keys, rendered_keys)
+        assert legacy_matched == index_matched == configmaps
+        print(f'{configmaps:>10} {len(extra_keys):>10} {legacy_seconds:>11.3f}s '
+              f'{index_seconds:>12.4f}s {legacy_seconds / index_seconds:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
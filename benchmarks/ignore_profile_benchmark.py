@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+"""Measure how much ignore-rule traversal the per-kind profiles save compared
+with applying one global tree (all profiles merged) to every manifest.
+
+Usage:
+    python benchmarks/ignore_profile_benchmark.py [--resources 5000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from manifest_compare_benchmark import build_release
+from utils.dict_utils import (compile_ignore_fields, compile_ignore_profiles,
+                              merge_ignore_trees, resolve_ignore_matcher)
+from utils.yaml_utils import load_yaml
+from services.helm_service import manifests_are_equal
+
+
+def count_rule_visits(obj, matcher) -> int:
+    """按规则驱动的方式遍历（与 remove_ignore_fields 相同），统计检查过的规则数"""
+    if obj is None or matcher is None:
+        return 0
+    if isinstance(obj, list):
+        return sum(count_rule_visits(item, matcher) for item in obj)
+    if not isinstance(obj, dict):
+        return 0
+    visits = len(matcher.fields) + len(matcher.children)
+    for key, child_matcher in matcher.children.items():
+        if key in obj:
+            visits += count_rule_visits(obj[key], child_matcher)
+    return visits
+
+
+def measure(pairs, ignore_fields_config) -> tuple:
+    visits = sum(count_rule_visits(runtime, resolve_ignore_matcher(ignore_fields_config, rendered))
+                 for rendered, runtime in pairs)
+    started = time.perf_counter()
+    results = [manifests_are_equal(rendered, runtime, ignore_fields_config)
+               for rendered, runtime in pairs]
+    return visits, time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resources', type=int, default=5000)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT_DIR, 'src', 'config.yml'), 'r', encoding='utf-8') as config_file:
+        config = load_yaml(config_file)
+    # 把所有 kind 的规则合并进全局字段树，相当于之前单一全局 ignore_fields 的行为
+    global_matcher = compile_ignore_fields(merge_ignore_trees(
+        config['ignore_fields'], *config['ignore_fields_by_kind'].values()))
+    pairs = build_release(args.resources)
+
+    global_visits, global_seconds, global_results = measure(pairs, global_matcher)
+    profile_visits, profile_seconds, profile_results = measure(
+        pairs, compile_ignore_profiles(config))
+
+    print(f'resources: {len(pairs)}')
+    print(f'changed (global tree / per-kind profiles): '
+          f'{global_results.count(False)} / {profile_results.count(False)}')
+    print(f'rule visits, global tree:      {global_visits}')
+    print(f'rule visits, per-kind profile: {profile_visits} '
+          f'({100 * (1 - profile_visits / global_visits):.1f}% fewer)')
+    print(f'comparator, global tree:       {global_seconds:.3f}s')
+    print(f'comparator, per-kind profile:  {profile_seconds:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+"""Compare the structural manifest comparator with the previous
+deepcopy + remove_ignore_fields + yaml.dump string comparison.
+
+Usage:
+    python benchmarks/manifest_compare_benchmark.py [--resources 5000]
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from utils.dict_utils import (compile_ignore_profiles, remove_ignore_fields,
+                              resolve_ignore_matcher)
+from utils.yaml_utils import YAML_BACKEND, dump_yaml, init_yaml_representer, load_yaml
+from services.helm_service import manifests_are_equal, without_implicit_runtime_defaults
+
+
+def legacy_manifests_are_equal(left: dict, right: dict, ignore_fields_config) -> bool:
+    matcher = resolve_ignore_matcher(ignore_fields_config, left)
+    normalized_left = copy.deepcopy(left)
+    remove_ignore_fields(normalized_left, matcher)
+    normalized_right = copy.deepcopy(right)
+    remove_ignore_fields(normalized_right, matcher)
+    normalized_right = without_implicit_runtime_defaults(normalized_left, normalized_right)
+    return dump_yaml(normalized_left, allow_unicode=True, sort_keys=True) == \
+        dump_yaml(normalized_right, allow_unicode=True, sort_keys=True)
+
+
+def build_deployment(index: int) -> dict:
+    name = f'app-{index}'
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {'name': name, 'namespace': 'demo',
+                     'labels': {'app': name, 'tier': 'backend'}},
+        'spec': {
+            'selector': {'matchLabels': {'app': name}},
+            'template': {
+                'metadata': {'labels': {'app': name}},
+                'spec': {
+                    'containers': [{
+                        'name': 'app',
+                        'image': f'registry.local/team/{name}:1.0.{index % 7}',
+                        'ports': [{'containerPort': 8080, 'name': 'http'}],
+                        'env': [{'name': f'ENV_{i}', 'value': str(i)} for i in range(10)],
+                        'readinessProbe': {'httpGet': {'path': '/ready', 'port': 8080}},
+                    }],
+                    'volumes': [{'name': 'config', 'configMap': {'name': f'{name}-config'}}],
+                },
+            },
+        },
+    }
+
+
+def build_service(index: int) -> dict:
+    name = f'app-{index}'
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': {'name': name, 'namespace': 'demo', 'labels': {'app': name}},
+        'spec': {'selector': {'app': name},
+                 'ports': [{'name': 'http', 'port': 80, 'targetPort': 8080}]},
+    }
+
+
+def build_config_map(index: int) -> dict:
+    return {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': f'app-{index}-config', 'namespace': 'demo'},
+        'data': {'application.yaml': '\n'.join(
+            f'key{i}: value-{index}-{i}' for i in range(200)) + '\n'},
+    }
+
+
+def to_runtime(manifest: dict, index: int) -> dict:
+    runtime = copy.deepcopy(manifest)
+    metadata = runtime['metadata']
+    metadata.update({
+        'uid': f'uid-{index}',
+        'resourceVersion': str(100000 + index),
+        'creationTimestamp': '2024-01-01T00:00:00Z',
+        'generation': 3,
+    })
+    metadata.setdefault('annotations', {}).update({
+        'meta.helm.sh/release-name': 'demo',
+        'meta.helm.sh/release-namespace': 'demo',
+    })
+    metadata.setdefault('labels', {})['app.kubernetes.io/managed-by'] = 'Helm'
+    if runtime['kind'] == 'Deployment':
+        runtime['spec'].update({'replicas': 2, 'revisionHistoryLimit': 10,
+                                'progressDeadlineSeconds': 600,
+                                'strategy': {'type': 'RollingUpdate'}})
+        pod_spec = runtime['spec']['template']['spec']
+        pod_spec.update({'dnsPolicy': 'ClusterFirst', 'restartPolicy': 'Always',
+                         'schedulerName': 'default-scheduler',
+                         'securityContext': {},
+                         'terminationGracePeriodSeconds': 30})
+        container = pod_spec['containers'][0]
+        container.update({'imagePullPolicy': 'IfNotPresent', 'resources': {},
+                          'terminationMessagePath': '/dev/termination-log',
+                          'terminationMessagePolicy': 'File'})
+        runtime['status'] = {'replicas': 2, 'readyReplicas': 2, 'availableReplicas': 2}
+    elif runtime['kind'] == 'Service':
+        runtime['spec'].update({'type': 'ClusterIP', 'clusterIP': '10.0.0.1',
+                                'sessionAffinity': 'None'})
+        runtime['spec']['ports'][0]['protocol'] = 'TCP'
+    if index % 10 == 0:
+        # 约 10% 的资源存在真实差异
+        runtime['metadata']['labels']['drifted'] = 'true'
+    return runtime
+
+
+def build_release(resource_count: int) -> list:
+    pairs = []
+    builders = (build_deployment, build_service, build_config_map)
+    for index in range(resource_count):
+        rendered = builders[index % len(builders)](index // len(builders))
+        pairs.append((rendered, to_runtime(rendered, index)))
+    return pairs
+
+
+def measure(func, pairs, ignore_fields_config) -> tuple:
+    started = time.perf_counter()
+    results = [func(rendered, runtime, ignore_fields_config) for rendered, runtime in pairs]
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resources', type=int, default=5000)
+    args = parser.parse_args()
+
+    init_yaml_representer()
+    with open(os.path.join(ROOT_DIR, 'src', 'config.yml'), 'r', encoding='utf-8') as config_file:
+        ignore_profiles = compile_ignore_profiles(load_yaml(config_file))
+    pairs = build_release(args.resources)
+
+    legacy_seconds, legacy_results = measure(
+        legacy_manifests_are_equal, pairs, ignore_profiles)
+    structural_seconds, structural_results = measure(
+        manifests_are_equal, pairs, ignore_profiles)
+
+    if legacy_results != structural_results:
+        raise SystemExit('Comparator results differ from the legacy implementation.')
+    print(f'resources: {len(pairs)} (yaml backend: {YAML_BACKEND})')
+    print(f'equal: {sum(structural_results)}, changed: {len(pairs) - sum(structural_results)}')
+    print(f'legacy deepcopy + yaml.dump: {legacy_seconds:.3f}s')
+    print(f'structural comparator:       {structural_seconds:.3f}s')
+    print(f'speedup: {legacy_seconds / structural_seconds:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
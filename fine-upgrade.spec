@@ -12,7 +12,8 @@ a = Analysis(
         (str(ROOT / 'README.md'), '.'),
         (str(ROOT / 'src' / 'config.yml'), '.'),
     ],
-    hiddenimports=[],
+    # PyYAML 的 libyaml C 扩展只会被动态导入，需要显式打包
+    hiddenimports=['yaml._yaml'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
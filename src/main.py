@@ -5,7 +5,8 @@ import sys
 import os
 import argparse
 from utils.yaml_utils import init_yaml_representer
-from utils.helm_utils import configure_kube_options
+from utils.helm_utils import (DEFAULT_FETCH_PARALLELISM, DEFAULT_MAX_CONCURRENT_ROLLOUTS,
+                              DEFAULT_ROLLOUT_TIMEOUT, configure_kube_options)
 from utils.output_utils import SUPPORTED_OUTPUT_FORMATS
 
 if getattr(sys, 'frozen', False):
@@ -26,12 +27,28 @@ MUTATING_ACTIONS = {
     'rolling-update-pod-labels',
 }
 CONFIRMATION_REQUIRED_EXIT_CODE = 2
+USAGE_ERROR_EXIT_CODE = 2
+# 指定 --from-snapshot 时可以省略 chart，直接使用快照中的渲染结果
+SNAPSHOT_CHART_OPTIONAL_ACTIONS = {
+    'adopt-plan',
+    'plan',
+    'generate-comparison-file',
+}
 
 def print_default_config():
     """打印默认配置文件，类似 helm show values，可以使用重定向另行保存"""
     with open(os.path.join(BASEDIR, DEFAULT_CONFIG_FILE), 'r', encoding='utf-8') as config_file:
         print(config_file.read())
 
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'必须是正整数: {value}')
+    return number
+
 def add_common_options(parser):
     parser.add_argument('--namespace', type=str, help='Release namespace')
     parser.add_argument('--kubeconfig', type=str, help='Kubeconfig file path')
@@ -51,6 +68,14 @@ def add_common_options(parser):
                         help='确认执行会修改集群或本地文件的命令')
     parser.add_argument('--debug', action='store_true',
                         help='打印执行的 Helm/kubectl 命令')
+    parser.add_argument('--no-render-cache', action='store_true',
+                        help='不读取也不写入 helm template 渲染缓存')
+    parser.add_argument('--parallelism', type=positive_int, default=DEFAULT_FETCH_PARALLELISM,
+                        help='并发执行 kubectl get 查询运行时对象、kubectl apply 应用资源的最大数量')
+    parser.add_argument('--rollout-timeout', type=positive_int, default=DEFAULT_ROLLOUT_TIMEOUT,
+                        help='等待 Deployment 滚动更新完成的最长秒数')
+    parser.add_argument('--native-client', action='store_true',
+                        help='使用进程内的 Kubernetes API 客户端查询和应用资源，不支持时回退到 kubectl')
     parser.add_argument('--output-format', choices=SUPPORTED_OUTPUT_FORMATS,
                         default='yaml', help='结构化输出格式')
     parser.add_argument('--fail-on', default='', type=str,
@@ -66,6 +91,10 @@ def add_release_chart_args(parser, chart_required=True):
         parser.add_argument('chart', nargs='?', type=str,
                             help='Chart local path or package')
 
+def add_snapshot_replay_option(parser):
+    parser.add_argument('--from-snapshot', dest='from_snapshot', type=str,
+                        help='使用 snapshot 命令生成的快照文件离线执行，不访问集群')
+
 def build_parser():
     with open(os.path.join(BASEDIR, DOC_FILE), 'r', encoding='utf-8') as doc_file:
         doc_content = doc_file.read()
@@ -87,31 +116,52 @@ def build_parser():
         'state-check',
         help='检查 Helm release 记录、集群运行态和当前 chart 之间的一致性')
     add_common_options(state_check_parser)
+    add_snapshot_replay_option(state_check_parser)
+    state_check_parser.add_argument('--spill-to-disk', action='store_true',
+                                    help='把 Release 记录、运行时对象和渲染结果写入本地 SQLite 文件后流式比较，'
+                                         '用于超大 Release 控制内存占用')
     add_release_chart_args(state_check_parser, chart_required=False)
 
     adopt_plan_parser = subparsers.add_parser(
         'adopt-plan',
         help='分析 chart 渲染资源和集群已有资源的接管关系')
     add_common_options(adopt_plan_parser)
-    add_release_chart_args(adopt_plan_parser)
+    add_snapshot_replay_option(adopt_plan_parser)
+    add_release_chart_args(adopt_plan_parser, chart_required=False)
 
     plan_parser = subparsers.add_parser(
         'plan',
         help='生成升级计划')
     add_common_options(plan_parser)
-    add_release_chart_args(plan_parser)
+    add_snapshot_replay_option(plan_parser)
+    plan_parser.add_argument('--out', dest='plan_out', type=str,
+                             help='保存计划文件，供 apply --plan 直接执行')
+    add_release_chart_args(plan_parser, chart_required=False)
 
     apply_parser = subparsers.add_parser(
         'apply',
         help='根据 chart 渲染结果应用资源')
     add_common_options(apply_parser)
-    add_release_chart_args(apply_parser)
+    apply_parser.add_argument('--only-changed', action='store_true',
+                              help='先生成升级计划，只应用需要创建、更新或接管的资源')
+    apply_parser.add_argument('--plan', dest='plan_path', type=str,
+                              help='执行 plan --out 保存的计划文件，不重新渲染 chart')
+    add_release_chart_args(apply_parser, chart_required=False)
 
     comparison_parser = subparsers.add_parser(
         'generate-comparison-file',
         help='生成集群当前配置与 chart 配置的对比文件')
     add_common_options(comparison_parser)
-    add_release_chart_args(comparison_parser)
+    add_snapshot_replay_option(comparison_parser)
+    add_release_chart_args(comparison_parser, chart_required=False)
+
+    snapshot_parser = subparsers.add_parser(
+        'snapshot',
+        help='采集 Release 记录、chart 渲染结果和集群运行时对象，生成离线快照文件')
+    add_common_options(snapshot_parser)
+    snapshot_parser.add_argument('--out', type=str,
+                                 help='快照文件路径，默认为 <release>.snapshot.json.gz')
+    add_release_chart_args(snapshot_parser, chart_required=False)
 
     image_parser = subparsers.add_parser(
         'update-values-image-version',
@@ -129,6 +179,15 @@ def build_parser():
         'rolling-update-pod-labels',
         help='滚动更新 Pod 标签')
     add_common_options(labels_parser)
+    labels_parser.add_argument('--max-concurrent-rollouts', type=positive_int,
+                               default=DEFAULT_MAX_CONCURRENT_ROLLOUTS,
+                               help='同时进行滚动更新的 Deployment 数量上限')
+    labels_parser.add_argument('--max-rollouts-per-namespace', type=positive_int,
+                               help='同一 namespace 中同时进行滚动更新的 Deployment 数量上限')
+    labels_parser.add_argument('--max-failures', type=positive_int,
+                               help='失败数量达到该值后不再开始新的滚动更新')
+    labels_parser.add_argument('--journal', type=str,
+                               help='记录滚动更新进度的日志文件路径，用于中断后继续执行')
     add_release_chart_args(labels_parser)
 
     return parser
@@ -139,7 +198,16 @@ def configure_runtime_options(args):
         kubeconfig=getattr(args, 'kubeconfig', None),
         context=getattr(args, 'context', None),
         timeout=getattr(args, 'timeout', None))
+    os.environ['FINE_UPGRADE_NAMESPACE_OPTION'] = getattr(args, 'namespace', None) or ''
     os.environ['DRY_RUN_FLAG'] = '1' if getattr(args, 'dry_run', False) else '0'
+    os.environ['FINE_UPGRADE_NO_RENDER_CACHE'] = \
+        '1' if getattr(args, 'no_render_cache', False) else '0'
+    os.environ['FINE_UPGRADE_PARALLELISM'] = str(
+        getattr(args, 'parallelism', DEFAULT_FETCH_PARALLELISM))
+    os.environ['FINE_UPGRADE_ROLLOUT_TIMEOUT'] = str(
+        getattr(args, 'rollout_timeout', DEFAULT_ROLLOUT_TIMEOUT))
+    os.environ['FINE_UPGRADE_NATIVE_CLIENT'] = \
+        '1' if getattr(args, 'native_client', False) else '0'
     if getattr(args, 'debug', False):
         os.environ['HELM_DEBUG'] = '1'
 
@@ -168,8 +236,24 @@ def validate_safety_options(args, input_stream=None, output_stream=None):
     print("Cancelled. No changes were made.", file=output_stream)
     raise SystemExit(0)
 
+def validate_chart_option(args, output_stream=None):
+    if getattr(args, 'action', None) == 'apply':
+        if (args.chart is None) == (args.plan_path is None):
+            print("Command 'apply' requires either chart or --plan, but not both.",
+                  file=output_stream or sys.stderr)
+            raise SystemExit(USAGE_ERROR_EXIT_CODE)
+        return
+    if getattr(args, 'action', None) not in SNAPSHOT_CHART_OPTIONAL_ACTIONS or \
+            getattr(args, 'chart', None) is not None or \
+            getattr(args, 'from_snapshot', None):
+        return
+    print(f"Command '{args.action}' requires chart unless --from-snapshot is set.",
+          file=output_stream or sys.stderr)
+    raise SystemExit(USAGE_ERROR_EXIT_CODE)
+
 def dispatch(args):
     configure_runtime_options(args)
+    validate_chart_option(args)
     validate_safety_options(args)
     if args.action == 'show-default-config':
         print_default_config()
@@ -183,7 +267,9 @@ def dispatch(args):
              values=args.values,
              config_path=args.config,
              output_format=args.output_format,
-             fail_on=args.fail_on)
+             fail_on=args.fail_on,
+             snapshot_path=args.from_snapshot,
+             spill_to_disk=args.spill_to_disk)
     elif args.action == 'adopt-plan':
         from services.metadata_service import adopt_plan
         adopt_plan(chart_path=args.chart,
@@ -191,7 +277,8 @@ def dispatch(args):
              values=args.values,
              selector=args.selector,
              output_format=args.output_format,
-             fail_on=args.fail_on)
+             fail_on=args.fail_on,
+             snapshot_path=args.from_snapshot)
     elif args.action == 'plan':
         from services.helm_service import plan_upgrade
         plan_upgrade(chart_path=args.chart,
@@ -200,13 +287,23 @@ def dispatch(args):
              config_path=args.config,
              selector=args.selector,
              output_format=args.output_format,
-             fail_on=args.fail_on)
+             fail_on=args.fail_on,
+             snapshot_path=args.from_snapshot,
+             plan_out=args.plan_out)
+    elif args.action == 'apply' and args.plan_path is not None:
+        from services.helm_service import apply_plan
+        apply_plan(plan_path=args.plan_path,
+             release_name=args.release_name,
+             output_format=args.output_format)
     elif args.action == 'apply':
         from services.helm_service import apply_upgrade
         apply_upgrade(chart_path=args.chart,
              release_name=args.release_name,
              values=args.values,
-             selector=args.selector)
+             selector=args.selector,
+             config_path=args.config,
+             only_changed=args.only_changed,
+             output_format=args.output_format)
     elif args.action == 'generate-comparison-file':
         from services.helm_service import diff
         diff(chart_path=args.chart,
@@ -214,7 +311,14 @@ def dispatch(args):
              values=args.values,
              output_path=args.output,
              config_path=args.config,
-             selector=args.selector)
+             selector=args.selector,
+             snapshot_path=args.from_snapshot)
+    elif args.action == 'snapshot':
+        from services.snapshot_service import take_snapshot
+        take_snapshot(release_name=args.release_name,
+                      chart_path=args.chart,
+                      values=args.values,
+                      snapshot_path=args.out)
     elif args.action == 'update-values-image-version':
         from services.image_service import image_version_diff
         image_version_diff(chart_path=args.chart,
@@ -236,7 +340,11 @@ def dispatch(args):
                                release_name=args.release_name,
                                values=args.values,
                                selector=args.selector,
-                               dry_run=args.dry_run)
+                               dry_run=args.dry_run,
+                               max_concurrent_rollouts=args.max_concurrent_rollouts,
+                               max_rollouts_per_namespace=args.max_rollouts_per_namespace,
+                               max_failures=args.max_failures,
+                               journal_path=args.journal)
 
 if __name__ == '__main__':
     dispatch(build_parser().parse_args())
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import os
+import sqlite3
+import tempfile
+import zlib
+from typing import Iterable, Iterator, List
+from utils.json_utils import dumps_json, loads_json
+from utils.helm_utils import CLUSTER_SCOPED_KINDS, get_helm_namespace
+
+# 写入 SQLite 时每批插入的 manifest 数量
+SPILL_INSERT_BATCH_SIZE = 500
+
+
+class ManifestRecord:
+    """manifest 的元数据，唯一 key 等字段只在加入索引时计算一次"""
+
+    __slots__ = ('key', 'kind', 'namespace', 'name', 'labels', 'position', 'manifest')
+
+    def __init__(self, key: str, kind: str, namespace: str, name: str,
+                 labels: dict, position: int, manifest: dict):
+        self.key = key
+        self.kind = kind
+        self.namespace = namespace
+        self.name = name
+        self.labels = labels
+        self.position = position
+        self.manifest = manifest
+
+
+def get_service_selector(manifest: dict) -> dict:
+    return (manifest.get('spec') or {}).get('selector') or {}
+
+
+class ManifestIndex:
+    """按唯一 key 索引的 manifest 集合，每组 manifest 只建立一次，在各命令中传递使用
+
+    唯一 key 与 get_manifest_unique_key 一致，未声明 namespace 的对象使用建立索引时的
+    Release namespace。除按 key 查找外，还维护按 kind、namespace、metadata.labels 的
+    (key, value) 和 Service spec.selector 的 (key, value) 建立的倒排索引，索引中的
+    唯一 key 都按加入顺序排列；同一 key 重复加入时保留最早的位置和最后加入的 manifest。
+    """
+
+    def __init__(self, manifests: Iterable = (), helm_namespace: str = None):
+        self.helm_namespace = helm_namespace or get_helm_namespace()
+        self.records = {}
+        self.by_kind = {}
+        self.by_namespace = {}
+        self.by_label = {}
+        self.service_selectors = {}
+        # id(manifest) -> ManifestRecord，已加入索引的 manifest 不再重新计算 key
+        self._records_by_id = {}
+        self.extend(manifests)
+
+    @classmethod
+    def of(cls, manifests) -> 'ManifestIndex':
+        """已经是 ManifestIndex 时原样返回，否则建立索引"""
+        if isinstance(manifests, cls):
+            return manifests
+        return cls(manifests or ())
+
+    def get_namespace(self, manifest: dict) -> str:
+        metadata = manifest['metadata']
+        if 'namespace' in metadata:
+            return metadata['namespace']
+        if manifest['kind'] in CLUSTER_SCOPED_KINDS:
+            return ''
+        return self.helm_namespace
+
+    def record_of(self, manifest: dict) -> ManifestRecord:
+        """返回已加入索引的 manifest 的记录，不在索引中时返回 None"""
+        record = self._records_by_id.get(id(manifest))
+        if record is not None and record.manifest is manifest:
+            return record
+        return None
+
+    def key_of(self, manifest: dict) -> str:
+        """返回 manifest 的唯一 key，已加入索引的 manifest 直接使用记录中的 key"""
+        record = self.record_of(manifest)
+        if record is not None:
+            return record.key
+        return f'{manifest["kind"]}:{self.get_namespace(manifest)}:{manifest["metadata"]["name"]}'
+
+    def add(self, manifest: dict) -> ManifestRecord:
+        """加入一个 manifest，忽略 None，返回对应的记录
+
+        同一 key 重复加入时原地替换记录，各倒排索引中的 key 保持原来的位置。
+        """
+        if manifest is None:
+            return None
+        key = self.key_of(manifest)
+        previous = self.records.get(key)
+        record = ManifestRecord(
+            key, manifest['kind'], self.get_namespace(manifest), manifest['metadata']['name'],
+            manifest['metadata'].get('labels') or {},
+            previous.position if previous is not None else len(self.records), manifest)
+        # 已存在的 key 赋值时不改变其在 dict 中的顺序
+        self.records[key] = record
+        if previous is not None:
+            self._records_by_id.pop(id(previous.manifest), None)
+        self._records_by_id[id(manifest)] = record
+        # 用 dict 保存唯一 key，去重的同时保留加入顺序；kind 和 namespace 是 key 的一部分，不会变化
+        self.by_kind.setdefault(record.kind, {})[key] = None
+        self.by_namespace.setdefault(record.namespace, {})[key] = None
+        self._relink(self.by_label, previous.labels if previous is not None else {},
+                     record.labels, record)
+        if record.kind == 'Service':
+            self._relink(self.service_selectors,
+                         get_service_selector(previous.manifest) if previous is not None else {},
+                         get_service_selector(manifest), record)
+        return record
+
+    def extend(self, manifests: Iterable) -> None:
+        for manifest in manifests:
+            self.add(manifest)
+
+    def _relink(self, index: dict, previous_items: dict, items: dict,
+                record: ManifestRecord) -> None:
+        """把记录在 (key, value) 倒排索引中的条目从 previous_items 更新为 items"""
+        for item in previous_items.items():
+            if item not in items.items():
+                index[item].pop(record.key, None)
+        for item in items.items():
+            if item in previous_items.items():
+                continue
+            posting = index.setdefault(item, {})
+            if not posting or self.records[next(reversed(posting))].position < record.position:
+                posting[record.key] = None
+                continue
+            # 重复加入的记录获得了新的标签，按加入顺序插入到原来的位置
+            keys = sorted(list(posting) + [record.key], key=lambda key: self.records[key].position)
+            posting.clear()
+            posting.update(dict.fromkeys(keys))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return (record.manifest for record in self.records.values())
+
+    def keys(self):
+        return self.records.keys()
+
+    def get(self, key: str, default: dict = None) -> dict:
+        record = self.records.get(key)
+        return record.manifest if record is not None else default
+
+    def __getitem__(self, key: str) -> dict:
+        return self.records[key].manifest
+
+    def iter_sorted_records(self) -> Iterator[ManifestRecord]:
+        """按唯一 key 排序逐个返回记录，与 SqliteManifestStore 的顺序一致"""
+        for key in sorted(self.records):
+            yield self.records[key]
+
+    def of_kind(self, kind: str) -> List[dict]:
+        return [self.records[key].manifest for key in self.by_kind.get(kind, ())]
+
+    def in_namespace(self, namespace: str) -> List[dict]:
+        return [self.records[key].manifest for key in self.by_namespace.get(namespace, ())]
+
+    def select(self, selector_dict: dict) -> List[dict]:
+        """返回标签包含 selector_dict 全部键值的 manifest，未指定选择器时返回全部"""
+        if not selector_dict:
+            return list(self)
+        postings = sorted((self.by_label.get(item, {}) for item in selector_dict.items()), key=len)
+        return [self.records[key].manifest for key in postings[0]
+                if all(key in posting for posting in postings[1:])]
+
+    def find_services(self, pod_labels: dict) -> List[str]:
+        """返回 selector 全部键值都包含在 pod_labels 中的 Service 唯一 key
+
+        与 Kubernetes 一致，没有 selector 或 selector 为空的 Service 不选中任何 Pod。
+        """
+        matched_counts = {}
+        for item in (pod_labels or {}).items():
+            for key in self.service_selectors.get(item, ()):
+                matched_counts[key] = matched_counts.get(key, 0) + 1
+        return sorted((key for key, count in matched_counts.items()
+                       if count == len(self.records[key].manifest['spec']['selector'])),
+                      key=lambda key: self.records[key].position)
+
+
+def get_spill_dir() -> str:
+    """返回存放 SqliteManifestStore 临时文件的目录，未设置时使用系统临时目录"""
+    return os.environ.get('FINE_UPGRADE_SPILL_DIR') or None
+
+
+class SqliteManifestStore:
+    """保存在本地 SQLite 文件中的 manifest 集合，用于超大 Release 控制内存占用
+
+    唯一 key 与 ManifestIndex 一致，另按 (kind, namespace, name) 建立索引；manifest 以
+    zlib 压缩的 JSON 保存，读取时逐条解压，内存中不保留整组 manifest。同一 key 重复加入时
+    保留最后加入的 manifest。未指定 path 时在 FINE_UPGRADE_SPILL_DIR 或系统临时目录中
+    创建临时文件，close 时删除。
+    """
+
+    def __init__(self, manifests: Iterable = (), path: str = None, helm_namespace: str = None):
+        self.helm_namespace = helm_namespace or get_helm_namespace()
+        self.temporary = path is None
+        if self.temporary:
+            spill_dir = get_spill_dir()
+            if spill_dir is not None:
+                os.makedirs(spill_dir, exist_ok=True)
+            file_descriptor, path = tempfile.mkstemp(
+                prefix='helm-fine-upgrade-', suffix='.sqlite', dir=spill_dir)
+            os.close(file_descriptor)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # 只作为临时存储，不需要回滚日志和同步写盘
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS manifests ('
+            'key TEXT PRIMARY KEY, kind TEXT NOT NULL, namespace TEXT NOT NULL, '
+            'name TEXT NOT NULL, body BLOB NOT NULL)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS manifests_kind_namespace_name '
+            'ON manifests (kind, namespace, name)')
+        self.extend(manifests)
+
+    def __enter__(self) -> 'SqliteManifestStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.connection is None:
+            return
+        self.connection.close()
+        self.connection = None
+        if self.temporary:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def get_namespace(self, manifest: dict) -> str:
+        metadata = manifest['metadata']
+        if 'namespace' in metadata:
+            return metadata['namespace']
+        if manifest['kind'] in CLUSTER_SCOPED_KINDS:
+            return ''
+        return self.helm_namespace
+
+    def key_of(self, manifest: dict) -> str:
+        return f'{manifest["kind"]}:{self.get_namespace(manifest)}:{manifest["metadata"]["name"]}'
+
+    def _to_row(self, manifest: dict) -> tuple:
+        namespace = self.get_namespace(manifest)
+        name = manifest['metadata']['name']
+        body = zlib.compress(dumps_json(manifest).encode('utf-8'))
+        return f'{manifest["kind"]}:{namespace}:{name}', manifest['kind'], namespace, name, body
+
+    def extend(self, manifests: Iterable) -> None:
+        """分批写入 manifest，忽略 None；manifests 可以是生成器，写入过程中不保留已写入的 manifest"""
+        rows = []
+        for manifest in manifests:
+            if manifest is None:
+                continue
+            rows.append(self._to_row(manifest))
+            if len(rows) >= SPILL_INSERT_BATCH_SIZE:
+                self._insert(rows)
+                rows = []
+        if rows:
+            self._insert(rows)
+
+    def add(self, manifest: dict) -> None:
+        self.extend([manifest])
+
+    def _insert(self, rows: list) -> None:
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO manifests (key, kind, namespace, name, body) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+
+    @staticmethod
+    def _load(body: bytes) -> dict:
+        return loads_json(zlib.decompress(body))
+
+    def _to_record(self, row: tuple) -> ManifestRecord:
+        key, kind, namespace, name, body = row
+        manifest = self._load(body)
+        return ManifestRecord(key, kind, namespace, name,
+                              manifest['metadata'].get('labels') or {}, None, manifest)
+
+    def __contains__(self, key: str) -> bool:
+        return self.connection.execute(
+            'SELECT 1 FROM manifests WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM manifests').fetchone()[0]
+
+    def __iter__(self):
+        for (body,) in self.connection.execute('SELECT body FROM manifests ORDER BY key'):
+            yield self._load(body)
+
+    def keys(self) -> Iterator[str]:
+        for (key,) in self.connection.execute('SELECT key FROM manifests ORDER BY key'):
+            yield key
+
+    def get(self, key: str, default: dict = None) -> dict:
+        row = self.connection.execute(
+            'SELECT body FROM manifests WHERE key = ?', (key,)).fetchone()
+        return self._load(row[0]) if row is not None else default
+
+    def __getitem__(self, key: str) -> dict:
+        manifest = self.get(key)
+        if manifest is None:
+            raise KeyError(key)
+        return manifest
+
+    def iter_sorted_records(self) -> Iterator[ManifestRecord]:
+        """按唯一 key 排序逐个读取并解压记录"""
+        cursor = self.connection.execute(
+            'SELECT key, kind, namespace, name, body FROM manifests ORDER BY key')
+        for row in cursor:
+            yield self._to_record(row)
+
+    def of_kind(self, kind: str, namespace: str = None) -> Iterator[dict]:
+        """按 kind（以及 namespace）读取 manifest，使用 (kind, namespace, name) 索引"""
+        if namespace is None:
+            cursor = self.connection.execute(
+                'SELECT body FROM manifests WHERE kind = ? ORDER BY namespace, name', (kind,))
+        else:
+            cursor = self.connection.execute(
+                'SELECT body FROM manifests WHERE kind = ? AND namespace = ? ORDER BY name',
+                (kind, namespace))
+        for (body,) in cursor:
+            yield self._load(body)
+
+
+def as_manifest_store(manifests):
+    """ManifestIndex 和 SqliteManifestStore 原样返回，其它 manifest 集合建立 ManifestIndex"""
+    if isinstance(manifests, (ManifestIndex, SqliteManifestStore)):
+        return manifests
+    return ManifestIndex.of(manifests)
@@ -9,6 +9,8 @@ import sys
 from pathlib import Path
 
 from utils.output_utils import print_structured_output
+from utils.json_utils import JSON_BACKEND
+from utils.yaml_utils import YAML_BACKEND
 
 ROOT_DIR = Path(__file__).resolve().parents[2]
 
@@ -120,6 +122,8 @@ def build_doctor_report() -> dict:
             'arch': platform.machine().lower(),
             'python_version': platform.python_version(),
             'frozen': getattr(sys, 'frozen', False),
+            'yaml_backend': YAML_BACKEND,
+            'json_backend': JSON_BACKEND,
         },
         'dependencies': {
             'helm': _get_helm_version(),
@@ -1,31 +1,45 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
+import contextlib
 import sys
 import os
-import copy
-import yaml
-from utils.yaml_utils import init_yaml_representer
-from utils.shell_utils import run_cmd
-from utils.dict_utils import remove_ignore_fields, parse_selector
+import subprocess
+from utils.yaml_utils import (dump_all_yaml, init_yaml_representer,
+                              load_yaml)
+from utils.dict_utils import (compile_ignore_profiles, parse_selector,
+                              project_ignore_fields, resolve_ignore_matcher,
+                              values_equal_ignoring_fields)
 from utils.output_utils import (
+    FAILURE_EXIT_CODE,
     exit_if_fail_on_triggered,
     print_status,
     print_structured_output,
 )
 from utils.helm_utils import (
-    build_helm_template_cmd,
-    get_api_object_spec,
+    iter_helm_template_manifests,
+    render_helm_template_manifests,
+    get_api_object_specs,
+    get_manifest_lookup_ref,
     get_all_release_api_objects,
+    get_complete_release_api_objects,
     get_release_manifests,
-    manifests_list_to_dict,
-    get_manifest_namespace,
-    get_manifest_unique_key,
-    find_first_same_object_key_with_different_hash,
-    is_manifest_match_selector
+    iter_release_manifests,
+    HashSuffixKeyIndex
     )   
-from utils.manifest_utils import find_and_merge_related_rendered_manifests_of_deployments
-from utils.kube_ops_utils import apply_manifests
+from utils.manifest_utils import select_related_rendered_manifests
+from utils.kube_ops_utils import apply_manifests_in_waves
+from models.helm_model import (ManifestIndex, ManifestRecord, SqliteManifestStore,
+                               as_manifest_store)
+from services.plan_artifact_service import (APPLY_PLAN_STATUSES,
+                                            build_plan_artifact,
+                                            find_moved_resources,
+                                            get_plan_artifact_manifests,
+                                            load_plan_artifact,
+                                            write_plan_artifact)
+from services.snapshot_service import (build_snapshot_lookup,
+                                       get_snapshot_rendered_manifests,
+                                       load_snapshot)
 
 if getattr(sys, 'frozen', False):
     BASEDIR = sys._MEIPASS
@@ -58,38 +72,23 @@ def get_field_value(dictionary: dict, field_path: str):
         value = value[key]
     return value
 
-def render_chart_manifests(chart_path: str, release_name: str, values: str) -> list:
+def iter_rendered_chart_manifests(chart_path: str, release_name: str, values: str):
+    """边执行 helm template 边逐个产出 manifest，命令失败时抛出 CalledProcessError"""
     print_status('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    yield from iter_helm_template_manifests(release_name, chart_path, values)
+
+def render_chart_manifests(chart_path: str, release_name: str, values: str) -> list:
+    try:
+        return list(iter_rendered_chart_manifests(chart_path, release_name, values))
+    except subprocess.CalledProcessError:
         return None
-    return [manifest for manifest in yaml.safe_load_all(cmd_output)
-            if manifest is not None]
-
-def select_rendered_manifests(rendered_manifests: list, selector: str) -> list:
-    rendered_manifest_dict = {}
-    service_unique_keys = []
-    for rendered_manifest in rendered_manifests:
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        rendered_manifest_dict[manifest_unique_key] = rendered_manifest
-        if rendered_manifest.get('kind') == 'Service':
-            service_unique_keys.append(manifest_unique_key)
 
+def select_rendered_manifests(rendered_manifests, selector: str):
+    """按选择器过滤渲染结果；未指定选择器时原样返回，保持流式迭代"""
     selector_dict = parse_selector(selector)
-    if bool(selector_dict):
-        direct_selector_rendered_manifests = [
-            rendered_manifest for rendered_manifest in rendered_manifests
-            if is_manifest_match_selector(rendered_manifest, selector)
-        ]
-        return find_and_merge_related_rendered_manifests_of_deployments(
-            direct_selector_rendered_manifests, rendered_manifest_dict,
-            service_unique_keys)
-    return rendered_manifests
-
-def normalize_manifest_for_compare(manifest: dict, ignore_fields_config: dict) -> dict:
-    normalized_manifest = copy.deepcopy(manifest)
-    remove_ignore_fields(normalized_manifest, ignore_fields_config)
-    return normalized_manifest
+    if not bool(selector_dict):
+        return rendered_manifests
+    return select_related_rendered_manifests(list(rendered_manifests), selector_dict)
 
 def get_pod_spec(manifest: dict):
     """Return a Pod spec for a Pod or a workload template, if present."""
@@ -98,45 +97,80 @@ def get_pod_spec(manifest: dict):
         return spec
     return spec.get('template', {}).get('spec', {})
 
-def remove_implicit_runtime_defaults(rendered_manifest: dict,
-                                     runtime_manifest: dict) -> None:
-    """Remove API-server defaults only when the rendered manifest omitted them.
+def without_implicit_runtime_defaults(rendered_manifest: dict,
+                                      runtime_manifest: dict) -> dict:
+    """Drop API-server defaults only when the rendered manifest omitted them.
 
     These defaults are not user intent and otherwise make a fresh Helm release
     look drifted. Values explicitly rendered by the chart remain comparable.
+    Neither manifest is modified: only the dicts and lists on the path to a
+    dropped default are copied.
     """
     if rendered_manifest.get('kind') != runtime_manifest.get('kind'):
-        return
+        return runtime_manifest
 
+    result = runtime_manifest
     rendered_spec = rendered_manifest.get('spec', {})
     runtime_spec = runtime_manifest.get('spec', {})
     if (rendered_manifest.get('kind') == 'Service' and
             'type' not in rendered_spec and
             runtime_spec.get('type') == 'ClusterIP'):
-        runtime_spec.pop('type', None)
+        runtime_spec = dict(runtime_spec)
+        runtime_spec.pop('type')
+        result = dict(result)
+        result['spec'] = runtime_spec
 
     rendered_pod_spec = get_pod_spec(rendered_manifest)
-    runtime_pod_spec = get_pod_spec(runtime_manifest)
+    runtime_pod_spec = get_pod_spec(result)
+    patched_pod_spec = None
     for container_group in ('containers', 'initContainers'):
         rendered_containers = {
             container.get('name'): container
             for container in rendered_pod_spec.get(container_group, [])
             if container.get('name')
         }
-        for runtime_container in runtime_pod_spec.get(container_group, []):
+        runtime_containers = runtime_pod_spec.get(container_group, [])
+        patched_containers = None
+        for index, runtime_container in enumerate(runtime_containers):
             rendered_container = rendered_containers.get(
                 runtime_container.get('name'))
             if (rendered_container is not None and
                     'resources' not in rendered_container and
                     runtime_container.get('resources') == {}):
-                runtime_container.pop('resources', None)
+                if patched_containers is None:
+                    patched_containers = list(runtime_containers)
+                patched_container = dict(runtime_container)
+                patched_container.pop('resources')
+                patched_containers[index] = patched_container
+        if patched_containers is not None:
+            if patched_pod_spec is None:
+                patched_pod_spec = dict(runtime_pod_spec)
+            patched_pod_spec[container_group] = patched_containers
+
+    if patched_pod_spec is None:
+        return result
+    result = dict(result)
+    if result.get('kind') == 'Pod':
+        result['spec'] = patched_pod_spec
+        return result
+    spec = dict(result['spec'])
+    template = dict(spec['template'])
+    template['spec'] = patched_pod_spec
+    spec['template'] = template
+    result['spec'] = spec
+    return result
 
 def manifests_are_equal(left: dict, right: dict, ignore_fields_config: dict) -> bool:
-    normalized_left = normalize_manifest_for_compare(left, ignore_fields_config)
-    normalized_right = normalize_manifest_for_compare(right, ignore_fields_config)
-    remove_implicit_runtime_defaults(normalized_left, normalized_right)
-    return yaml.dump(normalized_left, allow_unicode=True, sort_keys=True) == \
-        yaml.dump(normalized_right, allow_unicode=True, sort_keys=True)
+    """Compare manifests structurally after dropping ignored fields.
+
+    Stops at the first difference and never copies or serializes either side.
+    ignore_fields_config may be the raw ignore tree, a compiled matcher or a
+    per-kind IgnoreProfileTable; callers comparing many manifests should
+    compile it once. Rules are chosen by the left manifest's kind.
+    """
+    return values_equal_ignoring_fields(
+        left, without_implicit_runtime_defaults(left, right),
+        resolve_ignore_matcher(ignore_fields_config, left))
 
 def detect_immutable_field_changes(rendered_manifest: dict,
                                    cluster_manifest: dict) -> list:
@@ -149,20 +183,27 @@ def detect_immutable_field_changes(rendered_manifest: dict,
             changes.append(field_path)
     return changes
 
-def build_upgrade_plan(rendered_manifests: list,
+def build_upgrade_plan(rendered_manifests,
                        cluster_manifests: list,
                        config: dict,
                        selector: str = '',
-                       lookup_manifest_func=get_api_object_spec) -> dict:
-    """Build a structured upgrade plan without changing cluster state."""
+                       lookup_manifests_func=get_api_object_specs) -> dict:
+    """Build a structured upgrade plan without changing cluster state.
+
+    rendered_manifests may be a stream: resources present in the cluster are
+    compared as they arrive. Resources missing from cluster_manifests are
+    looked up in one batch after the whole render has been read, and only
+    those still missing fall back to hash-suffix matching. cluster_manifests
+    may be a list or an already built ManifestIndex.
+    """
     selected_rendered_manifests = select_rendered_manifests(
         rendered_manifests, selector)
-    cluster_manifest_dict = manifests_list_to_dict(cluster_manifests)
-    selected_key_set = {get_manifest_unique_key(manifest)
-                        for manifest in selected_rendered_manifests}
+    cluster_index = ManifestIndex.of(cluster_manifests)
+    selected_key_set = set()
     matched_cluster_keys = set()
-    extra_manifest_key_set = set(cluster_manifest_dict.keys()) - selected_key_set
-    ignore_fields_config = config.get('ignore_fields', {})
+    pending_lookups = []
+    pending_hash_matches = []
+    ignore_fields_config = compile_ignore_profiles(config)
 
     plan = {
         'summary': {
@@ -176,60 +217,74 @@ def build_upgrade_plan(rendered_manifests: list,
         'resources': [],
     }
 
-    for rendered_manifest in selected_rendered_manifests:
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        status = 'create'
-        cluster_manifest = None
-        matched_cluster_key = None
-
-        if manifest_unique_key in cluster_manifest_dict:
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
-            matched_cluster_key = manifest_unique_key
-            status = 'unchanged' if manifests_are_equal(
-                rendered_manifest, cluster_manifest, ignore_fields_config) else 'update'
-        else:
-            cluster_manifest = lookup_manifest_func(
-                rendered_manifest['kind'],
-                rendered_manifest['metadata']['name'],
-                namespace=rendered_manifest['metadata'].get('namespace'))
-            if cluster_manifest is not None:
-                status = 'adopt'
-            else:
-                same_manifest_key = find_first_same_object_key_with_different_hash(
-                    extra_manifest_key_set, manifest_unique_key)
-                if same_manifest_key is not None:
-                    cluster_manifest = cluster_manifest_dict[same_manifest_key]
-                    matched_cluster_key = same_manifest_key
-                    status = 'update'
-
-        immutable_field_changes = []
-        if cluster_manifest is not None:
-            immutable_field_changes = detect_immutable_field_changes(
-                rendered_manifest, cluster_manifest)
-            if matched_cluster_key is not None:
-                matched_cluster_keys.add(matched_cluster_key)
-                extra_manifest_key_set.discard(matched_cluster_key)
-
+    def record_cluster_match(resource_plan: dict,
+                             rendered_manifest: dict,
+                             cluster_manifest: dict,
+                             matched_cluster_key: str) -> None:
+        immutable_field_changes = detect_immutable_field_changes(
+            rendered_manifest, cluster_manifest)
+        if matched_cluster_key is not None:
+            matched_cluster_keys.add(matched_cluster_key)
+            if matched_cluster_key != resource_plan['key']:
+                resource_plan['matched_runtime_key'] = matched_cluster_key
         if immutable_field_changes:
             plan['summary']['immutable_risk'] += 1
+            resource_plan['immutable_field_changes'] = immutable_field_changes
 
-        plan['summary'][status] += 1
+    for rendered_manifest in selected_rendered_manifests:
+        manifest_unique_key = cluster_index.key_of(rendered_manifest)
+        selected_key_set.add(manifest_unique_key)
         resource_plan = {
             'key': manifest_unique_key,
             'kind': rendered_manifest['kind'],
             'namespace': rendered_manifest['metadata'].get('namespace', ''),
             'name': rendered_manifest['metadata']['name'],
-            'status': status,
+            'status': 'create',
         }
-        if matched_cluster_key is not None and matched_cluster_key != manifest_unique_key:
-            resource_plan['matched_runtime_key'] = matched_cluster_key
-        if immutable_field_changes:
-            resource_plan['immutable_field_changes'] = immutable_field_changes
         plan['resources'].append(resource_plan)
 
+        if manifest_unique_key in cluster_index:
+            cluster_manifest = cluster_index[manifest_unique_key]
+            resource_plan['status'] = 'unchanged' if manifests_are_equal(
+                rendered_manifest, cluster_manifest, ignore_fields_config) else 'update'
+            record_cluster_match(resource_plan, rendered_manifest,
+                                 cluster_manifest, manifest_unique_key)
+        else:
+            pending_lookups.append((get_manifest_lookup_ref(rendered_manifest),
+                                    resource_plan, rendered_manifest))
+
+    looked_up_manifests = lookup_manifests_func(
+        [ref for ref, _, _ in pending_lookups]) if pending_lookups else {}
+    for ref, resource_plan, rendered_manifest in pending_lookups:
+        cluster_manifest = looked_up_manifests.get(ref)
+        if cluster_manifest is not None:
+            resource_plan['status'] = 'adopt'
+            record_cluster_match(resource_plan, rendered_manifest,
+                                 cluster_manifest, None)
+        else:
+            pending_hash_matches.append((resource_plan, rendered_manifest))
+
+    # 集群中 Release 接管的，但又不在当前渲染结果中的对象，可能只是尾部 hash 不同
+    extra_manifest_key_set = set(cluster_index.keys()) - selected_key_set
+    hash_suffix_index = HashSuffixKeyIndex(
+        sorted(extra_manifest_key_set) if pending_hash_matches else ())
+    for resource_plan, rendered_manifest in pending_hash_matches:
+        same_manifest_key = hash_suffix_index.find(resource_plan['key'])
+        if same_manifest_key is None:
+            continue
+        resource_plan['status'] = 'update'
+        record_cluster_match(resource_plan, rendered_manifest,
+                             cluster_index[same_manifest_key],
+                             same_manifest_key)
+        extra_manifest_key_set.discard(same_manifest_key)
+        hash_suffix_index.discard(same_manifest_key)
+
+    for resource_plan in plan['resources']:
+        plan['summary'][resource_plan['status']] += 1
+
     if not bool(parse_selector(selector)):
         for manifest_unique_key in sorted(extra_manifest_key_set - matched_cluster_keys):
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
+            cluster_manifest = cluster_index[manifest_unique_key]
             plan['summary']['orphan'] += 1
             plan['resources'].append({
                 'key': manifest_unique_key,
@@ -241,31 +296,92 @@ def build_upgrade_plan(rendered_manifests: list,
 
     return plan
 
+def record_fetch_failures(report: dict, failures: list) -> None:
+    """Record runtime fetch failures so a partial snapshot is visible in reports."""
+    report['summary']['fetch_failed'] = len(failures)
+    if failures:
+        report['fetch_failures'] = failures
+
+def record_manifests(manifests, recorded_manifests: list):
+    """遍历 manifests 的同时把每个 manifest 存入 recorded_manifests"""
+    for manifest in manifests:
+        recorded_manifests.append(manifest)
+        yield manifest
+
+def record_lookups(lookup_manifests_func, recorded_manifests: dict):
+    """包装批量查找函数，把查找到的对象存入 recorded_manifests"""
+    def lookup_manifests(refs) -> dict:
+        manifests = lookup_manifests_func(refs)
+        recorded_manifests.update(manifests)
+        return manifests
+    return lookup_manifests
+
 def plan_upgrade(chart_path: str,
                  release_name: str,
                  values: str,
                  config_path: str,
                  selector: str,
                  output_format: str = 'yaml',
-                 fail_on: str = '') -> None:
+                 fail_on: str = '',
+                 snapshot_path: str = None,
+                 plan_out: str = None) -> None:
+    """生成升级计划
+
+    Args:
+        plan_out (str): 计划文件路径，指定时同时保存需要应用的渲染结果和对象的 resourceVersion，
+            供 apply --plan 直接执行
+    """
     with open(config_path, 'r', encoding='utf-8') as config_file:
-        config = yaml.safe_load(config_file)
+        config = load_yaml(config_file)
 
-    rendered_manifests = render_chart_manifests(chart_path, release_name, values)
-    if rendered_manifests is None:
+    lookup_manifests_func = get_api_object_specs
+    if snapshot_path is not None:
+        snapshot = load_snapshot(snapshot_path, release_name)
+        if snapshot is None:
+            return
+        fetch_failures = list(snapshot['fetch_failures'])
+        cluster_manifests = snapshot['runtime_manifests']
+        lookup_manifests_func = build_snapshot_lookup(snapshot)
+        if chart_path is None:
+            rendered_manifests = get_snapshot_rendered_manifests(snapshot)
+            if rendered_manifests is None:
+                return
+    else:
+        fetch_failures = []
+    if chart_path is not None:
+        rendered_manifests = render_chart_manifests(chart_path, release_name, values)
+        if rendered_manifests is None:
+            return
+    if snapshot_path is None:
+        # 按渲染结果和 Release 记录共同规划查询范围，渲染结果中新增的 kind 和 namespace 也会查询
+        cluster_manifests = get_all_release_api_objects(
+            release_name, rendered_manifests, failures=fetch_failures)
+    if plan_out is not None:
+        planned_manifests = []
+        looked_up_manifests = {}
+        rendered_manifests = record_manifests(rendered_manifests, planned_manifests)
+        lookup_manifests_func = record_lookups(lookup_manifests_func, looked_up_manifests)
+    try:
+        plan = build_upgrade_plan(
+            rendered_manifests, cluster_manifests, config, selector=selector,
+            lookup_manifests_func=lookup_manifests_func)
+    except subprocess.CalledProcessError:
         return
-    cluster_manifests = get_all_release_api_objects(release_name)
-    plan = build_upgrade_plan(rendered_manifests, cluster_manifests, config,
-                              selector=selector)
+    record_fetch_failures(plan, fetch_failures)
+    if plan_out is not None:
+        write_plan_artifact(build_plan_artifact(
+            release_name, plan, planned_manifests, cluster_manifests, looked_up_manifests),
+            plan_out)
+        print_status(f'生成计划文件: {plan_out}')
     print_structured_output(plan, output_format)
     exit_if_fail_on_triggered(plan, fail_on)
 
-def manifest_info(manifest: dict, status: str) -> dict:
+def manifest_info(record: ManifestRecord, status: str) -> dict:
     return {
-        'key': get_manifest_unique_key(manifest),
-        'kind': manifest['kind'],
-        'namespace': get_manifest_namespace(manifest),
-        'name': manifest['metadata']['name'],
+        'key': record.key,
+        'kind': record.kind,
+        'namespace': record.namespace,
+        'name': record.name,
         'status': status,
     }
 
@@ -274,35 +390,37 @@ def compare_manifest_sets(left_manifests: list,
                           left_label: str,
                           right_label: str,
                           ignore_fields_config: dict) -> dict:
-    left_manifest_dict = manifests_list_to_dict(left_manifests)
-    right_manifest_dict = manifests_list_to_dict(right_manifests)
-    left_keys = set(left_manifest_dict.keys())
-    right_keys = set(right_manifest_dict.keys())
-    common_keys = left_keys & right_keys
+    """按唯一 key 的顺序同时遍历两组 manifest 并逐个比较
+
+    left_manifests 和 right_manifests 可以是 list、ManifestIndex 或 SqliteManifestStore；
+    两边都按 key 排序流式读取，使用 SqliteManifestStore 时内存中只保留正在比较的两个对象。
+    """
+    left_records = as_manifest_store(left_manifests).iter_sorted_records()
+    right_records = as_manifest_store(right_manifests).iter_sorted_records()
+    left_record = next(left_records, None)
+    right_record = next(right_records, None)
 
     missing_from_right = []
     extra_in_right = []
     changed = []
 
-    for key in sorted(left_keys - right_keys):
-        missing_from_right.append(manifest_info(
-            left_manifest_dict[key], f'missing_from_{right_label}'))
-
-    for key in sorted(right_keys - left_keys):
-        extra_in_right.append(manifest_info(
-            right_manifest_dict[key], f'extra_in_{right_label}'))
-
-    for key in sorted(common_keys):
-        if not manifests_are_equal(left_manifest_dict[key],
-                                   right_manifest_dict[key],
-                                   ignore_fields_config):
-            changed.append({
-                'key': key,
-                'kind': left_manifest_dict[key]['kind'],
-                'namespace': get_manifest_namespace(left_manifest_dict[key]),
-                'name': left_manifest_dict[key]['metadata']['name'],
-                'status': f'{left_label}_{right_label}_drift',
-            })
+    while left_record is not None or right_record is not None:
+        if right_record is None or (left_record is not None and left_record.key < right_record.key):
+            missing_from_right.append(manifest_info(
+                left_record, f'missing_from_{right_label}'))
+            left_record = next(left_records, None)
+        elif left_record is None or right_record.key < left_record.key:
+            extra_in_right.append(manifest_info(
+                right_record, f'extra_in_{right_label}'))
+            right_record = next(right_records, None)
+        else:
+            if not manifests_are_equal(left_record.manifest,
+                                       right_record.manifest,
+                                       ignore_fields_config):
+                changed.append(manifest_info(
+                    left_record, f'{left_label}_{right_label}_drift'))
+            left_record = next(left_records, None)
+            right_record = next(right_records, None)
 
     return {
         f'missing_from_{right_label}': missing_from_right,
@@ -314,7 +432,7 @@ def build_state_check(release_manifests: list,
                       runtime_manifests: list,
                       chart_manifests: list,
                       config: dict) -> dict:
-    ignore_fields_config = config.get('ignore_fields', {})
+    ignore_fields_config = compile_ignore_profiles(config)
     runtime_consistency = compare_manifest_sets(
         release_manifests, runtime_manifests, 'release', 'runtime',
         ignore_fields_config)
@@ -352,22 +470,91 @@ def state_check(release_name: str,
                 values: str,
                 config_path: str,
                 output_format: str = 'yaml',
-                fail_on: str = '') -> None:
-    with open(config_path, 'r', encoding='utf-8') as config_file:
-        config = yaml.safe_load(config_file)
+                fail_on: str = '',
+                snapshot_path: str = None,
+                spill_to_disk: bool = False) -> None:
+    """检查 Release 记录、集群运行时对象和 chart 渲染结果之间的一致性
 
-    release_manifests = get_release_manifests(release_name)
-    if release_manifests is None:
+    Args:
+        spill_to_disk (bool): 把三组 manifest 分别写入本地 SQLite 文件后流式比较，
+            用于超大 Release 控制内存占用；使用快照时不生效
+    """
+    with open(config_path, 'r', encoding='utf-8') as config_file:
+        config = load_yaml(config_file)
+
+    if spill_to_disk and snapshot_path is None:
+        with contextlib.ExitStack() as spill_stores:
+            manifest_sets = spill_state_check_manifests(
+                release_name, chart_path, values, spill_stores)
+            if manifest_sets is None:
+                return
+            report_state_check(manifest_sets, config, output_format, fail_on)
         return
-    runtime_manifests = get_all_release_api_objects(release_name)
+
     chart_manifests = None
+    if snapshot_path is not None:
+        snapshot = load_snapshot(snapshot_path, release_name)
+        if snapshot is None:
+            return
+        release_manifests = snapshot['release_manifests']
+        if release_manifests is None:
+            print_status(f'快照中没有 Release {release_name} 的记录')
+            return
+        fetch_failures = list(snapshot['fetch_failures'])
+        runtime_manifests = snapshot['runtime_manifests']
+        chart_manifests = snapshot['rendered_manifests']
+    else:
+        release_manifests = get_release_manifests(release_name)
+        if release_manifests is None:
+            return
     if chart_path is not None:
         chart_manifests = render_chart_manifests(chart_path, release_name, values)
         if chart_manifests is None:
             return
+    if snapshot_path is None:
+        fetch_failures = []
+        runtime_manifests = get_all_release_api_objects(
+            release_name, chart_manifests if chart_path is not None else None,
+            release_manifests=release_manifests, failures=fetch_failures)
+
+    report_state_check((release_manifests, runtime_manifests, chart_manifests, fetch_failures),
+                       config, output_format, fail_on)
+
+def spill_state_check_manifests(release_name: str,
+                                chart_path: str,
+                                values: str,
+                                spill_stores: contextlib.ExitStack) -> tuple:
+    """把 Release 记录、集群运行时对象和 chart 渲染结果依次写入 SqliteManifestStore
+
+    Release 记录和渲染结果边读取边写入；运行时对象按两者规划查询范围，在全部查询完成后
+    写入，写入后即可释放，同一时刻内存中最多只有一组完整的 manifest。
+
+    Returns:
+        tuple: (release, runtime, chart, fetch_failures)，未指定 chart 时 chart 为 None；
+            命令执行失败时返回 None
+    """
+    release_store = spill_stores.enter_context(SqliteManifestStore())
+    try:
+        release_store.extend(iter_release_manifests(release_name))
+    except subprocess.CalledProcessError:
+        return None
+    chart_store = None
+    if chart_path is not None:
+        chart_store = spill_stores.enter_context(SqliteManifestStore())
+        try:
+            chart_store.extend(iter_rendered_chart_manifests(chart_path, release_name, values))
+        except subprocess.CalledProcessError:
+            return None
+    fetch_failures = []
+    runtime_store = spill_stores.enter_context(SqliteManifestStore(get_all_release_api_objects(
+        release_name, chart_store, release_manifests=release_store, failures=fetch_failures)))
+    return release_store, runtime_store, chart_store, fetch_failures
 
+def report_state_check(manifest_sets: tuple, config: dict, output_format: str, fail_on: str) -> None:
+    release_manifests, runtime_manifests, chart_manifests, fetch_failures = manifest_sets
     result = build_state_check(release_manifests, runtime_manifests,
                                chart_manifests, config)
+    record_fetch_failures(result, fetch_failures)
     print_structured_output(result, output_format)
     exit_if_fail_on_triggered(result, fail_on)
 
@@ -376,137 +563,232 @@ def diff(chart_path: str,
          values: str,
          output_path: str,
          config_path: str,
-         selector: str) -> None:
+         selector: str,
+         snapshot_path: str = None) -> None:
     """根据 helm template 生成的 yaml 文件，拉取集群对象配置，并过滤掉无关字段，生成易于对比的 yaml 文件
 
     Args:
-        chart_path (str): Chart 路径
+        chart_path (str): Chart 路径，使用快照时可以为 None，表示使用快照中的渲染结果
         release_name (str): Release name
         values (str): values.yaml 文件路径
         output_path (str): 输出内容目录路径
         config_path (str): 自定义配置文件路径
+        snapshot_path (str): 快照文件路径，指定时不访问集群
     """
 
     with open(config_path, 'r', encoding='utf-8') as config_file:
-        config = yaml.safe_load(config_file)
+        config = load_yaml(config_file)
 
-    print('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    snapshot = None
+    if snapshot_path is not None:
+        snapshot = load_snapshot(snapshot_path, release_name)
+        if snapshot is None:
+            return
+    if chart_path is not None:
+        print('执行 helm template 命令...')
+        rendered_original_manifests_generator = render_helm_template_manifests(
+            release_name, chart_path, values)
+    else:
+        rendered_original_manifests_generator = get_snapshot_rendered_manifests(snapshot)
+    if rendered_original_manifests_generator is None:
         return
-    rendered_original_manifests_generator = yaml.safe_load_all(cmd_output)
     # 提取所有 Release 接管的集群中的 manifest
-    cluster_original_manifests = get_all_release_api_objects(release_name)
-    cluster_manifest_dict = manifests_list_to_dict(cluster_original_manifests)
-    rendered_original_manifests = []
-    manifest_key_set = set() # 与 release 中 manifest 匹配的 cluster 中的 manifest key
-    rendered_manifest_dict = {}
-    service_unique_keys = []
-    for rendered_manifest in rendered_original_manifests_generator:
-        if rendered_manifest is None:
-            continue
-        rendered_original_manifests.append(rendered_manifest) # 第一次遍历生成器时，把 manifest 另外存入 list
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        rendered_manifest_dict[manifest_unique_key] = rendered_manifest # 将 rendered_original_manifest 转成字典
-        if manifest_unique_key in cluster_manifest_dict:
-            manifest_key_set.add(manifest_unique_key)
-        if rendered_manifest.get('kind') == 'Service':
-            service_unique_keys.append(manifest_unique_key)
+    if snapshot is not None:
+        fetch_failures = list(snapshot['fetch_failures'])
+        cluster_original_manifests = snapshot['runtime_manifests']
+        lookup_manifests_func = build_snapshot_lookup(snapshot)
+    else:
+        fetch_failures = []
+        cluster_original_manifests = get_all_release_api_objects(
+            release_name, rendered_original_manifests_generator, failures=fetch_failures)
+        lookup_manifests_func = get_api_object_specs
+    cluster_index = ManifestIndex(cluster_original_manifests)
+    # 第一次遍历生成器时建立渲染结果的索引，每个 manifest 的唯一 key 只计算一次
+    rendered_index = ManifestIndex(rendered_original_manifests_generator,
+                                   helm_namespace=cluster_index.helm_namespace)
 
     # 集群中 Release 接管的，但又不在当前 release 中的对象 manifest key
-    extra_manifest_key_set = set(cluster_manifest_dict.keys()) - manifest_key_set
-    # print(extra_manifest_key_set)
+    extra_manifest_key_set = set(cluster_index.keys()) - set(rendered_index.keys())
+    hash_suffix_index = HashSuffixKeyIndex(sorted(extra_manifest_key_set))
 
     selector_dict = parse_selector(selector)
     if bool(selector_dict):
-        direct_selector_rendered_manifests = [rendered_manifest for rendered_manifest in rendered_original_manifests if is_manifest_match_selector(rendered_manifest, selector)]
-        selector_rendered_manifests = find_and_merge_related_rendered_manifests_of_deployments(direct_selector_rendered_manifests, rendered_manifest_dict, service_unique_keys)
+        selector_rendered_manifests = select_related_rendered_manifests(rendered_index, selector_dict)
     else:
-        selector_rendered_manifests = rendered_original_manifests
+        selector_rendered_manifests = list(rendered_index)
 
     print('开始逐一对比API对象配置...')
+    ignore_profiles = compile_ignore_profiles(config)
+    looked_up_manifests = lookup_manifests_func([
+        get_manifest_lookup_ref(rendered_manifest)
+        for rendered_manifest in selector_rendered_manifests
+        if rendered_index.key_of(rendered_manifest) not in cluster_index])
     cluster_manifests = []
     rendered_manifests = []
     for rendered_manifest in selector_rendered_manifests:
-        # 过滤掉影响对比的字段
-        remove_ignore_fields(rendered_manifest, config['ignore_fields'])
-        rendered_manifests.append(rendered_manifest)
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
+        # 过滤掉影响对比的字段，不修改原对象
+        rendered_manifests.append(project_ignore_fields(
+            rendered_manifest, ignore_profiles.for_manifest(rendered_manifest)))
+        manifest_unique_key = rendered_index.key_of(rendered_manifest)
         # 寻找与 release manifest 匹配的集群中的 manifest
-        if manifest_unique_key in cluster_manifest_dict:
+        if manifest_unique_key in cluster_index:
             # 完全匹配的 manifest
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
+            cluster_manifest = cluster_index[manifest_unique_key]
         else:
-            # 到集群中直接查找
-            cluster_manifest = get_api_object_spec(rendered_manifest['kind'], rendered_manifest['metadata']['name'],
-                                        namespace=rendered_manifest['metadata']['namespace'] if 'namespace' in rendered_manifest['metadata'] else None)
+            # 使用到集群中批量查找的结果
+            cluster_manifest = looked_up_manifests.get(get_manifest_lookup_ref(rendered_manifest))
             if cluster_manifest is None:
                 # 从 extra_manifest_key_set 中查找仅尾部 hash 不同的对象
-                same_manifest_key = find_first_same_object_key_with_different_hash(extra_manifest_key_set, manifest_unique_key)
+                same_manifest_key = hash_suffix_index.find(manifest_unique_key)
                 if same_manifest_key is None:
                     continue
                 extra_manifest_key_set.remove(same_manifest_key)
-                cluster_manifest = cluster_manifest_dict[same_manifest_key]
+                hash_suffix_index.discard(same_manifest_key)
+                cluster_manifest = cluster_index[same_manifest_key]
         # 过滤掉影响对比的字段
-        remove_ignore_fields(cluster_manifest, config['ignore_fields'])
-        cluster_manifests.append(cluster_manifest)
+        cluster_manifests.append(project_ignore_fields(
+            cluster_manifest, ignore_profiles.for_manifest(cluster_manifest)))
 
     # 未使用选择器时，将集群中额外的 manifest 放到最后面
     if not bool(selector_dict):
         # 把剩下的 extra_manifest_key_set 中没有匹配到的对象放到末尾
         for manifest_unique_key in extra_manifest_key_set:
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
-            remove_ignore_fields(cluster_manifest, config['ignore_fields'])
-            cluster_manifests.append(cluster_manifest)
+            cluster_manifest = cluster_index[manifest_unique_key]
+            cluster_manifests.append(project_ignore_fields(
+                cluster_manifest, ignore_profiles.for_manifest(cluster_manifest)))
 
     os.makedirs(output_path, exist_ok=True)
     with open(os.path.join(output_path, RENDERED_MANIFESTS_FILENAME), 'w', encoding='utf-8') as outfile:
-        yaml.dump_all(rendered_manifests, outfile, allow_unicode=True)
+        dump_all_yaml(rendered_manifests, outfile, allow_unicode=True)
     print(f'生成文件: {os.path.join(output_path, RENDERED_MANIFESTS_FILENAME)}.')
     with open(os.path.join(output_path, RUNTIME_MANIFESTS_FILENAME), 'w', encoding='utf-8') as outfile:
-        yaml.dump_all(cluster_manifests, outfile, allow_unicode=True)
+        dump_all_yaml(cluster_manifests, outfile, allow_unicode=True)
     print(f'生成文件: {os.path.join(output_path, RUNTIME_MANIFESTS_FILENAME)}.')
+    if fetch_failures:
+        print_status(f'警告: {len(fetch_failures)} 项运行时对象查询失败，'
+                     f'{RUNTIME_MANIFESTS_FILENAME} 可能不完整')
+
+def select_changed_manifests(manifests: list, plan: dict,
+                             manifest_index: ManifestIndex = None) -> tuple:
+    """按升级计划挑出需要应用的 manifest
+
+    Args:
+        manifest_index (ManifestIndex): manifests 所属的渲染结果索引，传入时直接使用其中的唯一 key
+
+    Returns:
+        tuple: (状态为 create/update/adopt 的 manifest 列表, 跳过的资源计划列表)
+    """
+    statuses = {resource['key']: resource for resource in plan['resources']
+                if resource['status'] != 'orphan'}
+    if manifest_index is None:
+        manifest_index = ManifestIndex()
+    changed_manifests = []
+    skipped_resources = []
+    for manifest in manifests:
+        resource = statuses[manifest_index.key_of(manifest)]
+        if resource['status'] in APPLY_PLAN_STATUSES:
+            changed_manifests.append(manifest)
+        else:
+            skipped_resources.append(resource)
+    return changed_manifests, skipped_resources
+
+def report_skipped_resources(skipped_resources: list) -> None:
+    if not skipped_resources:
+        return
+    kind_counts = {}
+    for resource in skipped_resources:
+        kind_counts[resource['kind']] = kind_counts.get(resource['kind'], 0) + 1
+    details = ', '.join(f'{kind} {count}' for kind, count in sorted(kind_counts.items()))
+    print_status(f'跳过 {len(skipped_resources)} 个未变化的资源: {details}')
+    if os.environ.get('HELM_DEBUG', '0') == '1':
+        for resource in skipped_resources:
+            print_status(f'  unchanged: {resource["key"]}')
+
+def apply_manifests_and_report(manifests: list, output_format: str = 'yaml') -> None:
+    """分批应用 manifest 并输出每一批的耗时，有批次失败时以非 0 状态退出"""
+    report = apply_manifests_in_waves(manifests)
+    print_structured_output(report, output_format)
+    if report['summary']['failed']:
+        raise SystemExit(FAILURE_EXIT_CODE)
 
 def apply_upgrade(chart_path: str,
          release_name: str,
          values: str,
-         selector: str) -> None:
+         selector: str,
+         config_path: str = None,
+         only_changed: bool = False,
+         output_format: str = 'yaml') -> None:
     """使用 kubectl apply 更新关联的 manifest
 
     Args:
         chart_path (str): Chart 路径
         release_name (str): Release name
         values (str): values.yaml 文件路径
-        output_path (str): 输出内容目录路径
-        config_path (str): 自定义配置文件路径
+        selector (str): 标签选择器
+        config_path (str): 自定义配置文件路径，only_changed 为 True 时用于比对
+        only_changed (bool): 先生成升级计划，只应用 create、update、adopt 的资源
+        output_format (str): 应用报告的输出格式
     """
 
     print('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    rendered_original_manifests_generator = render_helm_template_manifests(
+        release_name, chart_path, values)
+    if rendered_original_manifests_generator is None:
         return
-    rendered_original_manifests_generator = yaml.safe_load_all(cmd_output)
-    rendered_original_manifests = []
-    rendered_manifest_dict = {}
-    service_unique_keys = []
-    for rendered_manifest in rendered_original_manifests_generator:
-        if rendered_manifest is None:
-            continue
-        rendered_original_manifests.append(rendered_manifest) # 第一次遍历生成器时，把 manifest 另外存入 list
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        rendered_manifest_dict[manifest_unique_key] = rendered_manifest # 将 rendered_original_manifest 转成字典
-        if rendered_manifest.get('kind') == 'Service':
-            service_unique_keys.append(manifest_unique_key)
+    rendered_index = ManifestIndex(rendered_original_manifests_generator)
 
     selector_dict = parse_selector(selector)
     if bool(selector_dict):
-        direct_selector_rendered_manifests = [rendered_manifest for rendered_manifest in rendered_original_manifests if is_manifest_match_selector(rendered_manifest, selector)]
-        selector_rendered_manifests = find_and_merge_related_rendered_manifests_of_deployments(direct_selector_rendered_manifests, rendered_manifest_dict, service_unique_keys)
+        selector_rendered_manifests = select_related_rendered_manifests(rendered_index, selector_dict)
     else:
-        selector_rendered_manifests = rendered_original_manifests
+        selector_rendered_manifests = list(rendered_index)
+
+    if only_changed:
+        with open(config_path, 'r', encoding='utf-8') as config_file:
+            config = load_yaml(config_file)
+        print_status('生成升级计划...')
+        cluster_manifests = get_complete_release_api_objects(
+            release_name, list(rendered_index))
+        plan = build_upgrade_plan(selector_rendered_manifests, cluster_manifests, config,
+                                  lookup_manifests_func=get_api_object_specs)
+        selector_rendered_manifests, skipped_resources = select_changed_manifests(
+            selector_rendered_manifests, plan, rendered_index)
+        report_skipped_resources(skipped_resources)
+        if not selector_rendered_manifests:
+            print('没有需要应用的资源.')
+            return
+
+    if os.environ.get('DRY_RUN_FLAG', '0') == '1':
+        print('Manifests will apply:')
+        print(dump_all_yaml(selector_rendered_manifests, allow_unicode=True))
+    else:
+        apply_manifests_and_report(selector_rendered_manifests, output_format)
+
+def apply_plan(plan_path: str, release_name: str, output_format: str = 'yaml') -> None:
+    """执行 plan --out 保存的升级计划，不重新渲染 chart，也不获取 Release 的全部运行时对象
+
+    应用前按 kind 和 namespace 批量检查目标对象，生成计划后有对象的 resourceVersion 变化时
+    不应用任何资源并以非 0 状态退出。
+    """
+    artifact = load_plan_artifact(plan_path, release_name)
+    if artifact is None:
+        raise SystemExit(FAILURE_EXIT_CODE)
+    manifests = get_plan_artifact_manifests(artifact)
+    if not manifests:
+        print('没有需要应用的资源.')
+        return
+
+    print_status(f'检查计划中 {len(manifests)} 个资源的 resourceVersion...')
+    moved_resources = find_moved_resources(artifact, lookup_manifests_func=get_api_object_specs)
+    if moved_resources:
+        print_status(f'生成计划后有 {len(moved_resources)} 个资源发生变化，请重新执行 plan:')
+        for resource in moved_resources:
+            print_status(f'  {resource["key"]}: resourceVersion '
+                         f'{resource["planned"] or "-"} -> {resource["current"] or "-"}')
+        raise SystemExit(FAILURE_EXIT_CODE)
 
     if os.environ.get('DRY_RUN_FLAG', '0') == '1':
         print('Manifests will apply:')
-        print(yaml.dump_all(selector_rendered_manifests, allow_unicode=True))
+        print(dump_all_yaml(manifests, allow_unicode=True))
     else:
-        apply_manifests(selector_rendered_manifests)
+        apply_manifests_and_report(manifests, output_format)
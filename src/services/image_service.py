@@ -1,15 +1,14 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
-import yaml
 from ruamel.yaml import YAML
-from utils.shell_utils import run_cmd
+from utils.yaml_utils import load_yaml
 from utils.dict_utils import set_value
 from utils.output_utils import print_status, print_structured_output
-from utils.helm_utils import (build_helm_template_cmd, get_api_object_spec,
-                              get_all_release_api_objects,
-                              get_manifest_unique_key, get_image_version,
-                              manifests_list_to_dict)
+from utils.helm_utils import (get_api_object_specs, get_manifest_lookup_ref,
+                              get_complete_release_api_objects, get_image_version,
+                              render_helm_template_manifests)
+from models.helm_model import ManifestIndex
 
 
 # ruamel 可以最大化保留原文件格式，这里用于修改 values.yaml 文件内容
@@ -32,35 +31,37 @@ def image_version_diff(chart_path: str,
         dry_run (str): 不真正运行
     """
     with open(config_path, 'r', encoding='utf-8') as config_file:
-        config = yaml.safe_load(config_file)
+        config = load_yaml(config_file)
 
     with open(values, 'r', encoding='utf-8') as values_file:
         values_content = ruamel_yaml.load(values_file)
 
     print_status('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    rendered_original_manifest = render_helm_template_manifests(
+        release_name, chart_path, values)
+    if rendered_original_manifest is None:
         return
-    rendered_original_manifest = yaml.safe_load_all(cmd_output)
     
-    cluster_original_manifests = get_all_release_api_objects(release_name)
-    cluster_manifest_dict = manifests_list_to_dict(cluster_original_manifests)
+    cluster_original_manifests = get_complete_release_api_objects(
+        release_name, rendered_original_manifest)
+    cluster_index = ManifestIndex(cluster_original_manifests)
+    rendered_index = ManifestIndex(rendered_original_manifest,
+                                   helm_namespace=cluster_index.helm_namespace)
+    rendered_deployments = rendered_index.of_kind('Deployment')
 
     print('开始逐一对比Deployment对象镜像版本...')
+    looked_up_manifests = get_api_object_specs(
+        get_manifest_lookup_ref(rendered_manifest)
+        for rendered_manifest in rendered_deployments
+        if rendered_index.key_of(rendered_manifest) not in cluster_index)
     different_image_dict = {}
-    for rendered_manifest in rendered_original_manifest:
-        if rendered_manifest is None:
-            continue
-        kind = rendered_manifest['kind']
-        if kind != 'Deployment':
-            continue
+    for rendered_manifest in rendered_deployments:
         name = rendered_manifest['metadata']['name']
-        namespace = rendered_manifest['metadata']['namespace'] if 'namespace' in rendered_manifest['metadata'] else None
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        if manifest_unique_key in cluster_manifest_dict:
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
+        manifest_unique_key = rendered_index.key_of(rendered_manifest)
+        if manifest_unique_key in cluster_index:
+            cluster_manifest = cluster_index[manifest_unique_key]
         else:
-            cluster_manifest = get_api_object_spec('Deployment', name, namespace=namespace)
+            cluster_manifest = looked_up_manifests.get(get_manifest_lookup_ref(rendered_manifest))
         if cluster_manifest is None:
             continue
 
@@ -1,25 +1,37 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
-import yaml
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils.shell_utils import run_cmd
 from utils.dict_utils import parse_selector
+from utils.json_utils import dumps_json
+from utils.kube_client import KubeApiError
 from utils.output_utils import (
+    FAILURE_EXIT_CODE,
     exit_if_fail_on_triggered,
     print_status,
     print_structured_output,
 )
-from utils.helm_utils import (build_helm_template_cmd, build_kubectl_cmd,
-                              get_api_object_spec, get_all_release_api_objects,
+from utils.helm_utils import (NATIVE_CLIENT_SKIPPED, build_kubectl_cmd,
+                              call_native_kube_client, chunk_object_names,
+                              get_api_object_specs, get_complete_release_api_objects,
+                              get_fetch_parallelism,
                               get_helm_namespace,
-                              get_manifest_namespace,
-                              manifests_list_to_dict, get_manifest_unique_key,
-                              is_manifest_match_selector)
-from utils.manifest_utils import find_and_merge_related_rendered_manifests_of_deployments
+                              iter_helm_template_manifests,
+                              render_helm_template_manifests)
+from utils.manifest_utils import select_related_rendered_manifests
+from models.helm_model import ManifestIndex
+from services.snapshot_service import (build_snapshot_lookup,
+                                       get_snapshot_rendered_manifests,
+                                       load_snapshot)
 
-def get_manifest_lookup_namespace(manifest: dict):
-    namespace = get_manifest_namespace(manifest)
-    return namespace if namespace else None
+def get_record_lookup_ref(record) -> tuple:
+    """返回到集群中查找对象的 (kind, name, namespace)，使用 ManifestRecord 中已计算的 namespace，
+    集群级别的对象 namespace 为 None"""
+    return record.kind, record.name, record.namespace or None
 
 def get_ownership_metadata(manifest: dict) -> dict:
     metadata = manifest.get('metadata', {})
@@ -31,32 +43,125 @@ def get_ownership_metadata(manifest: dict) -> dict:
         'managed_by': labels.get('app.kubernetes.io/managed-by'),
     }
 
-def build_set_ownership_commands(kind: str,
-                                 name: str,
-                                 namespace: str,
-                                 release_name: str,
-                                 release_namespace: str) -> list:
-    cmds = [
-        ['annotate', kind, name,
-         f'meta.helm.sh/release-name={release_name}', '--overwrite'],
-        ['annotate', kind, name,
-         f'meta.helm.sh/release-namespace={release_namespace}', '--overwrite'],
-        ['label', kind, name,
-         'app.kubernetes.io/managed-by=Helm', '--overwrite'],
-    ]
+def build_ownership_patch(ownership: dict,
+                          release_name: str,
+                          release_namespace: str) -> dict:
+    """生成把对象交给 Release 管理的 merge patch，只包含需要修改的注解和标签
+
+    Returns:
+        dict: merge patch，元数据已经正确时返回 None
+    """
+    annotations = {}
+    labels = {}
+    if ownership['release_name'] != release_name:
+        annotations['meta.helm.sh/release-name'] = release_name
+    if ownership['release_namespace'] != release_namespace:
+        annotations['meta.helm.sh/release-namespace'] = release_namespace
+    if ownership['managed_by'] != 'Helm':
+        labels['app.kubernetes.io/managed-by'] = 'Helm'
+    metadata = {}
+    if annotations:
+        metadata['annotations'] = annotations
+    if labels:
+        metadata['labels'] = labels
+    return {'metadata': metadata} if metadata else None
+
+def build_set_ownership_command(kind: str,
+                                names: list,
+                                namespace: str,
+                                patch: dict) -> list:
+    """生成一条 kubectl patch 命令，把同一个 merge patch 应用到同一 kind、namespace 下的多个对象"""
+    cmd = ['patch', kind] + list(names) + ['--type', 'merge', '-p', dumps_json(patch)]
     if namespace:
-        cmds = [cmd + ['-n', namespace] for cmd in cmds]
-    return [build_kubectl_cmd(cmd) for cmd in cmds]
+        cmd.extend(['-n', namespace])
+    return build_kubectl_cmd(cmd)
+
+def group_ownership_patches(patches: list) -> list:
+    """把 (kind, name, namespace, patch) 按 kind、namespace 和 patch 内容分组，每组切分成多批
+
+    Returns:
+        list: (kind, namespace, patch, 对象名称列表) 元组，每一批执行一次 kubectl patch
+    """
+    groups = {}
+    for kind, name, namespace, patch in patches:
+        group = groups.setdefault((kind, namespace, dumps_json(patch)), (patch, []))
+        group[1].append(name)
+    return [(kind, namespace, patch, chunk)
+            for (kind, namespace, _), (patch, names) in groups.items()
+            for chunk in chunk_object_names(names)]
+
+def patch_ownership_batch(kind: str, namespace: str, patch: dict, names: list) -> dict:
+    """修改一批对象的 Helm 元数据
+
+    Returns:
+        dict: 对象名称到错误信息的映射，成功的对象对应 None
+    """
+    def patch_with_client(client) -> dict:
+        errors = {}
+        for name in names:
+            try:
+                client.merge_patch(kind, name, namespace, patch)
+                errors[name] = None
+            except KubeApiError as e:
+                errors[name] = str(e)
+        return errors
+
+    errors = call_native_kube_client(kind, patch_with_client)
+    if errors is not NATIVE_CLIENT_SKIPPED:
+        return errors
+    if run_cmd(build_set_ownership_command(kind, names, namespace, patch)) is not None:
+        return {name: None for name in names}
+    if len(names) == 1:
+        return {names[0]: 'kubectl patch 执行失败'}
+    # 整批失败（例如其中某个对象已被删除）时逐个执行，区分每个对象的结果
+    errors = {}
+    for name in names:
+        errors.update(patch_ownership_batch(kind, namespace, patch, [name]))
+    return errors
+
+def run_ownership_patches(patches: list, parallelism: int = None) -> dict:
+    """分批并发修改对象的 Helm 元数据，逐个打印对象的结果，最后打印汇总和总耗时
+
+    Args:
+        patches (list): (kind, name, namespace, patch) 元组
+        parallelism (int): 同时执行的批次数量上限，默认使用 --parallelism
+
+    Returns:
+        dict: 汇总，包括成功数量 patched、失败数量 failed 和总耗时 seconds
+    """
+    batches = group_ownership_patches(patches)
+    summary = {'patched': 0, 'failed': 0, 'seconds': 0}
+    if not batches:
+        return summary
+    started = time.monotonic()
+    parallelism = min(parallelism or get_fetch_parallelism(), len(batches))
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = {executor.submit(patch_ownership_batch, *batch): batch for batch in batches}
+        for future in as_completed(futures):
+            kind, namespace, _, _ = futures[future]
+            for name, error in future.result().items():
+                if error is None:
+                    summary['patched'] += 1
+                    print(f'{kind}/{name} (namespace: {namespace or "-"}) 已更新')
+                else:
+                    summary['failed'] += 1
+                    print(f'{kind}/{name} (namespace: {namespace or "-"}) 更新失败: {error}')
+    summary['seconds'] = round(time.monotonic() - started, 3)
+    print(f'更新完成: 成功 {summary["patched"]} 个，失败 {summary["failed"]} 个，'
+          f'用时 {summary["seconds"]:.2f}s，共执行 {len(batches)} 批')
+    return summary
 
 def build_adopt_plan(rendered_manifests: list,
                      release_name: str,
                      selector: str = '',
-                     lookup_manifest_func=get_api_object_spec) -> dict:
+                     lookup_manifests_func=get_api_object_specs) -> dict:
     from services.helm_service import select_rendered_manifests
 
     release_namespace = get_helm_namespace()
-    selected_rendered_manifests = select_rendered_manifests(
-        rendered_manifests, selector)
+    selected_index = ManifestIndex(select_rendered_manifests(rendered_manifests, selector),
+                                   helm_namespace=release_namespace)
+    cluster_manifests = lookup_manifests_func(
+        [get_record_lookup_ref(record) for record in selected_index.records.values()])
     plan = {
         'summary': {
             'managed': 0,
@@ -68,14 +173,13 @@ def build_adopt_plan(rendered_manifests: list,
         'resources': [],
     }
 
-    for rendered_manifest in selected_rendered_manifests:
-        kind = rendered_manifest['kind']
-        name = rendered_manifest['metadata']['name']
-        namespace = get_manifest_namespace(rendered_manifest)
-        cluster_manifest = lookup_manifest_func(
-            kind, name, namespace=get_manifest_lookup_namespace(rendered_manifest))
+    for record in selected_index.records.values():
+        kind = record.kind
+        name = record.name
+        namespace = record.namespace
+        cluster_manifest = cluster_manifests.get(get_record_lookup_ref(record))
         resource_plan = {
-            'key': get_manifest_unique_key(rendered_manifest),
+            'key': record.key,
             'kind': kind,
             'namespace': namespace,
             'name': name,
@@ -108,9 +212,9 @@ def build_adopt_plan(rendered_manifests: list,
                 status = 'adoptable'
 
             if status in ('adoptable', 'needs_metadata_update'):
+                patch = build_ownership_patch(ownership, release_name, release_namespace)
                 resource_plan['commands'] = [
-                    ' '.join(cmd) for cmd in build_set_ownership_commands(
-                        kind, name, namespace, release_name, release_namespace)
+                    shlex.join(build_set_ownership_command(kind, [name], namespace, patch))
                 ]
 
         resource_plan['status'] = status
@@ -124,17 +228,26 @@ def adopt_plan(chart_path: str,
                values: str,
                selector: str,
                output_format: str = 'yaml',
-               fail_on: str = '') -> None:
-    print_status('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+               fail_on: str = '',
+               snapshot_path: str = None) -> None:
+    lookup_manifests_func = get_api_object_specs
+    if snapshot_path is not None:
+        snapshot = load_snapshot(snapshot_path, release_name)
+        if snapshot is None:
+            return
+        lookup_manifests_func = build_snapshot_lookup(snapshot)
+        if chart_path is None:
+            rendered_manifests = get_snapshot_rendered_manifests(snapshot)
+            if rendered_manifests is None:
+                return
+    if chart_path is not None:
+        print_status('执行 helm template 命令...')
+        rendered_manifests = iter_helm_template_manifests(release_name, chart_path, values)
+    try:
+        plan = build_adopt_plan(rendered_manifests, release_name, selector=selector,
+                                lookup_manifests_func=lookup_manifests_func)
+    except subprocess.CalledProcessError:
         return
-    rendered_manifests = [
-        manifest for manifest in yaml.safe_load_all(cmd_output)
-        if manifest is not None
-    ]
-    plan = build_adopt_plan(rendered_manifests, release_name,
-                            selector=selector)
     print_structured_output(plan, output_format)
     exit_if_fail_on_triggered(plan, fail_on)
 
@@ -147,63 +260,47 @@ def set_ownership_metadata(chart_path: str,
     设置集群对象的元数据，以支持 helm 修改非 helm 管理的对象
     """
     print('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    rendered_original_manifests_generator = render_helm_template_manifests(
+        release_name, chart_path, values)
+    if rendered_original_manifests_generator is None:
         return
-    rendered_original_manifests_generator = yaml.safe_load_all(cmd_output)
     
-    cluster_original_manifests = get_all_release_api_objects(release_name)
-    cluster_manifest_dict = manifests_list_to_dict(cluster_original_manifests)
-
-    rendered_original_manifests = []
-    rendered_manifest_dict = {}
-    service_unique_keys = []
-    for rendered_manifest in rendered_original_manifests_generator:
-        if rendered_manifest is None:
-            continue
-        rendered_original_manifests.append(rendered_manifest) # 第一次遍历生成器时，把 manifest 另外存入 list
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        rendered_manifest_dict[manifest_unique_key] = rendered_manifest # 将 rendered_original_manifest 转成字典
-        if rendered_manifest.get('kind') == 'Service':
-            service_unique_keys.append(manifest_unique_key)
+    cluster_original_manifests = get_complete_release_api_objects(
+        release_name, rendered_original_manifests_generator)
+    cluster_index = ManifestIndex(cluster_original_manifests)
+    rendered_index = ManifestIndex(rendered_original_manifests_generator,
+                                   helm_namespace=cluster_index.helm_namespace)
 
     selector_dict = parse_selector(selector)
     if bool(selector_dict):
-        direct_selector_rendered_manifests = [rendered_manifest for rendered_manifest in rendered_original_manifests if is_manifest_match_selector(rendered_manifest, selector)]
-        selector_rendered_manifests = find_and_merge_related_rendered_manifests_of_deployments(direct_selector_rendered_manifests, rendered_manifest_dict, service_unique_keys)
+        selector_rendered_manifests = select_related_rendered_manifests(rendered_index, selector_dict)
     else:
-        selector_rendered_manifests = rendered_original_manifests
+        selector_rendered_manifests = list(rendered_index)
 
     print('开始逐一检查API对象配置...')
-    set_metadata_commands = []
-    for rendered_manifest in selector_rendered_manifests:
-        kind = rendered_manifest['kind']
-        name = rendered_manifest['metadata']['name']
-        namespace = get_manifest_lookup_namespace(rendered_manifest)
-        manifest_unique_key = get_manifest_unique_key(rendered_manifest)
-        if manifest_unique_key in cluster_manifest_dict:
+    unmanaged_refs = [
+        get_record_lookup_ref(record)
+        for record in map(rendered_index.record_of, selector_rendered_manifests)
+        if record.key not in cluster_index
+    ]
+    looked_up_manifests = get_api_object_specs(unmanaged_refs)
+    helm_namespace = get_helm_namespace()
+    patches = []
+    for kind, name, namespace in unmanaged_refs:
+        cluster_manifest = looked_up_manifests.get((kind, name, namespace))
+        if cluster_manifest is None:
             continue
-        else:
-            cluster_manifest = get_api_object_spec(kind, name, namespace=namespace)
-            if cluster_manifest is None:
-                continue
-        helm_namespace = get_helm_namespace()
-        ownership = get_ownership_metadata(cluster_manifest)
-        all_cmds = build_set_ownership_commands(
-            kind, name, namespace or '', release_name, helm_namespace)
-        cmds = []
-        if ownership['release_name'] != release_name:
-            cmds.append(all_cmds[0])
-        if ownership['release_namespace'] != helm_namespace:
-            cmds.append(all_cmds[1])
-        if ownership['managed_by'] != 'Helm':
-            cmds.append(all_cmds[2])
-        set_metadata_commands.extend(cmds)
+        patch = build_ownership_patch(
+            get_ownership_metadata(cluster_manifest), release_name, helm_namespace)
+        if patch is not None:
+            patches.append((kind, name, namespace, patch))
 
     if dry_run:
         print('commands will run:')
-        print('\n'.join([' '.join(cmd) for cmd in set_metadata_commands]))
+        print('\n'.join([shlex.join(build_set_ownership_command(kind, names, namespace, patch))
+                         for kind, namespace, patch, names in group_ownership_patches(patches)]))
     else:
-        print('开始逐一执行变更命令...')
-        for cmd in set_metadata_commands:
-            print(run_cmd(cmd))
+        print(f'开始分批更新 {len(patches)} 个对象的元数据...')
+        summary = run_ownership_patches(patches)
+        if summary['failed']:
+            raise SystemExit(FAILURE_EXIT_CODE)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import datetime
+import gzip
+import os
+from utils.json_utils import dumps_json, loads_json
+from utils.output_utils import print_status
+from utils.helm_utils import (get_api_object_specs,
+                              get_helm_namespace,
+                              get_manifest_lookup_ref,
+                              use_recorded_namespace)
+from models.helm_model import ManifestIndex
+
+PLAN_ARTIFACT_FORMAT = 'helm-fine-upgrade-plan'
+PLAN_ARTIFACT_VERSION = 1
+# 升级计划中需要应用的资源状态
+APPLY_PLAN_STATUSES = ('create', 'update', 'adopt')
+
+def build_plan_artifact(release_name: str,
+                        plan: dict,
+                        rendered_manifests: list,
+                        cluster_manifests: list,
+                        looked_up_manifests: dict) -> dict:
+    """生成可供 apply --plan 直接执行的计划文件内容
+
+    只保存需要应用的资源的渲染结果，以及生成计划时目标对象的 resourceVersion，
+    目标对象不存在时记为 None。
+
+    Args:
+        rendered_manifests (list): 生成计划时读取的渲染结果
+        cluster_manifests (list): 生成计划时获取的 Release 运行时对象
+        looked_up_manifests (dict): 生成计划时按 (kind, name, namespace) 查找到的集群对象
+    """
+    rendered_index = ManifestIndex(rendered_manifests)
+    cluster_index = ManifestIndex.of(cluster_manifests)
+    resources = []
+    for resource_plan in plan['resources']:
+        if resource_plan['status'] not in APPLY_PLAN_STATUSES:
+            continue
+        manifest = rendered_index[resource_plan['key']]
+        ref = get_manifest_lookup_ref(manifest)
+        if resource_plan['status'] == 'adopt':
+            cluster_manifest = looked_up_manifests.get(ref)
+        else:
+            # 按尾部 hash 匹配到的 update 会创建新名称的对象，目标对象不存在
+            cluster_manifest = cluster_index.get(resource_plan['key'])
+        resource_version = None
+        if cluster_manifest is not None:
+            resource_version = cluster_manifest['metadata'].get('resourceVersion')
+        resources.append({
+            'key': resource_plan['key'],
+            'status': resource_plan['status'],
+            'ref': list(ref),
+            'resource_version': resource_version,
+            'manifest': manifest,
+        })
+
+    return {
+        'format': PLAN_ARTIFACT_FORMAT,
+        'version': PLAN_ARTIFACT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'release': {'name': release_name, 'namespace': get_helm_namespace()},
+        'summary': plan['summary'],
+        'resources': resources,
+    }
+
+def write_plan_artifact(artifact: dict, artifact_path: str) -> None:
+    """以 gzip 压缩的 JSON 写入计划文件，写入完成后再替换目标文件"""
+    temp_path = f'{artifact_path}.tmp'
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as artifact_file:
+        artifact_file.write(dumps_json(artifact))
+    os.replace(temp_path, artifact_path)
+
+def load_plan_artifact(artifact_path: str, release_name: str) -> dict:
+    """读取计划文件并校验格式、版本和 Release，使用计划中记录的 Release namespace
+
+    命令行指定的 --namespace 与计划中记录的不一致时以非 0 状态退出。
+
+    Returns:
+        dict: 计划文件内容，无法使用时打印原因并返回 None
+    """
+    try:
+        with gzip.open(artifact_path, 'rb') as artifact_file:
+            artifact = loads_json(artifact_file.read())
+    except (OSError, ValueError) as e:
+        print_status(f'读取计划文件失败: {artifact_path}: {e}')
+        return None
+    if not isinstance(artifact, dict) or artifact.get('format') != PLAN_ARTIFACT_FORMAT:
+        print_status(f'不是 helm-fine-upgrade 计划文件: {artifact_path}')
+        return None
+    if artifact.get('version') != PLAN_ARTIFACT_VERSION:
+        print_status(f'不支持的计划文件版本 {artifact.get("version")}，'
+                     f'当前支持的版本为 {PLAN_ARTIFACT_VERSION}: {artifact_path}')
+        return None
+    release = artifact['release']
+    if release['name'] != release_name:
+        print_status(f'计划文件属于 Release {release["name"]}，与 {release_name} 不一致')
+        return None
+    use_recorded_namespace(release['namespace'], '计划文件')
+    return artifact
+
+def find_moved_resources(artifact: dict, lookup_manifests_func=get_api_object_specs) -> list:
+    """按 kind 和 namespace 批量查询计划中的目标对象，返回 resourceVersion 已变化的资源
+
+    Returns:
+        list: 每项包含 key、生成计划时的 planned 和当前的 current resourceVersion
+    """
+    refs = [tuple(resource['ref']) for resource in artifact['resources']]
+    current_manifests = lookup_manifests_func(refs) if refs else {}
+    moved_resources = []
+    for resource, ref in zip(artifact['resources'], refs):
+        current_manifest = current_manifests.get(ref)
+        current_version = None
+        if current_manifest is not None:
+            current_version = current_manifest['metadata'].get('resourceVersion')
+        if current_version != resource['resource_version']:
+            moved_resources.append({
+                'key': resource['key'],
+                'planned': resource['resource_version'],
+                'current': current_version,
+            })
+    return moved_resources
+
+def get_plan_artifact_manifests(artifact: dict) -> list:
+    return [resource['manifest'] for resource in artifact['resources']]
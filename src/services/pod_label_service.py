@@ -1,118 +1,251 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
-import yaml
-from multiprocessing import Pool
+import copy
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from utils.shell_utils import run_cmd
-from utils.helm_utils import (build_helm_template_cmd, build_kubectl_cmd,
-                              get_api_object_spec,
-                              get_all_release_api_objects,
-                              get_manifest_unique_key, is_manifest_match_selector,
-                              manifests_list_to_dict)
-from utils.kube_ops_utils import apply_deployment, delete_deployment
+from utils.output_utils import print_status
+from utils.yaml_utils import dump_yaml
+from utils.rollout_journal import (ROLLOUT_STEPS, RolloutJournal, get_default_journal_path,
+                                   get_step_index)
+from utils.helm_utils import (DEFAULT_MAX_CONCURRENT_ROLLOUTS, append_helm_global_args,
+                              build_kubectl_cmd,
+                              get_api_object_specs, get_manifest_lookup_ref,
+                              get_complete_release_api_objects, is_manifest_match_selector,
+                              render_helm_template_manifests)
+from utils.kube_ops_utils import (DeploymentReadinessTracker, apply_deployment,
+                                  delete_deployment)
+from models.helm_model import ManifestIndex
+
+def run_rollouts(rollouts: list,
+                 worker,
+                 max_concurrent_rollouts: int = DEFAULT_MAX_CONCURRENT_ROLLOUTS,
+                 max_rollouts_per_namespace: int = None,
+                 max_failures: int = None):
+    """并发执行滚动更新，按完成顺序逐个产出结果
+
+    按提交顺序开始滚动更新，同时进行的数量不超过 max_concurrent_rollouts，同一 namespace
+    中同时进行的数量不超过 max_rollouts_per_namespace。失败数量达到 max_failures 后不再开始
+    新的滚动更新，已开始的继续执行完，未开始的以 skipped 状态产出。
+
+    Args:
+        rollouts (list): (namespace, name, worker 参数元组) 列表
+        worker: 执行单个滚动更新的函数，返回结果描述，失败时抛出异常
+
+    Yields:
+        dict: namespace、name、status（succeeded/failed/skipped），以及 result 或 error
+    """
+    pending = list(rollouts)
+    running = {}
+    namespace_running = Counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_concurrent_rollouts) as executor:
+        while pending or running:
+            if max_failures is not None and failures >= max_failures and pending:
+                print_status(f'失败数量达到 {max_failures}，不再开始新的滚动更新')
+                for namespace, name, _ in pending:
+                    yield {'namespace': namespace, 'name': name, 'status': 'skipped'}
+                pending = []
+            for rollout in list(pending):
+                if len(running) >= max_concurrent_rollouts:
+                    break
+                namespace, name, args = rollout
+                if max_rollouts_per_namespace is not None and \
+                        namespace_running[namespace] >= max_rollouts_per_namespace:
+                    continue
+                pending.remove(rollout)
+                running[executor.submit(worker, *args)] = rollout
+                namespace_running[namespace] += 1
+                print_status(f'开始滚动更新 {namespace}:{name}'
+                             f'（进行中 {len(running)}，等待 {len(pending)}）')
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                namespace, name, _ = running.pop(future)
+                namespace_running[namespace] -= 1
+                try:
+                    yield {'namespace': namespace, 'name': name, 'status': 'succeeded',
+                           'result': future.result()}
+                except Exception as e:
+                    failures += 1
+                    yield {'namespace': namespace, 'name': name, 'status': 'failed',
+                           'error': str(e)}
 
 def rolling_update_pod_labels(chart_path: str,
                               release_name: str,
                               values: str,
                               selector: str,
-                              dry_run: str) -> None:
+                              dry_run: str,
+                              max_concurrent_rollouts: int = DEFAULT_MAX_CONCURRENT_ROLLOUTS,
+                              max_rollouts_per_namespace: int = None,
+                              max_failures: int = None,
+                              journal_path: str = None) -> None:
     """
     滚动更新 Pod 的标签，服务不中断
+
+    每个 Deployment 完成的步骤记录在本地日志中，重新执行时跳过已完成的 Deployment，
+    并从中断的步骤继续未完成的 Deployment。
     """
 
     print('执行 helm template 命令...')
-    cmd_output = run_cmd(build_helm_template_cmd(release_name, chart_path, values))
-    if cmd_output is None:
+    rendered_original_manifest = render_helm_template_manifests(
+        release_name, chart_path, values)
+    if rendered_original_manifest is None:
         return
-    rendered_original_manifest = yaml.safe_load_all(cmd_output)
 
-    deployments = []
+    rendered_index = ManifestIndex(rendered_original_manifest)
     service_map = {}
-    for rendered_manifest in rendered_original_manifest:
-        if rendered_manifest is None:
+    for rendered_manifest in rendered_index.of_kind('Service'):
+        if 'selector' not in rendered_manifest['spec']:
+            # 非业务服务的情况，仅指定 Endpoint 的场景，跳过
             continue
-        kind = rendered_manifest['kind']
-        if kind == 'Deployment':
-            deployments.append(rendered_manifest)
-        elif kind == 'Service':
-            if 'selector' not in rendered_manifest['spec']:
-                # 非业务服务的情况，仅指定 Endpoint 的场景，跳过
-                continue
-            namespace = rendered_manifest['metadata']['namespace'] if 'namespace' in rendered_manifest['metadata'] else None
-            if 'name' not in rendered_manifest['spec']['selector']:
-                continue
-            deployment_name = rendered_manifest['spec']['selector']['name']
-            service_map[f'{namespace}:{deployment_name}'] = rendered_manifest
+        namespace = rendered_manifest['metadata']['namespace'] if 'namespace' in rendered_manifest['metadata'] else None
+        if 'name' not in rendered_manifest['spec']['selector']:
+            continue
+        deployment_name = rendered_manifest['spec']['selector']['name']
+        service_map[f'{namespace}:{deployment_name}'] = rendered_manifest
+    # 与选择器不匹配的 Deployment 直接跳过
+    deployments = [rendered_deployment_manifest
+                   for rendered_deployment_manifest in rendered_index.of_kind('Deployment')
+                   if is_manifest_match_selector(rendered_deployment_manifest, selector)]
+
+    cluster_original_manifests = get_complete_release_api_objects(
+        release_name, rendered_original_manifest)
+    cluster_index = ManifestIndex(cluster_original_manifests,
+                                  helm_namespace=rendered_index.helm_namespace)
 
-    cluster_original_manifests = get_all_release_api_objects(release_name)
-    cluster_manifest_dict = manifests_list_to_dict(cluster_original_manifests)
+    looked_up_manifests = get_api_object_specs(
+        get_manifest_lookup_ref(rendered_deployment_manifest)
+        for rendered_deployment_manifest in deployments
+        if rendered_index.key_of(rendered_deployment_manifest) not in cluster_index)
 
-    # 最多同时对5个 Deployment 进行滚动更新
-    pool = Pool(processes=5)
-    results = []
+    # 所有 worker 共享一个就绪跟踪器
+    tracker = DeploymentReadinessTracker()
+    journal = RolloutJournal(journal_path or get_default_journal_path(
+        release_name, append_helm_global_args([release_name])))
+    rollouts = []
     print('开始逐一检查Deployment对象的Pod标签配置...')
     for rendered_deployment_manifest in deployments:
-        # 如果与选择器不匹配，直接跳过
-        if not is_manifest_match_selector(rendered_deployment_manifest, selector):
-            continue
-
         name = rendered_deployment_manifest['metadata']['name']
         namespace = rendered_deployment_manifest['metadata']['namespace'] if 'namespace' in rendered_deployment_manifest['metadata'] else None
-        manifest_unique_key = get_manifest_unique_key(rendered_deployment_manifest)
-        if manifest_unique_key in cluster_manifest_dict:
-            cluster_manifest = cluster_manifest_dict[manifest_unique_key]
+        renderedMatchLabels = rendered_deployment_manifest['spec']['selector']['matchLabels']
+        # 日志中的目标标签与本次渲染结果一致时，才沿用之前的进度
+        journal_state = journal.get(namespace, name)
+        if journal_state is not None and journal_state['target'] != renderedMatchLabels:
+            journal_state = None
+        if journal_state is not None and journal_state['step'] == 'done':
+            print(f'{namespace}:{name} 已完成滚动更新，跳过.')
+            continue
+        if journal_state is not None:
+            if dry_run:
+                print(f'{namespace}:{name} 需从 {journal_state["step"]} 步骤之后继续滚动更新.')
+                continue
+            rollouts.append((namespace, name, (
+                rendered_deployment_manifest, journal_state['manifest'], service_map,
+                build_kubectl_cmd(['apply', '-f', '-']), tracker, journal, journal_state['step'])))
+            continue
+
+        manifest_unique_key = rendered_index.key_of(rendered_deployment_manifest)
+        if manifest_unique_key in cluster_index:
+            cluster_manifest = cluster_index[manifest_unique_key]
         else:
-            cluster_manifest = get_api_object_spec('Deployment', name, namespace=namespace)
+            cluster_manifest = looked_up_manifests.get(
+                get_manifest_lookup_ref(rendered_deployment_manifest))
         if cluster_manifest is None:
             continue
 
-        renderedMatchLabels = rendered_deployment_manifest['spec']['selector']['matchLabels']
         clusterMatchLabels = cluster_manifest['spec']['selector']['matchLabels']
-        if yaml.dump(renderedMatchLabels, allow_unicode=True) == yaml.dump(clusterMatchLabels, allow_unicode=True):
+        if dump_yaml(renderedMatchLabels, allow_unicode=True) == dump_yaml(clusterMatchLabels, allow_unicode=True):
             continue
         if dry_run:
             print(f'{namespace}:{name} 需对Pod进行滚动更新.')
             continue
-        # 异步处理滚动更新逻辑
-        result = pool.apply_async(rolling_update_worker, args=(
+        rollouts.append((namespace, name, (
             rendered_deployment_manifest, cluster_manifest, service_map,
-            build_kubectl_cmd(['apply', '-f', '-'])))
-        results.append(result)
-
-    # 获取异步结果
-    for result in results:
-        try:
-            print(result.get())
-        except Exception as e:
-            print(e)
-    pool.close()
-    pool.join()
-
-def rolling_update_worker(rendered_deployment_manifest, cluster_deployment_manifest, service_map, apply_cmd):
+            build_kubectl_cmd(['apply', '-f', '-']), tracker, journal)))
+
+    # 并发执行滚动更新，按完成顺序输出结果
+    counts = Counter()
+    for index, outcome in enumerate(run_rollouts(
+            rollouts, rolling_update_worker,
+            max_concurrent_rollouts=max_concurrent_rollouts,
+            max_rollouts_per_namespace=max_rollouts_per_namespace,
+            max_failures=max_failures), start=1):
+        counts[outcome['status']] += 1
+        if outcome['status'] == 'succeeded':
+            print(outcome['result'])
+        elif outcome['status'] == 'failed':
+            print(outcome['error'])
+        print_status(f'[{index}/{len(rollouts)}] {outcome["namespace"]}:{outcome["name"]} '
+                     f'{outcome["status"]}')
+    if rollouts:
+        print_status(f'滚动更新结束：成功 {counts["succeeded"]}，失败 {counts["failed"]}，'
+                     f'跳过 {counts["skipped"]}')
+
+def rolling_update_worker(rendered_deployment_manifest, cluster_deployment_manifest, service_map,
+                          apply_cmd, tracker=None, journal=None, completed_step=None):
+    """执行单个 Deployment 的滚动更新
+
+    Args:
+        cluster_deployment_manifest (dict): 开始滚动更新前集群中的 Deployment 配置
+        journal (RolloutJournal): 可选，记录每个完成的步骤
+        completed_step (str): 可选，上次执行时最后完成的步骤，之前的步骤不再执行
+    """
     name = rendered_deployment_manifest['metadata']['name']
     namespace = rendered_deployment_manifest['metadata']['namespace'] if 'namespace' in rendered_deployment_manifest['metadata'] else None
     renderedMatchLabels = rendered_deployment_manifest['spec']['selector']['matchLabels']
-    clusterMatchLabels = cluster_deployment_manifest['spec']['selector']['matchLabels']
-    specTemplateLables = cluster_deployment_manifest['spec']['template']['metadata']['labels']
+    temp_name = f'{name}-rolling-temp'
+    completed_index = get_step_index(completed_step)
+    times_to_ready = []
+
+    def run_step(step, action):
+        """执行步骤，action 返回 None 表示失败，此时抛出异常且不记录该步骤"""
+        if completed_index >= ROLLOUT_STEPS.index(step):
+            return None
+        result = action()
+        if result is None:
+            raise Exception(f'{namespace}:{name} {step} 步骤执行失败！')
+        if journal is not None:
+            journal.record(namespace, name, step)
+        return result
+
+    if journal is not None and completed_step is None:
+        journal.record(namespace, name, 'started',
+                       manifest=cluster_deployment_manifest, target=renderedMatchLabels)
 
     # 1. 创建临时 Deployment 以保持服务不中断
-    clusterMatchLabels['rolling-update-pod-labels-flag'] = '1'
-    specTemplateLables['rolling-update-pod-labels-flag'] = '1'
-    temp_name = f'{name}-rolling-temp'
-    cluster_deployment_manifest['metadata']['name'] = temp_name
-    apply_deployment(cluster_deployment_manifest)
+    temp_manifest = copy.deepcopy(cluster_deployment_manifest)
+    temp_manifest['spec']['selector']['matchLabels']['rolling-update-pod-labels-flag'] = '1'
+    temp_manifest['spec']['template']['metadata']['labels']['rolling-update-pod-labels-flag'] = '1'
+    temp_manifest['metadata']['name'] = temp_name
+    seconds = run_step('temp-ready', lambda: apply_deployment(temp_manifest, tracker))
+    if seconds is not None:
+        times_to_ready.append(('临时 Deployment', seconds))
     # 2. 临时 Deployment 就绪后删除旧 Deployment
-    delete_deployment(namespace, name)
+    run_step('old-deleted', lambda: delete_deployment(namespace, name))
     # 3. 使用新 Pod 标签创建 Deployment
-    cluster_deployment_manifest['metadata']['name'] = name
-    cluster_deployment_manifest['spec']['selector']['matchLabels'] = renderedMatchLabels
-    cluster_deployment_manifest['spec']['template']['metadata']['labels'] = renderedMatchLabels
-    apply_deployment(cluster_deployment_manifest)
+    new_manifest = copy.deepcopy(cluster_deployment_manifest)
+    new_manifest['spec']['selector']['matchLabels'] = renderedMatchLabels
+    new_manifest['spec']['template']['metadata']['labels'] = renderedMatchLabels
+    seconds = run_step('new-ready', lambda: apply_deployment(new_manifest, tracker))
+    if seconds is not None:
+        times_to_ready.append(('新 Deployment', seconds))
     # 4. 新 Deployment 就绪后更新 Service，把流量切回去
     serviceItem = service_map.get(f'{namespace}:{name}')
     if serviceItem is not None:
-        print(run_cmd(apply_cmd, input=yaml.dump(serviceItem, allow_unicode=True)))
+        output = run_step('service-applied', lambda: run_cmd(
+            apply_cmd, input=dump_yaml(serviceItem, allow_unicode=True)))
+        if output is not None:
+            print(output)
     # 5. 流量切回去后，将临时 Deployment 删除
-    delete_deployment(namespace, temp_name)
+    run_step('done', lambda: delete_deployment(namespace, temp_name))
 
-    return f'{namespace}:{name} 滚动更新完成！'
+    message = f'{namespace}:{name} 滚动更新完成！'
+    if completed_step is not None:
+        message += f'（从 {completed_step} 步骤之后继续）'
+    if times_to_ready:
+        message += '（' + '，'.join(
+            f'{label}就绪耗时 {seconds:.1f}s' for label, seconds in times_to_ready) + '）'
+    return message
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import datetime
+import gzip
+import os
+from utils.json_utils import dumps_json, loads_json
+from utils.output_utils import print_status
+from utils.helm_utils import (CLUSTER_SCOPED_KINDS,
+                              get_all_release_api_objects,
+                              get_api_object_specs,
+                              get_helm_namespace,
+                              get_manifest_namespace,
+                              get_release_manifests,
+                              render_helm_template_manifests,
+                              use_recorded_namespace)
+from models.helm_model import ManifestIndex
+
+SNAPSHOT_FORMAT = 'helm-fine-upgrade-snapshot'
+SNAPSHOT_VERSION = 1
+
+def get_default_snapshot_path(release_name: str) -> str:
+    return f'{release_name}.snapshot.json.gz'
+
+def get_snapshot_lookup_ref(manifest: dict) -> tuple:
+    namespace = get_manifest_namespace(manifest)
+    return manifest['kind'], manifest['metadata']['name'], namespace or None
+
+def build_snapshot(release_name: str,
+                   chart_path: str = None,
+                   values: str = None) -> dict:
+    """采集 Release 记录、chart 渲染结果和集群运行时对象
+
+    除 Release 接管的运行时对象外，还会采集渲染结果中不在其中的同名集群对象，
+    供离线执行 plan、adopt-plan 时查找。
+
+    Returns:
+        dict: 快照内容，chart 渲染失败时返回 None
+    """
+    rendered_manifests = None
+    if chart_path is not None:
+        print_status('执行 helm template 命令...')
+        rendered_manifests = render_helm_template_manifests(release_name, chart_path, values)
+        if rendered_manifests is None:
+            return None
+
+    print_status('获取 Release 记录...')
+    release_manifests = get_release_manifests(release_name, quiet=True)
+    print_status('获取集群运行时对象...')
+    fetch_failures = []
+    runtime_manifests = get_all_release_api_objects(
+        release_name, rendered_manifests, release_manifests=release_manifests or [],
+        failures=fetch_failures)
+    runtime_index = ManifestIndex(runtime_manifests)
+    lookup_manifests = list(get_api_object_specs(
+        get_snapshot_lookup_ref(manifest) for manifest in rendered_manifests or []
+        if runtime_index.key_of(manifest) not in runtime_index).values())
+
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'release': {'name': release_name, 'namespace': get_helm_namespace()},
+        'release_manifests': release_manifests,
+        'rendered_manifests': rendered_manifests,
+        'runtime_manifests': runtime_manifests,
+        'lookup_manifests': lookup_manifests,
+        'fetch_failures': fetch_failures,
+    }
+
+def write_snapshot(snapshot: dict, snapshot_path: str) -> None:
+    """以 gzip 压缩的 JSON 写入快照文件，写入完成后再替换目标文件"""
+    temp_path = f'{snapshot_path}.tmp'
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as snapshot_file:
+        snapshot_file.write(dumps_json(snapshot))
+    os.replace(temp_path, snapshot_path)
+
+def read_snapshot(snapshot_path: str) -> dict:
+    """读取快照文件
+
+    Returns:
+        dict: 快照内容，文件无法读取、格式或版本不支持时打印原因并返回 None
+    """
+    try:
+        with gzip.open(snapshot_path, 'rb') as snapshot_file:
+            snapshot = loads_json(snapshot_file.read())
+    except (OSError, ValueError) as e:
+        print_status(f'读取快照失败: {snapshot_path}: {e}')
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        print_status(f'不是 helm-fine-upgrade 快照文件: {snapshot_path}')
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        print_status(f'不支持的快照版本 {snapshot.get("version")}，'
+                     f'当前支持的版本为 {SNAPSHOT_VERSION}: {snapshot_path}')
+        return None
+    return snapshot
+
+def load_snapshot(snapshot_path: str, release_name: str) -> dict:
+    """读取快照并校验 Release，离线执行时使用快照中记录的 Release namespace
+
+    命令行指定的 --namespace 与快照中记录的不一致时以非 0 状态退出。
+
+    Returns:
+        dict: 快照内容，无法使用时返回 None
+    """
+    snapshot = read_snapshot(snapshot_path)
+    if snapshot is None:
+        return None
+    release = snapshot['release']
+    if release['name'] != release_name:
+        print_status(f'快照属于 Release {release["name"]}，与 {release_name} 不一致')
+        return None
+    use_recorded_namespace(release['namespace'], '快照')
+    return snapshot
+
+def get_snapshot_rendered_manifests(snapshot: dict) -> list:
+    """返回快照中的渲染结果，快照未包含 chart 渲染结果时打印提示并返回 None"""
+    rendered_manifests = snapshot.get('rendered_manifests')
+    if rendered_manifests is None:
+        print_status('快照中没有 chart 渲染结果，请在生成快照时指定 chart，或在离线执行时指定 chart')
+    return rendered_manifests
+
+def build_snapshot_lookup(snapshot: dict):
+    """返回基于快照的批量查找函数，与 get_api_object_specs 的参数和返回值一致"""
+    helm_namespace = snapshot['release']['namespace']
+    manifest_index = ManifestIndex(
+        (snapshot.get('runtime_manifests') or []) + (snapshot.get('lookup_manifests') or []),
+        helm_namespace=helm_namespace)
+
+    def lookup_manifests(refs) -> dict:
+        manifests = {}
+        for kind, name, namespace in refs:
+            if kind in CLUSTER_SCOPED_KINDS:
+                namespace_key = ''
+            else:
+                namespace_key = namespace or helm_namespace
+            manifest = manifest_index.get(f'{kind}:{namespace_key}:{name}')
+            if manifest is not None:
+                manifests[(kind, name, namespace)] = manifest
+        return manifests
+
+    return lookup_manifests
+
+def take_snapshot(release_name: str,
+                  chart_path: str,
+                  values: str,
+                  snapshot_path: str = None) -> None:
+    snapshot = build_snapshot(release_name, chart_path, values)
+    if snapshot is None:
+        return
+    snapshot_path = snapshot_path or get_default_snapshot_path(release_name)
+    write_snapshot(snapshot, snapshot_path)
+    if snapshot['release_manifests'] is None:
+        print_status(f'未找到 Release {release_name} 的记录，快照中不包含 Release manifest')
+    for failure in snapshot['fetch_failures']:
+        print_status(f'快照不完整：获取 {failure["kind"]} 对象失败（namespace: {failure["namespace"] or "-"}）')
+    print(f'生成文件: {snapshot_path}（运行时对象 {len(snapshot["runtime_manifests"])} 个）.')
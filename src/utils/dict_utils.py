@@ -4,29 +4,254 @@
 import functools
 from typing import Any
 
-def remove_ignore_fields(obj, ignore_config):
+_MISSING = object()
+
+class IgnoreFieldMatcher:
+    """预编译的忽略字段树节点
+
+    fields 为当前对象下需要移除的直接字段；children 为需要继续向下匹配的字段，
+    值为子节点，子节点为 None 表示该字段下没有需要移除的内容。
     """
-    移除不需要参与比对的字段
-    obj: 当前处理对象
-    ignore_config: 当前对象需要移除的字段树。_fields 字段内容为当前对象下需要移除的直接字段
+    __slots__ = ('fields', 'children')
+
+    def __init__(self, fields: frozenset, children: dict):
+        self.fields = fields
+        self.children = children
+
+def compile_ignore_fields(ignore_config):
+    """把配置文件中的 ignore_fields 字段树编译为 IgnoreFieldMatcher，已编译的对象原样返回
+
+    Returns:
+        IgnoreFieldMatcher: 字段树为空时返回 None
+    """
+    if ignore_config is None or isinstance(ignore_config, IgnoreFieldMatcher):
+        return ignore_config
+    if not ignore_config:
+        return None
+    return IgnoreFieldMatcher(
+        frozenset(ignore_config.get('_fields') or ()),
+        {key: compile_ignore_fields(child_config)
+         for key, child_config in ignore_config.items() if key != '_fields'})
+
+def merge_ignore_trees(*trees) -> dict:
+    """合并多个忽略字段树，_fields 取并集，子字段树递归合并，不修改传入的字段树"""
+    merged = {}
+    for tree in trees:
+        if not tree:
+            continue
+        for key, value in tree.items():
+            if key == '_fields':
+                fields = merged.setdefault('_fields', [])
+                fields.extend(field for field in value or [] if field not in fields)
+            elif merged.get(key):
+                merged[key] = merge_ignore_trees(merged[key], value)
+            else:
+                merged[key] = merge_ignore_trees(value)
+    return merged
+
+class IgnoreProfileTable:
+    """按 kind 分派的忽略字段规则表
+
+    kind_configs 的 key 可以是 kind（例如 Deployment），也可以是 apiVersion/kind
+    （例如 apps/v1/Deployment）。每种 apiVersion + kind 只在第一次遇到时把全局字段树
+    与对应的字段树合并编译一次，之后直接查表。
     """
-    if obj is None or ignore_config is None:
+    __slots__ = ('global_config', 'kind_configs', 'matchers')
+
+    def __init__(self, global_config: dict, kind_configs: dict):
+        self.global_config = global_config or {}
+        self.kind_configs = kind_configs or {}
+        self.matchers = {}
+
+    def for_manifest(self, manifest: dict) -> IgnoreFieldMatcher:
+        api_version = manifest.get('apiVersion') or ''
+        kind = manifest.get('kind') or ''
+        cache_key = (api_version, kind)
+        matcher = self.matchers.get(cache_key, _MISSING)
+        if matcher is _MISSING:
+            matcher = compile_ignore_fields(merge_ignore_trees(
+                self.global_config,
+                self.kind_configs.get(kind),
+                self.kind_configs.get(f'{api_version}/{kind}')))
+            self.matchers[cache_key] = matcher
+        return matcher
+
+def compile_ignore_profiles(config: dict) -> IgnoreProfileTable:
+    """根据配置中的 ignore_fields 与 ignore_fields_by_kind 构建规则表"""
+    return IgnoreProfileTable(config.get('ignore_fields'),
+                              config.get('ignore_fields_by_kind'))
+
+def resolve_ignore_matcher(ignore_config, manifest: dict) -> IgnoreFieldMatcher:
+    """返回适用于 manifest 的已编译字段树
+
+    ignore_config 可以是字段树、已编译的 IgnoreFieldMatcher 或 IgnoreProfileTable。
+    """
+    if isinstance(ignore_config, IgnoreProfileTable):
+        return ignore_config.for_manifest(manifest)
+    return compile_ignore_fields(ignore_config)
+
+def _remove_ignore_fields(obj, matcher: IgnoreFieldMatcher) -> None:
+    if obj is None or matcher is None:
         return
     if isinstance(obj, list):
         for item in obj:
-            remove_ignore_fields(item, ignore_config)
+            _remove_ignore_fields(item, matcher)
     elif isinstance(obj, dict):
-        for key in ignore_config:
-            if key == '_fields':
-                for field in ignore_config[key]:
-                    if field in obj:
-                        del obj[field]
-            elif key in obj:
+        for field in matcher.fields:
+            obj.pop(field, None)
+        for key, child_matcher in matcher.children.items():
+            if key in obj:
                 if obj[key] is not None:
-                    remove_ignore_fields(obj[key], ignore_config[key])
+                    _remove_ignore_fields(obj[key], child_matcher)
                 if not bool(obj[key]):
                     del obj[key]
 
+def remove_ignore_fields(obj, ignore_config):
+    """
+    移除不需要参与比对的字段
+    obj: 当前处理对象
+    ignore_config: 当前对象需要移除的字段树。_fields 字段内容为当前对象下需要移除的直接字段
+    """
+    _remove_ignore_fields(obj, compile_ignore_fields(ignore_config))
+
+def _project_ignore_fields(obj, matcher: IgnoreFieldMatcher):
+    if matcher is None:
+        return obj
+    if isinstance(obj, list):
+        projected_items = None
+        for index, item in enumerate(obj):
+            projected_item = _project_ignore_fields(item, matcher)
+            if projected_item is not item:
+                if projected_items is None:
+                    projected_items = list(obj)
+                projected_items[index] = projected_item
+        return obj if projected_items is None else projected_items
+    if not isinstance(obj, dict):
+        return obj
+
+    projected = None
+    for key, value in obj.items():
+        if key in matcher.fields:
+            projected_value = _MISSING
+        elif key in matcher.children:
+            projected_value = value
+            if value is not None:
+                projected_value = _project_ignore_fields(value, matcher.children[key])
+            if not bool(projected_value):
+                projected_value = _MISSING
+        else:
+            continue
+        if projected_value is value:
+            continue
+        if projected is None:
+            projected = dict(obj)
+        if projected_value is _MISSING:
+            del projected[key]
+        else:
+            projected[key] = projected_value
+    return obj if projected is None else projected
+
+def project_ignore_fields(obj, ignore_config):
+    """返回移除忽略字段后的视图，不修改原对象
+
+    只复制路径上发生变化的字典和列表，未变化的子树与原对象共享，
+    避免深拷贝带有大量 ConfigMap 数据的 manifest。
+    """
+    return _project_ignore_fields(obj, compile_ignore_fields(ignore_config))
+
+def normalize_text(text: str) -> str:
+    """与 YAML 多行字符串输出一致：去掉每行行尾空白以及末尾换行"""
+    return "\n".join(line.rstrip() for line in text.splitlines())
+
+def values_equal(left, right) -> bool:
+    """按 YAML 语义严格比较两个值：类型不同即不相等（True 与 1、1 与 1.0 不相等），
+    字符串忽略行尾空白，字典忽略键顺序"""
+    if left is right:
+        return True
+    if type(left) is not type(right):
+        return False
+    if isinstance(left, dict):
+        if len(left) != len(right):
+            return False
+        for key, value in left.items():
+            other = right.get(key, _MISSING)
+            if other is _MISSING or not values_equal(value, other):
+                return False
+        return True
+    if isinstance(left, list):
+        if len(left) != len(right):
+            return False
+        for value, other in zip(left, right):
+            if not values_equal(value, other):
+                return False
+        return True
+    if isinstance(left, str):
+        return left == right or normalize_text(left) == normalize_text(right)
+    return left == right
+
+def _is_empty_after_ignore(value, matcher: IgnoreFieldMatcher) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, dict) and matcher is not None:
+        for key, item in value.items():
+            if key in matcher.fields:
+                continue
+            if key in matcher.children and \
+                    _is_empty_after_ignore(item, matcher.children[key]):
+                continue
+            return False
+        return True
+    return not bool(value)
+
+def _values_equal_ignoring_fields(left, right, matcher: IgnoreFieldMatcher) -> bool:
+    if left is right:
+        return True
+    if matcher is None:
+        return values_equal(left, right)
+    if isinstance(left, list) and isinstance(right, list):
+        if len(left) != len(right):
+            return False
+        for value, other in zip(left, right):
+            if not _values_equal_ignoring_fields(value, other, matcher):
+                return False
+        return True
+    if not isinstance(left, dict) or not isinstance(right, dict):
+        return values_equal(left, right)
+
+    fields = matcher.fields
+    children = matcher.children
+    for key, value in left.items():
+        if key in fields:
+            continue
+        other = right.get(key, _MISSING)
+        if key in children:
+            child_matcher = children[key]
+            left_empty = _is_empty_after_ignore(value, child_matcher)
+            right_empty = other is _MISSING or _is_empty_after_ignore(other, child_matcher)
+            if left_empty or right_empty:
+                if left_empty and right_empty:
+                    continue
+                return False
+            if not _values_equal_ignoring_fields(value, other, child_matcher):
+                return False
+        elif other is _MISSING or not values_equal(value, other):
+            return False
+    for key, other in right.items():
+        if key in left or key in fields:
+            continue
+        if key in children and _is_empty_after_ignore(other, children[key]):
+            continue
+        return False
+    return True
+
+def values_equal_ignoring_fields(left, right, ignore_config) -> bool:
+    """结构化比较两个对象在移除忽略字段后是否相等
+
+    结果与分别调用 remove_ignore_fields 后再比较一致，但不复制、不修改原对象，
+    并且在遇到第一个差异时立即返回。ignore_config 可以是字段树或已编译的 IgnoreFieldMatcher。
+    """
+    return _values_equal_ignoring_fields(left, right, compile_ignore_fields(ignore_config))
+
 def set_value(dictionary: dict, keys: str, value: Any):
     """根据 key 序列设置字典值
 
@@ -2,10 +2,22 @@
 #-*- coding:utf-8 -*-
 
 import os
+import functools
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable
-import yaml
-from utils.shell_utils import run_cmd
+from utils.shell_utils import open_cmd_stream, run_cmd
 from utils.dict_utils import parse_selector
+from utils.output_utils import FAILURE_EXIT_CODE, print_status
+from utils.json_utils import load_json, loads_json
+from utils.kube_client import KubeApiError, KubeClientUnavailable, create_kube_client
+from utils.yaml_utils import iter_yaml_documents
+from utils.render_cache import (TeeReader, build_render_cache_key, is_local_path,
+                                is_render_cache_enabled, open_render_cache,
+                                render_cache_writer)
+from utils.release_cache import (build_release_cache_key, read_release_profile,
+                                 write_release_profile)
 
 K8S_KINDS = ['PodDisruptionBudget', 'ServiceAccount', 'Secret', 'ConfigMap',
              'PersistentVolume', 'PersistentVolumeClaim', 'Role', 'RoleBinding',
@@ -13,6 +25,30 @@ K8S_KINDS = ['PodDisruptionBudget', 'ServiceAccount', 'Secret', 'ConfigMap',
              'HorizontalPodAutoscaler', 'CronJob', 'Job', 'Ingress',
              'NetworkPolicy', 'Endpoints']
 
+# 单条 kubectl get 命令中对象名称的数量和总字节数上限，避免超出系统命令行参数长度限制
+KUBECTL_GET_MAX_NAMES = 200
+KUBECTL_GET_MAX_NAMES_BYTES = 32 * 1024
+
+# 并发执行 kubectl get 查询运行时对象的默认线程数
+DEFAULT_FETCH_PARALLELISM = 4
+
+# 等待 Deployment 滚动更新完成的默认总时长（秒）
+DEFAULT_ROLLOUT_TIMEOUT = 100
+
+# 同时进行滚动更新的 Deployment 默认数量上限
+DEFAULT_MAX_CONCURRENT_ROLLOUTS = 5
+
+# 按 namespace 逐个查询时的 namespace 数量上限，超过时改为一次 --all-namespaces 查询
+MAX_RELEASE_FETCH_NAMESPACES = 10
+
+HELM_MANAGED_BY_SELECTOR = 'app.kubernetes.io/managed-by=Helm'
+
+# 原生客户端未启用、不支持该 kind 或无法连接 API Server 时的返回值，调用方改用 kubectl
+NATIVE_CLIENT_SKIPPED = object()
+
+_native_kube_clients = {}
+_native_kube_clients_lock = threading.Lock()
+
 CLUSTER_SCOPED_KINDS = {
     'ClusterRole',
     'ClusterRoleBinding',
@@ -41,6 +77,23 @@ def configure_kube_options(namespace=None,
     if timeout:
         os.environ['FINE_UPGRADE_TIMEOUT'] = timeout
 
+def get_namespace_option() -> str:
+    """命令行 --namespace 指定的 namespace，未指定时返回 None"""
+    return os.environ.get('FINE_UPGRADE_NAMESPACE_OPTION') or None
+
+def use_recorded_namespace(namespace: str, source: str) -> None:
+    """使用计划文件或快照中记录的 Release namespace
+
+    命令行显式指定的 --namespace 与记录的 namespace 不一致时打印原因并以非 0 状态退出，
+    避免在其它 namespace 中执行。
+    """
+    namespace_option = get_namespace_option()
+    if namespace_option is not None and namespace_option != namespace:
+        print_status(f'{source}中记录的 Release namespace 为 {namespace}，'
+                     f'与 --namespace {namespace_option} 不一致')
+        raise SystemExit(FAILURE_EXIT_CODE)
+    configure_kube_options(namespace=namespace)
+
 def get_kubeconfig():
     return os.environ.get('FINE_UPGRADE_KUBECONFIG')
 
@@ -50,6 +103,68 @@ def get_kube_context():
 def get_kube_timeout():
     return os.environ.get('FINE_UPGRADE_TIMEOUT')
 
+def get_fetch_parallelism() -> int:
+    parallelism = os.environ.get('FINE_UPGRADE_PARALLELISM')
+    if not parallelism:
+        return DEFAULT_FETCH_PARALLELISM
+    return max(1, int(parallelism))
+
+def get_rollout_timeout() -> int:
+    rollout_timeout = os.environ.get('FINE_UPGRADE_ROLLOUT_TIMEOUT')
+    if not rollout_timeout:
+        return DEFAULT_ROLLOUT_TIMEOUT
+    return max(1, int(rollout_timeout))
+
+def is_native_kube_client_enabled() -> bool:
+    return os.environ.get('FINE_UPGRADE_NATIVE_CLIENT', '0') == '1'
+
+def get_native_kube_client():
+    """返回当前 kubeconfig、context 和超时参数对应的原生客户端，同一组参数只创建一次
+
+    Returns:
+        KubeClient: 未启用原生客户端或 kubeconfig 不受支持时返回 None
+    """
+    if not is_native_kube_client_enabled():
+        return None
+    key = (get_kubeconfig(), get_kube_context(), get_kube_timeout())
+    with _native_kube_clients_lock:
+        if key not in _native_kube_clients:
+            try:
+                client = create_kube_client(*key, pool_size=get_fetch_parallelism())
+            except KubeClientUnavailable as e:
+                print_status(f'无法使用原生 Kubernetes 客户端，改用 kubectl: {e}')
+                client = None
+            _native_kube_clients[key] = client
+        return _native_kube_clients[key]
+
+def disable_native_kube_client(client, error) -> None:
+    with _native_kube_clients_lock:
+        for key, cached_client in list(_native_kube_clients.items()):
+            if cached_client is client:
+                print_status(f'原生 Kubernetes 客户端不可用，改用 kubectl: {error}')
+                _native_kube_clients[key] = None
+                client.close()
+
+def call_native_kube_client(kind: str, operation):
+    """使用原生客户端执行 operation(client)
+
+    API Server 返回的错误以 KubeApiError 抛出，由调用方处理；无法连接 API Server 时
+    本次运行不再使用原生客户端。
+
+    Returns:
+        operation 的返回值；未启用原生客户端、不支持该 kind、集群未提供该 kind 的 apiVersion 或无法连接时返回 NATIVE_CLIENT_SKIPPED
+    """
+    client = get_native_kube_client()
+    if client is None:
+        return NATIVE_CLIENT_SKIPPED
+    try:
+        if not client.supports(kind):
+            return NATIVE_CLIENT_SKIPPED
+        return operation(client)
+    except KubeClientUnavailable as e:
+        disable_native_kube_client(client, e)
+        return NATIVE_CLIENT_SKIPPED
+
 def append_helm_global_args(cmd: list) -> list:
     cmd = list(cmd)
     cmd.extend(['--namespace', get_helm_namespace()])
@@ -84,16 +199,95 @@ def build_helm_template_cmd(release_name: str, chart_path: str, values: str = No
         cmd.extend(['-f', values])
     return append_helm_global_args(cmd)
 
+@functools.lru_cache(maxsize=None)
+def get_helm_version() -> str:
+    cmd_output = run_cmd(['helm', 'version', '--short'])
+    if cmd_output is None:
+        return None
+    return cmd_output.strip()
+
+def get_render_cache_key(release_name: str, chart_path: str, values: str = None) -> str:
+    if not is_render_cache_enabled():
+        return None
+    # 仓库中的 chart 引用不缓存，无需执行 helm version
+    if not is_local_path(chart_path) or (values is not None and not is_local_path(values)):
+        return None
+    helm_version = get_helm_version()
+    if helm_version is None:
+        return None
+    return build_render_cache_key(
+        build_helm_template_cmd(release_name, chart_path, values),
+        chart_path, values, helm_version)
+
+def iter_helm_template_manifests(release_name: str, chart_path: str, values: str = None):
+    """流式执行 helm template，在 helm 仍在输出时逐个产出渲染出的 manifest
+
+    本地 chart 的渲染结果会按内容摘要缓存到磁盘，命中缓存时直接从缓存文件解析。
+    命令执行失败时抛出 subprocess.CalledProcessError。
+    """
+    cache_key = get_render_cache_key(release_name, chart_path, values)
+    if cache_key is not None:
+        cache_file = open_render_cache(cache_key)
+        if cache_file is not None:
+            with cache_file:
+                yield from iter_yaml_documents(cache_file)
+            return
+
+    cmd = build_helm_template_cmd(release_name, chart_path, values)
+    if cache_key is None:
+        with open_cmd_stream(cmd) as stream:
+            yield from iter_yaml_documents(stream)
+        return
+    with render_cache_writer(cache_key) as cache_file:
+        with open_cmd_stream(cmd) as stream:
+            if cache_file is not None:
+                stream = TeeReader(stream, cache_file)
+            yield from iter_yaml_documents(stream)
+
+def render_helm_template_manifests(release_name: str, chart_path: str, values: str = None) -> list:
+    """执行 helm template 并流式解析全部 manifest
+
+    Returns:
+        list: 渲染出的 manifest，命令执行失败时返回 None
+    """
+    try:
+        return list(iter_helm_template_manifests(release_name, chart_path, values))
+    except subprocess.CalledProcessError:
+        return None
+
 def build_helm_get_manifest_cmd(release_name: str) -> list:
     return append_helm_global_args(['helm', 'get', 'manifest', release_name])
 
-def get_release_manifests(release_name: str) -> list:
+def iter_release_manifests(release_name: str, quiet: bool = False):
+    """边执行 helm get manifest 边逐个产出 manifest，命令失败时抛出 CalledProcessError"""
+    with open_cmd_stream(build_helm_get_manifest_cmd(release_name), quiet=quiet) as stream:
+        yield from iter_yaml_documents(stream)
+
+def get_release_manifests(release_name: str, quiet: bool = False) -> list:
     """Read manifests stored in Helm release history."""
-    cmd_output = run_cmd(build_helm_get_manifest_cmd(release_name))
-    if cmd_output is None:
+    try:
+        return list(iter_release_manifests(release_name, quiet=quiet))
+    except subprocess.CalledProcessError:
         return None
-    return [manifest for manifest in yaml.safe_load_all(cmd_output)
-            if manifest is not None]
+
+def build_helm_history_cmd(release_name: str) -> list:
+    return append_helm_global_args(['helm', 'history', release_name, '--max', '1', '-o', 'json'])
+
+def get_release_version(release_name: str) -> dict:
+    """获取 Release 当前版本的 revision、更新时间以及 chart
+
+    Release 被卸载后重新安装时 revision 会从 1 重新计数，因此需要同时比较更新时间和 chart
+    才能判断 Release 是否变化。Release 不存在或命令执行失败时返回 None
+    """
+    try:
+        with open_cmd_stream(build_helm_history_cmd(release_name), quiet=True) as stream:
+            history = load_json(stream)
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+    if not history:
+        return None
+    latest = history[-1]
+    return {key: latest.get(key) for key in ('revision', 'updated', 'chart')}
 
 def get_manifest_namespace(manifest: dict) -> str:
     kind = manifest['kind']
@@ -103,51 +297,287 @@ def get_manifest_namespace(manifest: dict) -> str:
         return ''
     return get_helm_namespace()
 
+def get_manifest_lookup_ref(manifest: dict) -> tuple:
+    """返回用于到集群中查找对象的 (kind, name, namespace)，未声明 namespace 时为 None"""
+    metadata = manifest['metadata']
+    return manifest['kind'], metadata['name'], metadata.get('namespace')
+
 def get_api_object_spec(kind, name, namespace):
     """
-    根据元信息，使用 kubectl 获取API对象的 yaml 配置
+    根据元信息，使用原生客户端或 kubectl 获取API对象的配置
     """
-    cmd = ['get', kind, name, '-o', 'yaml']
+    try:
+        manifest = call_native_kube_client(
+            kind, lambda client: client.get(kind, name, namespace))
+    except KubeApiError as e:
+        print(f'获取 {kind} {name} 失败: {e}')
+        return None
+    if manifest is not NATIVE_CLIENT_SKIPPED:
+        return manifest
+    cmd = ['get', kind, name, '-o', 'json']
     if namespace is not None:
         cmd.extend(['-n', namespace])
     cmd_output = run_cmd(build_kubectl_cmd(cmd))
     if cmd_output is not None:
-        return yaml.safe_load(cmd_output)
+        return loads_json(cmd_output)
     else:
         return None
-    
-def get_all_release_api_objects(release_name) -> list:
+
+def chunk_object_names(names: list,
+                       max_names: int = KUBECTL_GET_MAX_NAMES,
+                       max_bytes: int = KUBECTL_GET_MAX_NAMES_BYTES) -> list:
+    """把对象名称切分成多组，每组的数量和总长度都不超过上限"""
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for name in names:
+        name_bytes = len(name.encode('utf-8')) + 1
+        if chunk and (len(chunk) >= max_names or chunk_bytes + name_bytes > max_bytes):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(name)
+        chunk_bytes += name_bytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def get_api_objects_by_names(kind: str, names: list, namespace) -> dict:
+    """使用一条 kubectl get 命令获取同一 kind、namespace 下的多个对象
+
+    Returns:
+        dict: 对象名称到配置的映射，不存在的对象不会出现在结果中；命令执行失败时返回 None
+    """
+    def get_by_names(client) -> dict:
+        # 原生客户端复用连接逐个查询，单次请求的开销远小于启动一次 kubectl
+        objects = {}
+        for name in names:
+            manifest = client.get(kind, name, namespace)
+            if manifest is not None:
+                objects[name] = manifest
+        return objects
+
+    try:
+        objects = call_native_kube_client(kind, get_by_names)
+    except KubeApiError as e:
+        print(f'获取 {kind} 对象失败: {e}')
+        return None
+    if objects is not NATIVE_CLIENT_SKIPPED:
+        return objects
+    cmd = ['get', kind] + list(names) + ['--ignore-not-found', '-o', 'json']
+    if namespace is not None:
+        cmd.extend(['-n', namespace])
+    cmd_output = run_cmd(build_kubectl_cmd(cmd))
+    if cmd_output is None:
+        return None
+    document = loads_json(cmd_output) if cmd_output.strip() else None
+    if not document:
+        return {}
+    # 只查询一个名称时 kubectl 直接输出对象本身，多个名称时输出 List
+    if document.get('kind') == 'List':
+        items = document.get('items') or []
+    else:
+        items = [document]
+    return {item['metadata']['name']: item for item in items}
+
+def get_api_object_specs(refs: Iterable) -> dict:
+    """批量获取 API 对象配置，按 kind 和 namespace 分组，每组只执行一条 kubectl get 命令
+
+    Args:
+        refs (Iterable): (kind, name, namespace) 元组，namespace 为 None 时使用 kubectl 的默认 namespace
+
+    Returns:
+        dict: (kind, name, namespace) 到对象配置的映射，集群中不存在的对象不会出现在结果中
+    """
+    groups = {}
+    for kind, name, namespace in refs:
+        groups.setdefault((kind, namespace), {})[name] = None
+    manifests = {}
+    for (kind, namespace), names in groups.items():
+        for chunk in chunk_object_names(list(names)):
+            objects = get_api_objects_by_names(kind, chunk, namespace)
+            if objects is None and len(chunk) > 1:
+                # 整组查询失败（例如只对部分对象有权限）时退回逐个查询
+                objects = {}
+                for name in chunk:
+                    manifest = get_api_object_spec(kind, name, namespace)
+                    if manifest is not None:
+                        objects[name] = manifest
+            for name in chunk:
+                if objects and name in objects:
+                    manifests[(kind, name, namespace)] = objects[name]
+    return manifests
+
+def summarize_release_manifests(manifests: list) -> dict:
+    """统计 manifest 中出现的 kind 和 namespace
+
+    Returns:
+        dict: 概况，manifests 为空时返回 None
+    """
+    # 只遍历一次，manifests 可以是生成器或磁盘上的 SqliteManifestStore
+    kinds = set()
+    namespaces = set()
+    for manifest in manifests or []:
+        if manifest is None:
+            continue
+        kinds.add(manifest['kind'])
+        namespaces.add(get_manifest_namespace(manifest))
+    if not kinds:
+        return None
+    namespaces.discard('')
+    return {
+        'kinds': sorted(kinds),
+        'namespaces': sorted(namespaces),
+    }
+
+def get_release_manifest_profile(release_name: str) -> dict:
+    """获取 Release 中保存的 manifest 概况
+
+    概况按 Release 的 revision、更新时间以及 chart 缓存在本地，三者都未变化时不再执行
+    helm get manifest。
+    """
+    version = get_release_version(release_name)
+    if version is None:
+        return None
+    cache_key = build_release_cache_key(build_helm_get_manifest_cmd(release_name))
+    profile = read_release_profile(cache_key, version)
+    if profile is not None:
+        return profile
+    profile = summarize_release_manifests(get_release_manifests(release_name, quiet=True))
+    if profile is not None:
+        write_release_profile(cache_key, version, profile)
+    return profile
+
+def plan_release_api_object_fetch(release_name: str,
+                                  manifests: list = None,
+                                  release_manifests: list = None) -> dict:
+    """根据渲染结果和 Release 中保存的 manifest 规划运行时对象的查询范围
+
+    Release 接管的对象只会出现在 Helm namespace 以及这些 manifest 指定的 namespace 中，
+    也只需要查询这些 manifest 中出现过的 kind。标签选择器只使用 managed-by=Helm：
+    运行时对象的 instance 标签可能被修改或缺失（例如 set-ownership-metadata 接管的对象），
+    是否属于当前 Release 由调用方按 Release 注解过滤。
+
+    Args:
+        release_name (str): release name
+        manifests (list): 渲染出的 manifest，可选
+        release_manifests (list): helm get manifest 的结果，未传入时使用按 revision 缓存的概况
+
+    Returns:
+        dict: kinds 为需要查询的 kind 列表；namespaces 为需要查询的 namespace 列表，
+            为 None 时查询所有 namespace；selector 为标签选择器
+    """
+    if release_manifests is None:
+        release_profile = get_release_manifest_profile(release_name)
+    else:
+        release_profile = summarize_release_manifests(release_manifests)
+    profiles = [profile for profile in (
+        release_profile, summarize_release_manifests(manifests)) if profile]
+    if not profiles:
+        return {'kinds': list(K8S_KINDS), 'namespaces': None,
+                'selector': HELM_MANAGED_BY_SELECTOR}
+
+    kinds = set()
+    namespaces = {get_helm_namespace()}
+    for profile in profiles:
+        kinds.update(profile['kinds'])
+        namespaces.update(profile['namespaces'])
+    return {
+        'kinds': [kind for kind in K8S_KINDS if kind in kinds],
+        'namespaces': sorted(namespaces) if len(namespaces) <= MAX_RELEASE_FETCH_NAMESPACES else None,
+        'selector': HELM_MANAGED_BY_SELECTOR,
+    }
+
+def is_release_api_object(manifest: dict, release_name: str) -> bool:
+    annotations = manifest['metadata'].get('annotations') or {}
+    return annotations.get('meta.helm.sh/release-name') == release_name and \
+        annotations.get('meta.helm.sh/release-namespace') == get_helm_namespace()
+
+def fetch_api_objects(kind: str, scope: list, selector: str) -> list:
+    """使用一次 List 请求或一条 kubectl get 获取一种 kind 的对象
+
+    Args:
+        scope (list): namespace 相关参数，例如 ['-n', 'demo']、['--all-namespaces']，集群级对象为 []
+
+    Returns:
+        list: 对象配置列表；查询失败时抛出 KubeApiError 或 subprocess.CalledProcessError
+    """
+    namespace = scope[1] if scope[:1] == ['-n'] else None
+    items = call_native_kube_client(
+        kind, lambda client: client.list(kind, namespace, label_selector=selector))
+    if items is not NATIVE_CLIENT_SKIPPED:
+        return items
+    cmd = build_kubectl_cmd(['get', kind] + scope + ['-l', selector, '-o', 'json'])
+    with open_cmd_stream(cmd, quiet=True) as stream:
+        document = load_json(stream)
+    return (document or {}).get('items') or []
+
+def get_all_release_api_objects(release_name: str,
+                                manifests: list = None,
+                                release_manifests: list = None,
+                                failures: list = None) -> list:
     """获取集群中所有由 Helm Release 管理的 API 对象
 
+    只查询 plan_release_api_object_fetch 规划出的 kind、namespace 和标签范围，
+    无法确定范围时回退为查询所有 namespace。每种 kind（以及每个 namespace）单独执行
+    一条 kubectl get，并按 --parallelism 并发执行；单条查询失败不影响其它查询的结果。
+
     Args:
         release_name (string): release name
+        manifests (list): 渲染出的 manifest，用于确定查询范围，可选
+        release_manifests (list): helm get manifest 的结果，未传入时自动获取
+        failures (list): 可选，传入时追加查询失败的 kind、namespace 和错误信息
 
     Returns:
         list: API 对象配置列表
     """
-    kinds = ','.join(K8S_KINDS)
-    cmd = ['get', kinds, '--all-namespaces',
-           '-l', 'app.kubernetes.io/managed-by=Helm', '-o', 'yaml']
-    cmd_output = run_cmd(build_kubectl_cmd(cmd))
-    if cmd_output is not None:
-        release_runtime_manifests = []
-        manifests = yaml.safe_load(cmd_output).get('items', [])
-        for manifest in manifests:
-            if 'annotations' not in manifest['metadata']:
-                continue
-            annotations = manifest['metadata']['annotations']
-            if 'meta.helm.sh/release-name' not in annotations or 'meta.helm.sh/release-namespace' not in annotations:
-                continue
-            manifest_release_name = annotations['meta.helm.sh/release-name']
-            manifest_release_namespace = annotations['meta.helm.sh/release-namespace']
-            if manifest_release_name != release_name or manifest_release_namespace != get_helm_namespace():
-                continue
-            else:
-                release_runtime_manifests.append(manifest)
-        return release_runtime_manifests                                    
+    fetch_plan = plan_release_api_object_fetch(release_name, manifests, release_manifests)
+    if fetch_plan['namespaces'] is None:
+        scopes = [['--all-namespaces']]
     else:
+        scopes = [['-n', namespace] for namespace in fetch_plan['namespaces']]
+    tasks = []
+    for kind in fetch_plan['kinds']:
+        if kind in CLUSTER_SCOPED_KINDS:
+            tasks.append((kind, []))
+        else:
+            tasks.extend((kind, scope) for scope in scopes)
+    if not tasks:
         return []
 
+    release_runtime_manifests = {}
+    with ThreadPoolExecutor(max_workers=min(get_fetch_parallelism(), len(tasks))) as executor:
+        futures = [executor.submit(fetch_api_objects, kind, scope, fetch_plan['selector'])
+                   for kind, scope in tasks]
+        for (kind, scope), future in zip(tasks, futures):
+            try:
+                items = future.result()
+            except (subprocess.CalledProcessError, KubeApiError) as e:
+                namespace = scope[1] if scope[:1] == ['-n'] else ('*' if scope else '')
+                error = (e.stderr or '').strip() if isinstance(e, subprocess.CalledProcessError) \
+                    else e.message
+                print_status(f'获取 {kind} 对象失败（namespace: {namespace or "-"}）: {error}')
+                if failures is not None:
+                    failures.append({'kind': kind, 'namespace': namespace, 'error': error})
+                continue
+            for manifest in items:
+                if is_release_api_object(manifest, release_name):
+                    release_runtime_manifests[get_manifest_unique_key(manifest)] = manifest
+    return list(release_runtime_manifests.values())
+
+def get_complete_release_api_objects(release_name: str, manifests: list = None) -> list:
+    """获取集群中所有由 Helm Release 管理的 API 对象，任一 kind 查询失败时以非 0 状态退出
+
+    基于不完整的运行时对象会把已存在的对象误判为缺失，修改集群或 values 文件的命令
+    使用此函数，避免在部分查询失败时继续执行。
+    """
+    failures = []
+    release_api_objects = get_all_release_api_objects(release_name, manifests, failures=failures)
+    if failures:
+        print_status(f'{len(failures)} 项运行时对象查询失败，已中止')
+        raise SystemExit(FAILURE_EXIT_CODE)
+    return release_api_objects
+
 def get_manifest_unique_key(manifest: dict) -> str:
     """从 Manifest 中提取唯一 key
 
@@ -204,8 +634,61 @@ def get_image_version(manifest: dict) -> str:
         return ''
     return next(iter(versions.values()))
 
+HASH_SUFFIX_CHARACTERS = frozenset('0123456789abcdef')
+
+def split_hash_suffix(key: str) -> tuple:
+    """把对象唯一 key 按最后一个 `-` 分成基础名称和末尾 hash
+
+    Returns:
+        tuple: (基础名称, hash)，没有 `-` 或末尾不是 16 进制数值时返回 None
+    """
+    parts = key.rsplit('-', 1)
+    if len(parts) != 2 or not HASH_SUFFIX_CHARACTERS.issuperset(parts[1].lower()):
+        return None
+    return parts[0], parts[1]
+
+class HashSuffixKeyIndex:
+    """按去掉末尾 hash 的基础名称和 hash 长度索引对象唯一 key，常用于 Helm 中 ConfigMap 的匹配
+
+    索引只需建立一次，每次查找只访问基础名称相同的候选 key；匹配后用 discard 移除，
+    避免同一个对象被重复匹配。
+    """
+
+    def __init__(self, keys: Iterable = ()):
+        self.candidates = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str) -> None:
+        parts = split_hash_suffix(key)
+        if parts is not None:
+            # 用 dict 保存候选 key，保留插入顺序且可以 O(1) 移除
+            self.candidates.setdefault((parts[0], len(parts[1])), {})[key] = None
+
+    def discard(self, key: str) -> None:
+        parts = split_hash_suffix(key)
+        if parts is None:
+            return
+        index_key = (parts[0], len(parts[1]))
+        candidates = self.candidates.get(index_key)
+        if candidates is None:
+            return
+        candidates.pop(key, None)
+        if not candidates:
+            del self.candidates[index_key]
+
+    def find(self, object_key: str) -> str:
+        """返回第一个只是末尾 hash 不同的 key，没有时返回 None"""
+        parts = split_hash_suffix(object_key)
+        if parts is None:
+            return None
+        candidates = self.candidates.get((parts[0], len(parts[1])))
+        return next(iter(candidates), None) if candidates else None
+
 def find_first_same_object_key_with_different_hash(keys: Iterable, object_key: str) -> str:
-    """从 keys 中寻找只是末尾 hash 不同的对象唯一 key，常用语 Helm 中 ConfigMap 的匹配
+    """从 keys 中寻找只是末尾 hash 不同的对象唯一 key
+
+    每次调用都要遍历全部 keys，需要多次查找时应使用 HashSuffixKeyIndex。
 
     Args:
         keys (Iterable): 可用于遍历的 keys，可以是 list 或 set
@@ -214,27 +697,7 @@ def find_first_same_object_key_with_different_hash(keys: Iterable, object_key: s
     Returns:
         str: 匹配到的第一个 key
     """
-    # print(f'keys: {keys}, object_key: {object_key}')
-    for key in keys:
-        # key 长度不同，排除
-        if len(key) != len(object_key):
-            continue
-        # 分隔最后一个 ·-· 符号，符号前为对象基础名称，符号后为 hash
-        key_parts = key.rsplit("-", 1)
-        object_key_parts = object_key.rsplit("-", 1)
-        # 没有 `-`` 符号，排除
-        if len(key_parts) != 2 or len(object_key_parts) != 2:
-            continue 
-        # 对象名部分必须相等，否则跳过
-        if key_parts[0] != object_key_parts[0]:
-            continue
-        # print(f"any: {any(c not in '0123456789abcdef' for c in key.lower())}")
-        # hash 部分只能包含16进制数值，否则跳过
-        if any(c not in '0123456789abcdef' for c in key_parts[1].lower()) or any(c not in '0123456789abcdef' for c in object_key_parts[1].lower()):
-            continue
-        # 找到满足的 key
-        return key
-    return None
+    return HashSuffixKeyIndex(keys).find(object_key)
 
 def is_manifest_match_selector(manifest: dict, selector: str) -> bool:
     if not selector:
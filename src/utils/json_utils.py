@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import json
+
+# 安装了 orjson 时使用 orjson 解析 kubectl/helm 的 JSON 输出，否则回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+def loads_json(data):
+    """解析 JSON 字符串或 bytes，格式错误时抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_json(stream):
+    """从类文件对象读取并解析 JSON"""
+    return loads_json(stream.read())
+
+def iter_json_documents(stream):
+    """逐个解析 kubectl get --watch -o json 输出的多个 JSON 文档
+
+    kubectl 以缩进格式输出每个文档，文档的结束括号位于行首，据此切分文档，
+    不需要等待命令结束。
+    """
+    lines = []
+    for line in stream:
+        lines.append(line)
+        if line.startswith('}'):
+            yield loads_json(''.join(lines))
+            lines = []
+
+def dumps_json(data) -> str:
+    """序列化为紧凑的 JSON 字符串，用于本地缓存等机器读取的文件"""
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import base64
+import contextlib
+import http.client
+import math
+import os
+import queue
+import re
+import ssl
+import tempfile
+import threading
+import urllib.parse
+from utils.json_utils import dumps_json, loads_json
+from utils.yaml_utils import load_yaml
+
+DEFAULT_POOL_SIZE = 4
+
+# kind 到 (apiVersion, 资源复数名, 是否属于 namespace) 的映射，
+# 每个 apiVersion 只在首次使用时通过 API 发现确认集群是否提供，替代 kubectl 每次执行时的 API 发现
+API_RESOURCES = {
+    'ConfigMap': ('v1', 'configmaps', True),
+    'Endpoints': ('v1', 'endpoints', True),
+    'Namespace': ('v1', 'namespaces', False),
+    'Node': ('v1', 'nodes', False),
+    'PersistentVolume': ('v1', 'persistentvolumes', False),
+    'PersistentVolumeClaim': ('v1', 'persistentvolumeclaims', True),
+    'Pod': ('v1', 'pods', True),
+    'Secret': ('v1', 'secrets', True),
+    'Service': ('v1', 'services', True),
+    'ServiceAccount': ('v1', 'serviceaccounts', True),
+    'DaemonSet': ('apps/v1', 'daemonsets', True),
+    'Deployment': ('apps/v1', 'deployments', True),
+    'ReplicaSet': ('apps/v1', 'replicasets', True),
+    'StatefulSet': ('apps/v1', 'statefulsets', True),
+    'HorizontalPodAutoscaler': ('autoscaling/v2', 'horizontalpodautoscalers', True),
+    'CronJob': ('batch/v1', 'cronjobs', True),
+    'Job': ('batch/v1', 'jobs', True),
+    'Ingress': ('networking.k8s.io/v1', 'ingresses', True),
+    'NetworkPolicy': ('networking.k8s.io/v1', 'networkpolicies', True),
+    'PodDisruptionBudget': ('policy/v1', 'poddisruptionbudgets', True),
+    'ClusterRole': ('rbac.authorization.k8s.io/v1', 'clusterroles', False),
+    'ClusterRoleBinding': ('rbac.authorization.k8s.io/v1', 'clusterrolebindings', False),
+    'Role': ('rbac.authorization.k8s.io/v1', 'roles', True),
+    'RoleBinding': ('rbac.authorization.k8s.io/v1', 'rolebindings', True),
+    'StorageClass': ('storage.k8s.io/v1', 'storageclasses', False),
+    'CustomResourceDefinition': ('apiextensions.k8s.io/v1', 'customresourcedefinitions', False),
+    'MutatingWebhookConfiguration': (
+        'admissionregistration.k8s.io/v1', 'mutatingwebhookconfigurations', False),
+    'ValidatingWebhookConfiguration': (
+        'admissionregistration.k8s.io/v1', 'validatingwebhookconfigurations', False),
+}
+
+TIMEOUT_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}
+# watch 请求的 socket 超时在服务端 timeoutSeconds 的基础上额外等待的秒数
+WATCH_SOCKET_TIMEOUT_MARGIN = 5
+
+class KubeClientUnavailable(Exception):
+    """kubeconfig 中的认证方式不受支持或无法连接 API Server，调用方应回退到 kubectl"""
+
+class KubeApiError(Exception):
+    """API Server 返回了错误状态码"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+def parse_timeout(value: str) -> float:
+    """解析 kubectl --request-timeout 格式的超时时间，例如 30s、1m、500ms，0 或未设置时返回 None"""
+    if not value:
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)(ms|s|m|h)?', value.strip())
+    if match is None:
+        raise KubeClientUnavailable(f'无法解析超时时间: {value}')
+    seconds = float(match.group(1)) * TIMEOUT_UNITS[match.group(2)]
+    return seconds or None
+
+def get_kubeconfig_paths(kubeconfig: str = None) -> list:
+    if kubeconfig:
+        return [kubeconfig]
+    env_paths = [path for path in os.environ.get('KUBECONFIG', '').split(os.pathsep) if path]
+    return env_paths or [os.path.join(os.path.expanduser('~'), '.kube', 'config')]
+
+def load_kubeconfig(paths: list) -> dict:
+    """按 kubectl 的规则合并多个 kubeconfig 文件，同名条目以先出现的为准
+
+    Returns:
+        dict: current-context 以及按名称索引的 clusters、users、contexts，
+            每个条目为 (配置, kubeconfig 所在目录)，用于解析相对路径
+    """
+    merged = {'current-context': None, 'clusters': {}, 'users': {}, 'contexts': {}}
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as config_file:
+                config = load_yaml(config_file) or {}
+        except OSError:
+            continue
+        base_dir = os.path.dirname(os.path.abspath(path))
+        merged['current-context'] = merged['current-context'] or config.get('current-context')
+        for section, field in (('clusters', 'cluster'), ('users', 'user'), ('contexts', 'context')):
+            for entry in config.get(section) or []:
+                merged[section].setdefault(entry['name'], (entry.get(field) or {}, base_dir))
+    return merged
+
+def _resolve_path(path: str, base_dir: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+def _read_credential(config: dict, base_dir: str, field: str) -> bytes:
+    """读取 kubeconfig 中 <field>-data（base64）或 <field>（文件路径）形式的证书内容"""
+    if config.get(f'{field}-data'):
+        return base64.b64decode(config[f'{field}-data'])
+    if config.get(field):
+        with open(_resolve_path(config[field], base_dir), 'rb') as credential_file:
+            return credential_file.read()
+    return None
+
+def build_ssl_context(cluster: dict, cluster_dir: str, user: dict, user_dir: str):
+    context = ssl.create_default_context()
+    if cluster.get('insecure-skip-tls-verify'):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        ca_data = _read_credential(cluster, cluster_dir, 'certificate-authority')
+        if ca_data is not None:
+            context.load_verify_locations(cadata=ca_data.decode('ascii'))
+    cert_data = _read_credential(user, user_dir, 'client-certificate')
+    key_data = _read_credential(user, user_dir, 'client-key')
+    if cert_data is not None and key_data is not None:
+        # ssl 只能从文件加载客户端证书，加载后立即删除临时文件
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cert_path = os.path.join(temp_dir, 'client.crt')
+            key_path = os.path.join(temp_dir, 'client.key')
+            for path, data in ((cert_path, cert_data), (key_path, key_data)):
+                with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), 'wb') as output_file:
+                    output_file.write(data)
+            context.load_cert_chain(cert_path, key_path)
+    return context
+
+def build_auth_headers(user: dict, user_dir: str) -> dict:
+    if user.get('exec') or user.get('auth-provider'):
+        raise KubeClientUnavailable('不支持 exec/auth-provider 认证方式')
+    token = user.get('token')
+    if not token and user.get('tokenFile'):
+        with open(_resolve_path(user['tokenFile'], user_dir), 'r', encoding='utf-8') as token_file:
+            token = token_file.read().strip()
+    if token:
+        return {'Authorization': f'Bearer {token}'}
+    if user.get('username'):
+        credentials = f'{user["username"]}:{user.get("password", "")}'.encode('utf-8')
+        return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+    return {}
+
+def create_kube_client(kubeconfig: str = None,
+                       context: str = None,
+                       timeout: str = None,
+                       pool_size: int = DEFAULT_POOL_SIZE):
+    """根据 kubeconfig、context 和超时时间创建客户端，参数含义与 kubectl 的同名参数一致
+
+    Raises:
+        KubeClientUnavailable: kubeconfig 缺失或使用了不支持的认证方式
+    """
+    config = load_kubeconfig(get_kubeconfig_paths(kubeconfig))
+    context_name = context or config['current-context']
+    if context_name not in config['contexts']:
+        raise KubeClientUnavailable(f'kubeconfig 中没有 context: {context_name}')
+    context_config, _ = config['contexts'][context_name]
+    if context_config.get('cluster') not in config['clusters']:
+        raise KubeClientUnavailable(f'kubeconfig 中没有 cluster: {context_config.get("cluster")}')
+    cluster, cluster_dir = config['clusters'][context_config['cluster']]
+    user, user_dir = config['users'].get(context_config.get('user'), ({}, None))
+    if not cluster.get('server'):
+        raise KubeClientUnavailable(f'cluster 没有配置 server: {context_config["cluster"]}')
+    try:
+        ssl_context = None
+        if cluster['server'].startswith('https://'):
+            ssl_context = build_ssl_context(cluster, cluster_dir, user, user_dir)
+        headers = build_auth_headers(user, user_dir)
+    except (OSError, ssl.SSLError, ValueError) as e:
+        raise KubeClientUnavailable(f'读取 kubeconfig 凭据失败: {e}') from e
+    return KubeClient(cluster['server'],
+                      ssl_context=ssl_context,
+                      headers=headers,
+                      namespace=context_config.get('namespace') or 'default',
+                      timeout=parse_timeout(timeout),
+                      pool_size=pool_size)
+
+class KubeClient:
+    """在进程内直接访问 Kubernetes API Server 的客户端
+
+    空闲连接放入连接池复用（HTTP keep-alive），避免每次请求都重新启动 kubectl、
+    解析 kubeconfig、建立 TLS 连接和执行 API 发现。每个连接同一时间只被一个线程使用。
+    """
+
+    def __init__(self, server: str,
+                 ssl_context=None,
+                 headers: dict = None,
+                 namespace: str = 'default',
+                 timeout: float = None,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        parsed = urllib.parse.urlsplit(server)
+        self.server = server
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.ssl_context = ssl_context
+        self.headers = dict(headers or {})
+        self.namespace = namespace
+        self.timeout = timeout
+        self.idle_connections = queue.LifoQueue(maxsize=pool_size)
+        self.served_resources = {}
+        self.discovery_lock = threading.Lock()
+
+    def get_served_resources(self, api_version: str) -> set:
+        """通过 API 发现获取集群在 api_version 下提供的资源复数名，结果按 apiVersion 缓存
+
+        集群未提供该 apiVersion 或无权访问时返回空集合。
+
+        Raises:
+            KubeClientUnavailable: 无法连接 API Server
+        """
+        with self.discovery_lock:
+            if api_version not in self.served_resources:
+                path = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+                try:
+                    document = self.request('GET', path) or {}
+                except KubeApiError:
+                    document = {}
+                self.served_resources[api_version] = {
+                    resource.get('name') for resource in document.get('resources') or []}
+            return self.served_resources[api_version]
+
+    def supports(self, kind: str) -> bool:
+        """kind 是否可以通过原生客户端访问
+
+        API_RESOURCES 中的 apiVersion 是固定的，集群不提供时路径会返回 404，
+        如果直接访问会被误当作对象不存在，因此先通过 API 发现确认。
+
+        Raises:
+            KubeClientUnavailable: 无法连接 API Server
+        """
+        if kind not in API_RESOURCES:
+            return False
+        api_version, plural, _ = API_RESOURCES[kind]
+        return plural in self.get_served_resources(api_version)
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire_connection(self):
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def _release_connection(self, connection) -> None:
+        try:
+            self.idle_connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def request(self, method: str, path: str, query: dict = None,
+                body: dict = None, content_type: str = 'application/json'):
+        """发送请求并解析 JSON 响应
+
+        Raises:
+            KubeApiError: API Server 返回错误状态码
+            KubeClientUnavailable: 无法连接 API Server
+        """
+        url = self.base_path + path
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        headers = dict(self.headers, Accept='application/json')
+        payload = None
+        if body is not None:
+            payload = dumps_json(body).encode('utf-8')
+            headers['Content-Type'] = content_type
+
+        for attempt in range(2):
+            connection = self._acquire_connection()
+            reused = connection.sock is not None
+            try:
+                connection.request(method, url, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # 复用的空闲连接可能已被服务端关闭，换一个新连接重试一次
+                if reused and attempt == 0:
+                    continue
+                raise KubeClientUnavailable(f'请求 {self.server} 失败: {e}') from e
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(connection)
+            break
+
+        document = None
+        if data:
+            with contextlib.suppress(ValueError):
+                document = loads_json(data)
+        if response.status >= 400:
+            message = document.get('message') if isinstance(document, dict) else None
+            raise KubeApiError(response.status,
+                               message or data.decode('utf-8', errors='replace').strip()
+                               or response.reason)
+        return document
+
+    def build_path(self, kind: str, namespace: str = None, name: str = None,
+                   api_version: str = None) -> str:
+        """拼接资源路径，namespace 为 None 时访问所有 namespace（集群级资源忽略 namespace）"""
+        default_api_version, plural, namespaced = API_RESOURCES[kind]
+        api_version = api_version or default_api_version
+        path = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+        if namespaced and namespace is not None:
+            path += '/namespaces/' + urllib.parse.quote(namespace, safe='')
+        path += '/' + plural
+        if name is not None:
+            path += '/' + urllib.parse.quote(name, safe='')
+        return path
+
+    def get(self, kind: str, name: str, namespace: str = None) -> dict:
+        """获取单个对象，namespace 为 None 时使用 context 的 namespace
+
+        Returns:
+            dict: 对象配置，不存在时返回 None
+        """
+        try:
+            return self.request('GET', self.build_path(kind, namespace or self.namespace, name))
+        except KubeApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list(self, kind: str, namespace: str = None, label_selector: str = None) -> list:
+        """列出对象，namespace 为 None 时列出所有 namespace 的对象
+
+        与 kubectl 一致，为每个对象补充 kind 和 apiVersion 字段。
+        """
+        query = {'labelSelector': label_selector} if label_selector else None
+        document = self.request('GET', self.build_path(kind, namespace), query=query) or {}
+        items = document.get('items') or []
+        api_version = document.get('apiVersion') or API_RESOURCES[kind][0]
+        for item in items:
+            item.setdefault('kind', kind)
+            item.setdefault('apiVersion', api_version)
+        return items
+
+    def merge_patch(self, kind: str, name: str, namespace: str, patch: dict) -> dict:
+        """使用 JSON merge patch 修改已有对象，namespace 为 None 时使用 context 的 namespace"""
+        path = self.build_path(kind, namespace or self.namespace, name)
+        return self.request('PATCH', path, body=patch,
+                            content_type='application/merge-patch+json')
+
+    def watch(self, kind: str, name: str = None, namespace: str = None,
+              resource_version: str = None, timeout: float = None):
+        """监听单个对象或 namespace 中全部对象的变更，逐个产出 (事件类型, 对象)
+
+        name 为 None 时监听 namespace 中的全部对象。watch 使用单独的连接，不放回连接池。
+        服务端在 timeout 秒后结束 watch，调用方提前退出时关闭连接。
+        """
+        query = {'watch': 'true'}
+        if name is not None:
+            query['fieldSelector'] = f'metadata.name={name}'
+        if resource_version:
+            query['resourceVersion'] = resource_version
+        socket_timeout = None
+        if timeout is not None:
+            query['timeoutSeconds'] = str(max(1, math.ceil(timeout)))
+            socket_timeout = timeout + WATCH_SOCKET_TIMEOUT_MARGIN
+        url = self.base_path + self.build_path(kind, namespace or self.namespace) + \
+            '?' + urllib.parse.urlencode(query)
+        connection = self._new_connection()
+        connection.timeout = socket_timeout
+        try:
+            try:
+                connection.request('GET', url, headers=dict(self.headers, Accept='application/json'))
+                response = connection.getresponse()
+                if response.status >= 400:
+                    data = response.read()
+                    raise KubeApiError(response.status,
+                                       data.decode('utf-8', errors='replace').strip()
+                                       or response.reason)
+                while True:
+                    line = response.readline()
+                    if not line:
+                        return
+                    if line.strip():
+                        event = loads_json(line)
+                        yield event.get('type'), event.get('object')
+            except (OSError, http.client.HTTPException) as e:
+                raise KubeClientUnavailable(f'监听 {self.server} 失败: {e}') from e
+        finally:
+            connection.close()
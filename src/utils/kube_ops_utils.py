@@ -1,11 +1,49 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
+import subprocess
+import threading
 import time
-import yaml
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from utils.shell_utils import run_cmd
-from utils.helm_utils import build_kubectl_cmd
+from utils.shell_utils import open_cmd_stream, run_cmd
+from utils.json_utils import iter_json_documents, loads_json
+from utils.output_utils import print_status
+from utils.yaml_utils import dump_all_yaml, dump_yaml
+from utils.kube_client import KubeApiError
+from utils.helm_utils import (NATIVE_CLIENT_SKIPPED, build_kubectl_cmd,
+                              call_native_kube_client, get_fetch_parallelism,
+                              get_rollout_timeout)
+
+# watch 意外结束后重新开始监听前等待的秒数
+ROLLOUT_WATCH_RETRY_INTERVAL = 1
+# 按依赖关系分批应用的资源类型，前一批全部应用成功后才开始下一批；未列出的类型与 Helm 一样最后应用
+APPLY_WAVES = (
+    ('namespaces', ('Namespace', 'CustomResourceDefinition')),
+    ('policies', ('PriorityClass', 'NetworkPolicy', 'ResourceQuota', 'LimitRange',
+                  'PodSecurityPolicy', 'PodDisruptionBudget')),
+    ('storage', ('StorageClass', 'PersistentVolume', 'PersistentVolumeClaim')),
+    ('config', ('ServiceAccount', 'Secret', 'ConfigMap', 'ClusterRole', 'ClusterRoleBinding',
+                'Role', 'RoleBinding')),
+    ('workloads', ('DaemonSet', 'Pod', 'ReplicationController', 'ReplicaSet', 'Deployment',
+                   'StatefulSet', 'Job', 'CronJob')),
+    ('services', ('Service', 'IngressClass', 'Ingress', 'HorizontalPodAutoscaler', 'APIService')),
+)
+APPLY_OTHER_WAVE = 'others'
+APPLY_WAVE_BY_KIND = {kind: wave for wave, kinds in APPLY_WAVES for kind in kinds}
+# helm install 的资源类型顺序，批内按此顺序排列，未列出的类型排在最后
+HELM_INSTALL_ORDER = (
+    'PriorityClass', 'Namespace', 'NetworkPolicy', 'ResourceQuota', 'LimitRange',
+    'PodSecurityPolicy', 'PodDisruptionBudget', 'ServiceAccount', 'Secret', 'SecretList',
+    'ConfigMap', 'StorageClass', 'PersistentVolume', 'PersistentVolumeClaim',
+    'CustomResourceDefinition', 'ClusterRole', 'ClusterRoleList', 'ClusterRoleBinding',
+    'ClusterRoleBindingList', 'Role', 'RoleList', 'RoleBinding', 'RoleBindingList', 'Service',
+    'DaemonSet', 'Pod', 'ReplicationController', 'ReplicaSet', 'Deployment',
+    'HorizontalPodAutoscaler', 'StatefulSet', 'Job', 'CronJob', 'IngressClass', 'Ingress',
+    'APIService')
+HELM_INSTALL_RANK = {kind: rank for rank, kind in enumerate(HELM_INSTALL_ORDER)}
+# 同一批中每条 kubectl apply 命令包含的资源数量上限
+APPLY_CHUNK_SIZE = 20
 
 def apply_manifests(rendered_manifests: List[dict]) -> None:
     """execute `kubectl apply -f` for the rendered manifests.
@@ -14,39 +52,272 @@ def apply_manifests(rendered_manifests: List[dict]) -> None:
         rendered_manifests (List[dict]): rendered manifests which will apply
     """
     apply_cmd = build_kubectl_cmd(['apply', '-f', '-'])
-    print(run_cmd(apply_cmd, input=yaml.dump_all(rendered_manifests, allow_unicode=True)))
+    print(run_cmd(apply_cmd, input=dump_all_yaml(rendered_manifests, allow_unicode=True)))
+
+def build_apply_waves(manifests: List[dict]) -> list:
+    """按 APPLY_WAVES 把 manifest 分批，批内按 HELM_INSTALL_ORDER 排序，同类型保持原有顺序
+
+    Returns:
+        list: (批次名称, manifest 列表) 元组，按应用顺序排列，不包含空的批次
+    """
+    wave_names = [wave for wave, _ in APPLY_WAVES] + [APPLY_OTHER_WAVE]
+    wave_manifests = {wave: [] for wave in wave_names}
+    for manifest in manifests:
+        wave_manifests[APPLY_WAVE_BY_KIND.get(manifest['kind'], APPLY_OTHER_WAVE)].append(manifest)
+    return [(wave, sorted(wave_manifests[wave],
+                          key=lambda manifest: HELM_INSTALL_RANK.get(
+                              manifest['kind'], len(HELM_INSTALL_ORDER))))
+            for wave in wave_names if wave_manifests[wave]]
+
+def apply_manifest_chunk(manifests: List[dict]) -> bool:
+    """使用一条 kubectl apply 应用一组 manifest，成功时返回 True"""
+    apply_cmd = build_kubectl_cmd(['apply', '-f', '-'])
+    output = run_cmd(apply_cmd, input=dump_all_yaml(manifests, allow_unicode=True))
+    if output is None:
+        return False
+    print(output)
+    return True
+
+def apply_manifests_in_waves(manifests: List[dict],
+                             parallelism: int = None,
+                             chunk_size: int = APPLY_CHUNK_SIZE) -> dict:
+    """按依赖关系分批应用 manifest，每批切分成多组并发执行 kubectl apply
+
+    某一批有任何一组失败时不再应用后面的批次。
+
+    Args:
+        parallelism (int): 同时执行的 apply 数量上限，默认使用 --parallelism
+        chunk_size (int): 每组包含的资源数量上限
+
+    Returns:
+        dict: 应用报告，包含汇总和每一批的资源数量、状态和耗时
+    """
+    parallelism = parallelism or get_fetch_parallelism()
+    waves = build_apply_waves(manifests)
+    report = {
+        'summary': {'waves': len(waves), 'applied': 0, 'failed': 0, 'skipped': 0},
+        'waves': [],
+    }
+    failed = False
+    for index, (wave, wave_manifests) in enumerate(waves, 1):
+        wave_report = {'name': wave, 'resources': len(wave_manifests)}
+        report['waves'].append(wave_report)
+        if failed:
+            wave_report['status'] = 'skipped'
+            report['summary']['skipped'] += len(wave_manifests)
+            continue
+        print_status(f'应用第 {index}/{len(waves)} 批 {wave}: {len(wave_manifests)} 个资源...')
+        chunks = [wave_manifests[start:start + chunk_size]
+                  for start in range(0, len(wave_manifests), chunk_size)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(chunks))) as executor:
+            results = list(executor.map(apply_manifest_chunk, chunks))
+        wave_report['chunks'] = len(chunks)
+        wave_report['seconds'] = round(time.monotonic() - started, 3)
+        for chunk, succeeded in zip(chunks, results):
+            report['summary']['applied' if succeeded else 'failed'] += len(chunk)
+        if all(results):
+            wave_report['status'] = 'applied'
+        else:
+            wave_report['status'] = 'failed'
+            failed = True
+            print_status(f'第 {index} 批 {wave} 应用失败，不再应用后续批次')
+    return report
+
+def apply_deployment(manifest, tracker=None) -> float:
+    """应用 Deployment 并等待滚动更新完成
+
+    Args:
+        tracker (DeploymentReadinessTracker): 可选，多个 Deployment 同时滚动更新时共享的就绪跟踪器
 
-def apply_deployment(manifest):
+    Returns:
+        float: 从应用完成到就绪的秒数
+    """
     name = manifest['metadata']['name']
     namespace = manifest['metadata']['namespace'] if 'namespace' in manifest['metadata'] else None
 
     apply_cmd = build_kubectl_cmd(['apply', '-f', '-'])
-    print(run_cmd(apply_cmd, input=yaml.dump(manifest, allow_unicode=True)))
+    output = run_cmd(apply_cmd, input=dump_yaml(manifest, allow_unicode=True))
+    if output is None:
+        raise Exception(f'{namespace}:{name} 应用失败！')
+    print(output)
 
-    try_times = 0
-    while try_times < 20:
-        if is_deployment_ready(name, namespace):
-            return
-        try_times += 1
-        time.sleep(5)
-    raise Exception(f'{namespace}:{name} 部署失败！')
+    time_to_ready = (tracker or DeploymentReadinessTracker()).wait(name, namespace)
+    if time_to_ready is None:
+        raise Exception(f'{namespace}:{name} 部署失败！')
+    return time_to_ready
 
-def is_deployment_ready(name, namespace=None) -> bool:
-    check_cmd = ['get', 'Deployment', name, '-o', 'yaml']
+def is_deployment_rollout_complete(deployment: dict) -> bool:
+    """控制器已处理最新的 spec，且 ready、updated、available 副本数都达到期望值"""
+    desired = deployment.get('spec', {}).get('replicas', 1)
+    status = deployment.get('status', {})
+    return status.get('observedGeneration', 0) >= deployment.get('metadata', {}).get('generation', 0) \
+        and status.get('readyReplicas', 0) >= desired \
+        and status.get('updatedReplicas', 0) >= desired \
+        and status.get('availableReplicas', 0) >= desired
+
+def watch_deployments_with_native_client(client, namespace, on_deployment, timeout) -> bool:
+    # 不指定 resourceVersion 时，服务端先以 ADDED 事件发送 namespace 中现有的全部 Deployment
+    for event_type, event_object in client.watch('Deployment', None, namespace, timeout=timeout):
+        if event_type == 'ERROR':
+            # resourceVersion 过期等错误，由调用方重新监听
+            return False
+        if event_type in ('ADDED', 'MODIFIED') and not on_deployment(event_object):
+            break
+    return True
+
+def watch_deployments_with_kubectl(namespace, on_deployment, timeout) -> bool:
+    watch_cmd = ['get', 'deployments', '-o', 'json', '--watch']
+    if namespace is not None:
+        watch_cmd.extend(['-n', namespace])
+    try:
+        with open_cmd_stream(build_kubectl_cmd(watch_cmd), timeout=timeout,
+                             kill_on_exit=True) as stream:
+            for deployment in iter_json_documents(stream):
+                if not on_deployment(deployment):
+                    break
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return False
+    return True
+
+def watch_deployments(namespace, on_deployment, timeout) -> bool:
+    """监听 namespace 下全部 Deployment 的状态变化，namespace 为 None 时使用 context 的 namespace
+
+    使用原生客户端的 watch API 或 kubectl get --watch，开始时先产出现有的全部 Deployment。
+    每观察到一个 Deployment 调用一次 on_deployment(deployment)，其返回 False 时停止监听。
+
+    Returns:
+        bool: 监听正常结束时返回 True，出错或超时时返回 False
+    """
+    try:
+        finished = call_native_kube_client(
+            'Deployment',
+            lambda client: watch_deployments_with_native_client(
+                client, namespace, on_deployment, timeout))
+    except KubeApiError as e:
+        print_status(f'监听 Deployment 失败: {e}')
+        return False
+    if finished is NATIVE_CLIENT_SKIPPED:
+        return watch_deployments_with_kubectl(namespace, on_deployment, timeout)
+    return finished
+
+def get_deployment(name, namespace=None) -> dict:
+    try:
+        deployment = call_native_kube_client(
+            'Deployment', lambda client: client.get('Deployment', name, namespace))
+    except KubeApiError as e:
+        print(f'获取 Deployment {name} 失败: {e}')
+        return None
+    if deployment is not NATIVE_CLIENT_SKIPPED:
+        return deployment
+    check_cmd = ['get', 'Deployment', name, '-o', 'json']
     if namespace is not None:
         check_cmd.extend(['-n', namespace])
     output = run_cmd(build_kubectl_cmd(check_cmd))
     if output is None:
+        return None
+    return loads_json(output)
+
+def is_deployment_ready(name, namespace=None) -> bool:
+    deployment = get_deployment(name, namespace)
+    if deployment is None:
         return False
-    deployment = yaml.safe_load(output)
-    desired = deployment.get('spec', {}).get('replicas', 1)
-    status = deployment.get('status', {})
-    return status.get('readyReplicas', 0) >= desired \
-        and status.get('updatedReplicas', 0) >= desired \
-        and status.get('availableReplicas', 0) >= desired
+    return is_deployment_rollout_complete(deployment)
+
+class DeploymentReadinessTracker:
+    """多个 Deployment 同时滚动更新时共享的就绪状态跟踪器
+
+    每个有等待者的 namespace 只建立一个 Deployment watch，后台线程把观察到的状态分发给
+    所有等待的线程，API Server 的负载不随同时进行的滚动更新数量增长，状态变化后立即唤醒
+    等待者。watch 意外结束时重新监听；namespace 没有等待者后线程自动退出。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.waiters = {}
+        self.watchers = {}
+        # 每个 namespace 中最晚的等待期限，用作 watch 的时长上限
+        self.deadlines = {}
+        # 观察序号，每观察到一个 Deployment 的状态加一
+        self.observed = 0
+        # (namespace, name) -> 最近一次观察到该 Deployment 已就绪时的观察序号
+        self.ready_observations = {}
+        # 每个 Deployment 每次等待的就绪耗时，按完成顺序记录
+        self.time_to_ready = []
+
+    def _has_waiters(self, namespace) -> bool:
+        return any(waiter_namespace == namespace for waiter_namespace, _ in self.waiters)
 
-def delete_deployment(namespace, name):
-    delete_cmd = ['delete', 'Deployment', name]
+    def _observe(self, namespace, deployment) -> bool:
+        """记录 watch 产出的 Deployment 状态并唤醒等待者，namespace 没有等待者时返回 False"""
+        key = (namespace, deployment['metadata']['name'])
+        with self.condition:
+            self.observed += 1
+            if is_deployment_rollout_complete(deployment):
+                self.ready_observations[key] = self.observed
+            else:
+                self.ready_observations.pop(key, None)
+            self.condition.notify_all()
+            return self._has_waiters(namespace)
+
+    def _watch(self, namespace) -> None:
+        while True:
+            with self.condition:
+                window = self.deadlines[namespace] - time.monotonic()
+                if not self._has_waiters(namespace) or window <= 0:
+                    del self.watchers[namespace]
+                    return
+            watch_deployments(
+                namespace, lambda deployment: self._observe(namespace, deployment), window)
+            # watch 提前结束（出错或被服务端关闭）时稍后重新监听
+            time.sleep(ROLLOUT_WATCH_RETRY_INTERVAL)
+
+    def wait(self, name, namespace=None, timeout=None) -> float:
+        """等待 Deployment 完成滚动更新，只采用开始等待之后观察到的状态
+
+        Returns:
+            float: 从开始等待到就绪的秒数，超过 timeout（默认使用 --rollout-timeout）时返回 None
+        """
+        key = (namespace, name)
+        started = time.monotonic()
+        deadline = started + (timeout or get_rollout_timeout())
+        with self.condition:
+            self.waiters[key] = self.waiters.get(key, 0) + 1
+            registered = self.observed
+            self.deadlines[namespace] = max(self.deadlines.get(namespace, deadline), deadline)
+            if namespace not in self.watchers:
+                self.watchers[namespace] = threading.Thread(
+                    target=self._watch, args=(namespace,), daemon=True)
+                self.watchers[namespace].start()
+        try:
+            # 已有的 watch 只在对象变化时产出事件，应用没有产生变化时需要先读取一次当前状态
+            ready = is_deployment_ready(name, namespace)
+            with self.condition:
+                while not (ready or self.ready_observations.get(key, 0) > registered):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+                time_to_ready = time.monotonic() - started
+                self.time_to_ready.append({'namespace': namespace, 'name': name,
+                                           'seconds': round(time_to_ready, 3)})
+                return time_to_ready
+        finally:
+            with self.condition:
+                self.waiters[key] -= 1
+                if not self.waiters[key]:
+                    del self.waiters[key]
+
+def delete_deployment(namespace, name) -> str:
+    """删除 Deployment，对象已不存在时视为成功
+
+    Returns:
+        str: kubectl 的输出，命令失败时返回 None
+    """
+    delete_cmd = ['delete', 'Deployment', name, '--ignore-not-found']
     if namespace is not None:
         delete_cmd.extend(['-n', namespace])
-    print(run_cmd(build_kubectl_cmd(delete_cmd)))
+    output = run_cmd(build_kubectl_cmd(delete_cmd))
+    if output is not None:
+        print(output)
+    return output
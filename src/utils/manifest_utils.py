@@ -3,68 +3,61 @@
 
 import itertools
 from typing import List
+from models.helm_model import ManifestIndex
+
+# 带有 Pod 模板的工作负载类型，按选择器选中后一并带出关联的存储、配置和 Service
+WORKLOAD_KINDS = ('Deployment', 'StatefulSet', 'DaemonSet', 'Job', 'CronJob')
+
+
+def get_pod_template(manifest: dict) -> dict:
+    """返回工作负载的 Pod 模板，CronJob 取 jobTemplate 中的模板，没有时返回空字典"""
+    spec = manifest.get('spec') or {}
+    if manifest.get('kind') == 'CronJob':
+        spec = (spec.get('jobTemplate') or {}).get('spec') or {}
+    return spec.get('template') or {}
+
+
+def get_pod_volumes(manifest: dict) -> List[dict]:
+    return (get_pod_template(manifest).get('spec') or {}).get('volumes') or []
+
 
 def parse_config_maps_in_deployment(manifest: dict) -> List[str]:
-    """解析 Deployment manifest 中关联的 ConfigMap
+    """解析工作负载 manifest 中关联的 ConfigMap
 
     Args:
-        manifest (dict): 传入 Deployment manifest
+        manifest (dict): 传入 Deployment、StatefulSet 等工作负载的 manifest
 
     Returns:
         List[str]: 关联的 ConfigMap 名称
     """
-    if 'spec' not in manifest:
-        return []
-    if 'template' not in manifest['spec']:
-        return []
-    if 'spec' not in manifest['spec']['template']:
-        return []
-    if 'volumes' not in manifest['spec']['template']['spec']:
-        return []
     return [volume['configMap']['name']
-            for volume in manifest['spec']['template']['spec']['volumes'] if 'configMap' in volume]
+            for volume in get_pod_volumes(manifest) if 'configMap' in volume]
 
 
 def parse_secrets_in_deployment(manifest: dict) -> List[str]:
-    """解析 Deployment manifest 中关联的 Secret
+    """解析工作负载 manifest 中关联的 Secret
 
     Args:
-        manifest (dict): 传入 Deployment manifest
+        manifest (dict): 传入 Deployment、StatefulSet 等工作负载的 manifest
 
     Returns:
         List[str]: 关联的 Secret 名称
     """
-    if 'spec' not in manifest:
-        return []
-    if 'template' not in manifest['spec']:
-        return []
-    if 'spec' not in manifest['spec']['template']:
-        return []
-    if 'volumes' not in manifest['spec']['template']['spec']:
-        return []
     return [volume['secret']['secretName']
-            for volume in manifest['spec']['template']['spec']['volumes'] if 'secret' in volume]
+            for volume in get_pod_volumes(manifest) if 'secret' in volume]
 
 
 def parse_pvcs_in_deployment(manifest: dict) -> List[str]:
-    """解析 Deployment manifest 中关联的 pvc
+    """解析工作负载 manifest 中关联的 pvc
 
     Args:
-        manifest (dict): 传入 Deployment manifest
+        manifest (dict): 传入 Deployment、StatefulSet 等工作负载的 manifest
 
     Returns:
         List[str]: 关联的 pvc 名称
     """
-    if 'spec' not in manifest:
-        return []
-    if 'template' not in manifest['spec']:
-        return []
-    if 'spec' not in manifest['spec']['template']:
-        return []
-    if 'volumes' not in manifest['spec']['template']['spec']:
-        return []
     return [volume['persistentVolumeClaim']['claimName']
-            for volume in manifest['spec']['template']['spec']['volumes']
+            for volume in get_pod_volumes(manifest)
             if 'persistentVolumeClaim' in volume]
 
 
@@ -100,16 +93,15 @@ def parse_pv_in_pvc(manifest: dict) -> str:
     return manifest['spec']['volumeName']
 
 
-def find_and_merge_related_rendered_manifests_of_deployments(
-        deployment_manifests: List[dict],
-        manifest_dict: dict,
-        service_unique_keys: List[str]) -> List[dict]:
-    """找出与 Deployment 关联的其他 manifest 资源
+def find_and_merge_related_rendered_manifests_of_workloads(
+        workload_manifests: List[dict],
+        manifest_index: ManifestIndex) -> List[dict]:
+    """找出与工作负载关联的其他 manifest 资源
 
     Args:
-        deployment_manifests (List[dict]): Deployment manifest 数组
-        manifest_dict (dict): 所有 manifest 的字典，key 为 kind:bamespace:name 格式
-        service_unique_keys (List[str]): svc 在字典中的唯一 key 数组
+        workload_manifests (List[dict]): 选中的 manifest 数组，只有 WORKLOAD_KINDS 中的类型会带出
+            PVC、Secret、ConfigMap 和 Service
+        manifest_index (ManifestIndex): 全部渲染结果的索引
 
     Returns:
         List[dict]: 合并后的 manifest 新数组
@@ -121,70 +113,69 @@ def find_and_merge_related_rendered_manifests_of_deployments(
     related_pvc_manifests = []
     related_service_manifests = []
     related_storageclass_manifests = []
-    unique_key_set = set()
+    # 已经直接选中的资源不再作为关联资源重复加入
+    unique_key_set = {manifest_index.key_of(manifest) for manifest in workload_manifests}
 
-    for rendered_manifest in deployment_manifests:
+    for rendered_manifest in workload_manifests:
         if 'namespace' in rendered_manifest['metadata']:
             namespace = rendered_manifest['metadata']['namespace']
         else:
             namespace = ''
 
-        # 提取 Deployment 关联的 Namespace
+        # 提取关联的 Namespace
         namespace_unique_key = f'Namespace::{namespace}'
-        if namespace_unique_key in manifest_dict and namespace_unique_key not in unique_key_set:
+        if namespace_unique_key in manifest_index and namespace_unique_key not in unique_key_set:
             related_namespace_manifests.append(
-                manifest_dict[namespace_unique_key])
+                manifest_index[namespace_unique_key])
             unique_key_set.add(namespace_unique_key)
 
-        # 提取 Deployment 关联的 PVC
+        if rendered_manifest.get('kind') not in WORKLOAD_KINDS:
+            continue
+
+        # 提取工作负载关联的 PVC
         for pvc_name in parse_pvcs_in_deployment(rendered_manifest):
             pvc_unique_key = f'PersistentVolumeClaim:{namespace}:{pvc_name}'
-            if pvc_unique_key in manifest_dict and pvc_unique_key not in unique_key_set:
-                pvc = manifest_dict[pvc_unique_key]
+            if pvc_unique_key in manifest_index and pvc_unique_key not in unique_key_set:
+                pvc = manifest_index[pvc_unique_key]
                 related_pvc_manifests.append(pvc)
                 unique_key_set.add(pvc_unique_key)
                 # 提取 PVC 关联的 StorageClass
                 storageclass_name = parse_storageclass_in_pvc(pvc)
                 if storageclass_name is not None:
                     sc_unique_key = f'StorageClass::{storageclass_name}'
-                    if sc_unique_key in manifest_dict and sc_unique_key not in unique_key_set:
+                    if sc_unique_key in manifest_index and sc_unique_key not in unique_key_set:
                         related_storageclass_manifests.append(
-                            manifest_dict[sc_unique_key])
+                            manifest_index[sc_unique_key])
                         unique_key_set.add(sc_unique_key)
                 else:
                     pv_name = parse_pv_in_pvc(pvc)
                     if pv_name is not None:
                         pv_unique_key = f'PersistentVolume::{pv_name}'
-                        if pv_unique_key in manifest_dict and pv_unique_key not in unique_key_set:
+                        if pv_unique_key in manifest_index and pv_unique_key not in unique_key_set:
                             related_storageclass_manifests.append(
-                                manifest_dict[pv_unique_key])
+                                manifest_index[pv_unique_key])
                             unique_key_set.add(pv_unique_key)
 
-        # 提取 Deployment 关联的 Secret
+        # 提取工作负载关联的 Secret
         for secret_name in parse_secrets_in_deployment(rendered_manifest):
             secret_unique_key = f'Secret:{namespace}:{secret_name}'
-            if secret_unique_key in manifest_dict and secret_unique_key not in unique_key_set:
+            if secret_unique_key in manifest_index and secret_unique_key not in unique_key_set:
                 related_secrets_manifests.append(
-                    manifest_dict[secret_unique_key])
+                    manifest_index[secret_unique_key])
                 unique_key_set.add(secret_unique_key)
-        # 提取 Deployment 关联的 ConfigMap
+        # 提取工作负载关联的 ConfigMap
         for configmap_name in parse_config_maps_in_deployment(rendered_manifest):
             configmap_unique_key = f'ConfigMap:{namespace}:{configmap_name}'
-            if configmap_unique_key in manifest_dict and configmap_unique_key not in unique_key_set:
+            if configmap_unique_key in manifest_index and configmap_unique_key not in unique_key_set:
                 related_configmap_manifests.append(
-                    manifest_dict[configmap_unique_key])
+                    manifest_index[configmap_unique_key])
                 unique_key_set.add(configmap_unique_key)
 
-        # 提取 Deployment 关联的 Service
-        pod_labels = rendered_manifest['spec']['template']['metadata']['labels']
-        for svc_key in service_unique_keys:
-            svc = manifest_dict[svc_key]
-            if 'selector' not in svc['spec']:
-                continue
-            svc_selector = svc['spec']['selector']
-            if svc_key not in unique_key_set and all(
-                    item in pod_labels.items() for item in svc_selector.items()):
-                related_service_manifests.append(svc)
+        # 通过标签索引提取选中工作负载 Pod 的 Service
+        pod_labels = (get_pod_template(rendered_manifest).get('metadata') or {}).get('labels')
+        for svc_key in manifest_index.find_services(pod_labels):
+            if svc_key not in unique_key_set:
+                related_service_manifests.append(manifest_index[svc_key])
                 unique_key_set.add(svc_key)
 
     return list(itertools.chain(related_namespace_manifests,
@@ -192,5 +183,17 @@ def find_and_merge_related_rendered_manifests_of_deployments(
                                 related_pvc_manifests,
                                 related_secrets_manifests,
                                 related_configmap_manifests,
-                                deployment_manifests,
+                                workload_manifests,
                                 related_service_manifests))
+
+
+def select_related_rendered_manifests(rendered_manifests: List[dict], selector_dict: dict) -> List[dict]:
+    """按选择器选出 manifest，并带出选中工作负载关联的资源
+
+    Args:
+        rendered_manifests (List[dict]): 全部渲染结果，可以直接传入已建立的 ManifestIndex
+        selector_dict (dict): parse_selector 解析后的选择器，不能为空
+    """
+    manifest_index = ManifestIndex.of(rendered_manifests)
+    return find_and_merge_related_rendered_manifests_of_workloads(
+        manifest_index.select(selector_dict), manifest_index)
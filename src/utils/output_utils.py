@@ -3,7 +3,7 @@
 
 import json
 import sys
-import yaml
+from utils.yaml_utils import dump_yaml
 
 SUPPORTED_OUTPUT_FORMATS = ('yaml', 'json')
 FAILURE_EXIT_CODE = 2
@@ -12,7 +12,7 @@ def print_structured_output(data, output_format='yaml') -> None:
     if output_format == 'json':
         print(json.dumps(data, ensure_ascii=False, indent=2))
     elif output_format == 'yaml':
-        print(yaml.dump(data, allow_unicode=True, sort_keys=False))
+        print(dump_yaml(data, allow_unicode=True, sort_keys=False))
     else:
         raise ValueError(f'Unsupported output format: {output_format}')
 
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import contextlib
+import hashlib
+import os
+import tempfile
+from utils.json_utils import dumps_json, load_json
+from utils.render_cache import get_fine_upgrade_cache_dir
+
+def get_release_cache_dir() -> str:
+    return os.environ.get('FINE_UPGRADE_RELEASE_CACHE_DIR') or \
+        os.path.join(get_fine_upgrade_cache_dir(), 'releases')
+
+def build_release_cache_key(cmd: list) -> str:
+    """根据包含 release name、namespace 以及 kubeconfig/context 的 helm 命令参数生成缓存 key"""
+    return hashlib.sha256('\0'.join(cmd).encode('utf-8')).hexdigest()
+
+def get_release_cache_path(key: str) -> str:
+    return os.path.join(get_release_cache_dir(), key + '.json')
+
+def read_release_profile(key: str, version: dict) -> dict:
+    """读取缓存的 Release manifest 概况
+
+    Returns:
+        dict: 缓存的概况；未命中或缓存对应的 Release 版本不同时返回 None
+    """
+    try:
+        with open(get_release_cache_path(key), 'r', encoding='utf-8') as cache_file:
+            cached = load_json(cache_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('version') != version:
+        return None
+    return cached.get('profile')
+
+def write_release_profile(key: str, version: dict, profile: dict) -> None:
+    """原子地写入 Release manifest 概况，缓存目录不可写时忽略"""
+    cache_dir = get_release_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(dumps_json({'version': version, 'profile': profile}))
+        os.replace(temp_path, get_release_cache_path(key))
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
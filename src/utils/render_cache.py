@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import contextlib
+import hashlib
+import os
+import tempfile
+from utils.output_utils import print_status
+
+DEFAULT_RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RENDER_CACHE_SUFFIX = '.yaml'
+SKIPPED_CHART_DIRNAMES = {'.git', '.hg', '.svn', '__pycache__'}
+
+def is_render_cache_enabled() -> bool:
+    return os.environ.get('FINE_UPGRADE_NO_RENDER_CACHE', '0') != '1'
+
+def get_fine_upgrade_cache_dir() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'helm-fine-upgrade')
+
+def get_render_cache_dir() -> str:
+    return os.environ.get('FINE_UPGRADE_RENDER_CACHE_DIR') or \
+        os.path.join(get_fine_upgrade_cache_dir(), 'renders')
+
+def get_render_cache_max_bytes() -> int:
+    max_bytes = os.environ.get('FINE_UPGRADE_RENDER_CACHE_MAX_BYTES')
+    if not max_bytes:
+        return DEFAULT_RENDER_CACHE_MAX_BYTES
+    try:
+        return int(max_bytes)
+    except ValueError:
+        print_status(f'FINE_UPGRADE_RENDER_CACHE_MAX_BYTES 不是整数: {max_bytes}，'
+                     f'使用默认值 {DEFAULT_RENDER_CACHE_MAX_BYTES}')
+        return DEFAULT_RENDER_CACHE_MAX_BYTES
+
+def is_local_path(path: str) -> bool:
+    """路径是否为本地文件或目录，只有本地 chart 和 values 的渲染结果可以缓存"""
+    return os.path.isfile(path) or os.path.isdir(path)
+
+def _update_digest_with_file(digest, file_path: str) -> None:
+    with open(file_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+def update_digest_with_path(digest, path: str) -> bool:
+    """把本地 chart 目录、chart 包或 values 文件的内容写入摘要
+
+    Args:
+        digest: hashlib 摘要对象
+        path (str): 本地文件或目录路径
+
+    Returns:
+        bool: 路径不是本地文件或目录（例如仓库中的 chart 引用）时返回 False
+    """
+    if os.path.isfile(path):
+        digest.update(b'file\0')
+        _update_digest_with_file(digest, path)
+        return True
+    if not os.path.isdir(path):
+        return False
+    digest.update(b'dir\0')
+    for root, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(dirname for dirname in dirnames
+                             if dirname not in SKIPPED_CHART_DIRNAMES)
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(file_path, path).replace(os.sep, '/')
+            digest.update(relative_path.encode('utf-8') + b'\0')
+            _update_digest_with_file(digest, file_path)
+            digest.update(b'\0')
+    return True
+
+def build_render_cache_key(cmd: list,
+                           chart_path: str,
+                           values: str,
+                           helm_version: str) -> str:
+    """根据 helm template 命令参数、chart 内容、values 内容和 helm 版本生成缓存 key
+
+    命令参数里已经包含 release name、namespace 以及 kubeconfig/context 等全局参数。
+
+    Returns:
+        str: 缓存 key；chart 不是本地路径时返回 None，表示不缓存
+    """
+    digest = hashlib.sha256()
+    digest.update(f'helm:{helm_version}\0'.encode('utf-8'))
+    digest.update('\0'.join(cmd).encode('utf-8') + b'\0')
+    if not update_digest_with_path(digest, chart_path):
+        return None
+    if values is not None:
+        digest.update(b'values\0')
+        if not update_digest_with_path(digest, values):
+            return None
+    return digest.hexdigest()
+
+def get_render_cache_path(key: str) -> str:
+    return os.path.join(get_render_cache_dir(), key + RENDER_CACHE_SUFFIX)
+
+def open_render_cache(key: str):
+    """打开缓存的渲染结果
+
+    Returns:
+        缓存文件的文本流，未命中时返回 None
+    """
+    cache_path = get_render_cache_path(key)
+    try:
+        cache_file = open(cache_path, 'r', encoding='utf-8')
+    except OSError:
+        return None
+    # 使用文件修改时间记录最近访问时间，用于 LRU 淘汰
+    try:
+        os.utime(cache_path, None)
+    except OSError:
+        pass
+    return cache_file
+
+@contextlib.contextmanager
+def render_cache_writer(key: str):
+    """返回用于写入渲染结果的临时文件，上下文正常退出时原子地提交到缓存，异常退出时丢弃
+
+    缓存目录不可写时返回 None，调用方按未启用缓存处理。
+    """
+    cache_dir = get_render_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError as e:
+        print_status(f'写入渲染缓存失败: {e}')
+        yield None
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as temp_file:
+            yield temp_file
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    try:
+        os.replace(temp_path, get_render_cache_path(key))
+    except OSError as e:
+        print_status(f'写入渲染缓存失败: {e}')
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        return
+    evict_render_cache(get_render_cache_max_bytes())
+
+class TeeReader:
+    """读取 stream 的同时把读到的内容写入 tee_file，用于边解析边写缓存"""
+
+    def __init__(self, stream, tee_file):
+        self.stream = stream
+        self.tee_file = tee_file
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        if chunk:
+            self.tee_file.write(chunk)
+        return chunk
+
+def evict_render_cache(max_bytes: int) -> list:
+    """按最近访问时间淘汰缓存文件，直到缓存总大小不超过 max_bytes
+
+    Returns:
+        list: 被删除的缓存文件路径
+    """
+    cache_dir = get_render_cache_dir()
+    try:
+        filenames = os.listdir(cache_dir)
+    except OSError:
+        return []
+    entries = []
+    total_size = 0
+    for filename in filenames:
+        if not filename.endswith(RENDER_CACHE_SUFFIX):
+            continue
+        cache_path = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(cache_path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, cache_path, stat.st_size))
+        total_size += stat.st_size
+
+    removed = []
+    for _, cache_path, size in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(cache_path)
+        except OSError:
+            continue
+        total_size -= size
+        removed.append(cache_path)
+    return removed
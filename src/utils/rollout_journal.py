@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import datetime
+import hashlib
+import os
+import threading
+from utils.json_utils import dumps_json, loads_json
+from utils.render_cache import get_fine_upgrade_cache_dir
+
+# 滚动更新 Pod 标签的步骤，按执行顺序排列
+ROLLOUT_STEPS = ('started', 'temp-ready', 'old-deleted', 'new-ready', 'service-applied', 'done')
+
+def get_journal_dir() -> str:
+    return os.environ.get('FINE_UPGRADE_JOURNAL_DIR') or \
+        os.path.join(get_fine_upgrade_cache_dir(), 'journals')
+
+def get_default_journal_path(release_name: str, scope: list) -> str:
+    """返回 Release 默认的日志文件路径
+
+    Args:
+        scope (list): 区分集群和 namespace 的参数，例如带有 namespace、kubeconfig、context 的 helm 命令参数
+    """
+    digest = hashlib.sha256('\0'.join(scope).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(get_journal_dir(), f'{release_name}-{digest}.jsonl')
+
+def get_step_index(step: str) -> int:
+    return ROLLOUT_STEPS.index(step) if step is not None else -1
+
+class RolloutJournal:
+    """记录每个 Deployment 已完成的滚动更新步骤，中断后重新执行时据此跳过或继续
+
+    日志以 JSON Lines 追加写入，每条记录写入后立即刷新到磁盘；进程中断导致的不完整行在读取时忽略。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        self._apply(loads_json(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+
+    def _apply(self, entry: dict) -> None:
+        key = (entry['namespace'], entry['name'])
+        if entry['step'] == 'started':
+            self.states[key] = {'step': 'started', 'manifest': entry['manifest'],
+                                'target': entry['target']}
+        elif key in self.states:
+            self.states[key]['step'] = entry['step']
+
+    def get(self, namespace: str, name: str) -> dict:
+        """返回 Deployment 的记录，包括最后完成的步骤 step、开始前的集群配置 manifest 和目标标签 target"""
+        return self.states.get((namespace, name))
+
+    def record(self, namespace: str, name: str, step: str, **fields) -> None:
+        entry = dict(fields, namespace=namespace, name=name, step=step,
+                     time=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'))
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(dumps_json(entry) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self._apply(entry)
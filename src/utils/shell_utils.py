@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 #-*- coding:utf-8 -*-
 
+import contextlib
 import os
 import subprocess
+import tempfile
+import threading
 
 
 def run_cmd(cmd_args, input=None) -> str:
@@ -16,3 +19,54 @@ def run_cmd(cmd_args, input=None) -> str:
         print(f'命令执行失败: {cmd_args}')
         print(return_cmd.stderr)
         return None
+
+@contextlib.contextmanager
+def open_cmd_stream(cmd_args, quiet=False, timeout=None, kill_on_exit=False):
+    """启动命令并返回标准输出的文本流，调用方可以在命令仍在输出时边读边处理
+
+    stderr 写入临时文件，避免管道写满导致子进程阻塞。命令退出码非 0 时，
+    在退出上下文时打印错误（quiet 为 True 时不打印）并抛出 subprocess.CalledProcessError。
+
+    Args:
+        timeout (float): 可选，命令运行超过该秒数时终止命令，退出上下文时抛出 subprocess.TimeoutExpired
+        kill_on_exit (bool): 退出上下文时命令仍在运行则直接终止，用于 --watch 等不会自行退出的命令
+    """
+    if os.environ.get('HELM_DEBUG', '0') == '1':
+        print(f'执行命令：{cmd_args}')
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=stderr_file,
+                                   encoding='utf-8', text=True)
+        timed_out = threading.Event()
+        timer = None
+        if timeout is not None:
+            def kill_after_timeout():
+                timed_out.set()
+                process.kill()
+            timer = threading.Timer(timeout, kill_after_timeout)
+            timer.daemon = True
+            timer.start()
+        killed_on_exit = False
+        try:
+            yield process.stdout
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if kill_on_exit and process.poll() is None:
+                process.kill()
+                killed_on_exit = True
+            process.stdout.close()
+            returncode = process.wait()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd_args, timeout)
+        if killed_on_exit:
+            return
+        if returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+            if not quiet:
+                print(f'命令执行失败: {cmd_args}')
+                print(stderr)
+            raise subprocess.CalledProcessError(returncode, cmd_args, stderr=stderr)
@@ -3,6 +3,16 @@
 
 import yaml
 
+# 安装了 libyaml 时使用 C 实现的 Loader/Dumper，否则回退到纯 Python 实现
+if getattr(yaml, '__with_libyaml__', False):
+    SafeLoader = yaml.CSafeLoader
+    SafeDumper = yaml.CSafeDumper
+    YAML_BACKEND = 'libyaml'
+else:
+    SafeLoader = yaml.SafeLoader
+    SafeDumper = yaml.SafeDumper
+    YAML_BACKEND = 'python'
+
 def yaml_multiline_string_pipe(dumper, data):
     text_list = [line.rstrip() for line in data.splitlines()]
     fixed_data = "\n".join(text_list)
@@ -11,4 +21,27 @@ def yaml_multiline_string_pipe(dumper, data):
     return dumper.represent_scalar('tag:yaml.org,2002:str', fixed_data)
 
 def init_yaml_representer():
-    yaml.add_representer(str, yaml_multiline_string_pipe)
+    for dumper in (yaml.Dumper, yaml.SafeDumper, SafeDumper):
+        yaml.add_representer(str, yaml_multiline_string_pipe, Dumper=dumper)
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+def load_all_yaml(stream):
+    return yaml.load_all(stream, Loader=SafeLoader)
+
+def dump_yaml(data, stream=None, **kwargs):
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
+
+def dump_all_yaml(documents, stream=None, **kwargs):
+    return yaml.dump_all(documents, stream, Dumper=SafeDumper, **kwargs)
+
+def iter_yaml_documents(stream):
+    """逐个解析 YAML 多文档流，跳过空文档
+
+    Args:
+        stream: 字符串或类文件对象；类文件对象会按块读取，不需要一次性读入内存
+    """
+    for document in load_all_yaml(stream):
+        if document is not None:
+            yield document
@@ -46,6 +46,8 @@ class DiagnosticsServiceTests(unittest.TestCase):
         self.assertEqual(report['dependencies']['kubectl']['error'], 'kubectl not found in PATH')
         self.assertIn('os', report['platform'])
         self.assertIn('arch', report['platform'])
+        self.assertIn(report['platform']['yaml_backend'], ('libyaml', 'python'))
+        self.assertIn(report['platform']['json_backend'], ('orjson', 'json'))
 
     @patch('services.diagnostics_service.build_doctor_report')
     def test_doctor_supports_json_output(self, build_doctor_report):
@@ -1,44 +1,362 @@
+import contextlib
+import io
+import json
 import os
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
-from utils.kube_ops_utils import is_deployment_ready
+from models.helm_model import ManifestIndex, SqliteManifestStore
+from utils.helm_utils import get_manifest_unique_key
+from utils.kube_ops_utils import (DeploymentReadinessTracker, apply_manifests_in_waves,
+                                  build_apply_waves, is_deployment_ready, watch_deployments)
+
+
+def manifest(kind, name):
+    return {'kind': kind, 'metadata': {'name': name, 'namespace': 'demo'}}
 
 
 class KubeOpsUtilsTests(unittest.TestCase):
 
     @patch('utils.kube_ops_utils.run_cmd')
     def test_is_deployment_ready_true_when_replicas_are_available(self, run_cmd):
-        run_cmd.return_value = """
-spec:
-  replicas: 2
-status:
-  readyReplicas: 2
-  updatedReplicas: 2
-  availableReplicas: 2
-"""
+        run_cmd.return_value = json.dumps({
+            'spec': {'replicas': 2},
+            'status': {'readyReplicas': 2, 'updatedReplicas': 2, 'availableReplicas': 2},
+        })
 
         self.assertTrue(is_deployment_ready('api', 'demo'))
         run_cmd.assert_called_once_with([
-            'kubectl', 'get', 'Deployment', 'api', '-o', 'yaml', '-n', 'demo'
+            'kubectl', 'get', 'Deployment', 'api', '-o', 'json', '-n', 'demo'
         ])
 
     @patch('utils.kube_ops_utils.run_cmd')
     def test_is_deployment_ready_false_when_not_available(self, run_cmd):
-        run_cmd.return_value = """
-spec:
-  replicas: 2
-status:
-  readyReplicas: 1
-  updatedReplicas: 2
-  availableReplicas: 1
-"""
+        run_cmd.return_value = json.dumps({
+            'spec': {'replicas': 2},
+            'status': {'readyReplicas': 1, 'updatedReplicas': 2, 'availableReplicas': 1},
+        })
 
         self.assertFalse(is_deployment_ready('api'))
 
+    @patch('utils.kube_ops_utils.open_cmd_stream')
+    def test_watch_deployments_stops_when_callback_declines(self, open_cmd_stream):
+        consumed = []
+
+        def watch_output():
+            for name in ('api', 'worker', 'web'):
+                consumed.append(name)
+                yield json.dumps({'metadata': {'name': name}}, indent=4) + '\n'
+
+        open_cmd_stream.return_value.__enter__.return_value = \
+            (line for document in watch_output() for line in document.splitlines(True))
+
+        self.assertTrue(watch_deployments(
+            'demo', lambda deployment: deployment['metadata']['name'] != 'worker', timeout=30))
+        self.assertEqual(consumed, ['api', 'worker'])
+        cmd = open_cmd_stream.call_args.args[0]
+        self.assertEqual(cmd, ['kubectl', 'get', 'deployments', '-o', 'json',
+                               '--watch', '-n', 'demo'])
+        self.assertTrue(open_cmd_stream.call_args.kwargs['kill_on_exit'])
+
+    def test_is_deployment_ready_waits_for_new_generation_to_be_observed(self):
+        with patch('utils.kube_ops_utils.run_cmd') as run_cmd:
+            run_cmd.return_value = json.dumps({
+                'metadata': {'generation': 3},
+                'spec': {'replicas': 1},
+                'status': {'observedGeneration': 2, 'readyReplicas': 1,
+                           'updatedReplicas': 1, 'availableReplicas': 1},
+            })
+
+            self.assertFalse(is_deployment_ready('api', 'demo'))
+
+    @patch('utils.kube_ops_utils.is_deployment_ready', return_value=False)
+    @patch('utils.kube_ops_utils.watch_deployments')
+    def test_readiness_tracker_shares_one_watch_per_namespace(self, watch_deployments, _):
+        watched = []
+
+        def deployment(name, ready):
+            return {'metadata': {'name': name}, 'spec': {'replicas': 1},
+                    'status': {'readyReplicas': ready, 'updatedReplicas': ready,
+                               'availableReplicas': ready}}
+
+        def watch_namespace(namespace, on_deployment, timeout):
+            watched.append(namespace)
+            while len(tracker.waiters) < 3:
+                time.sleep(0.01)
+            for ready in (0, 1):
+                for i in range(3):
+                    if not on_deployment(deployment(f'app-{i}', ready)):
+                        return True
+            return True
+
+        watch_deployments.side_effect = watch_namespace
+        tracker = DeploymentReadinessTracker()
+        results = {}
+
+        def wait(name):
+            results[name] = tracker.wait(name, 'demo', timeout=10)
+
+        threads = [threading.Thread(target=wait, args=(f'app-{i}',)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(seconds is not None for seconds in results.values()))
+        self.assertEqual(watched, ['demo'])
+        self.assertEqual(sorted(record['name'] for record in tracker.time_to_ready),
+                         ['app-0', 'app-1', 'app-2'])
+
+    @patch('utils.kube_ops_utils.is_deployment_ready', return_value=True)
+    @patch('utils.kube_ops_utils.watch_deployments', return_value=True)
+    def test_readiness_tracker_accepts_deployment_already_ready(self, _, is_deployment_ready):
+        tracker = DeploymentReadinessTracker()
+
+        self.assertIsNotNone(tracker.wait('api', 'demo', timeout=10))
+        is_deployment_ready.assert_called_once_with('api', 'demo')
+
+    @patch('utils.kube_ops_utils.time.sleep')
+    @patch('utils.kube_ops_utils.is_deployment_ready', return_value=False)
+    @patch('utils.kube_ops_utils.watch_deployments')
+    def test_readiness_tracker_times_out_when_rollout_never_converges(
+            self, watch_deployments, _, sleep):
+        def watch_namespace(namespace, on_deployment, timeout):
+            on_deployment({'metadata': {'name': 'api'}, 'spec': {'replicas': 1}, 'status': {}})
+            return True
+
+        watch_deployments.side_effect = watch_namespace
+        tracker = DeploymentReadinessTracker()
+
+        self.assertIsNone(tracker.wait('api', 'demo', timeout=0.1))
+        self.assertEqual(tracker.time_to_ready, [])
+        self.assertEqual(tracker.waiters, {})
+
+    def test_build_apply_waves_orders_kinds_by_dependency(self):
+        manifests = [manifest('Service', 'api'), manifest('Deployment', 'api'),
+                     manifest('Widget', 'custom'), manifest('ConfigMap', 'api'),
+                     manifest('Namespace', 'demo'), manifest('PersistentVolumeClaim', 'data'),
+                     manifest('Secret', 'api')]
+
+        waves = build_apply_waves(manifests)
+
+        self.assertEqual(
+            [(wave, [item['metadata']['name'] for item in items]) for wave, items in waves],
+            [('namespaces', ['demo']), ('storage', ['data']), ('config', ['api', 'api']),
+             ('workloads', ['api']), ('services', ['api']), ('others', ['custom'])])
+
+    def test_build_apply_waves_applies_namespaces_before_namespaced_policies(self):
+        manifests = [manifest('PodDisruptionBudget', 'api'), manifest('Namespace', 'demo'),
+                     manifest('ResourceQuota', 'quota'), manifest('PriorityClass', 'high')]
+
+        waves = build_apply_waves(manifests)
+
+        self.assertEqual(
+            [(wave, [item['kind'] for item in items]) for wave, items in waves],
+            [('namespaces', ['Namespace']),
+             ('policies', ['PriorityClass', 'ResourceQuota', 'PodDisruptionBudget'])])
+
+    @patch('utils.kube_ops_utils.run_cmd')
+    def test_apply_manifests_in_waves_stops_after_failed_wave(self, run_cmd):
+        def apply(cmd, input):
+            return None if 'name: worker-2' in input else 'applied'
+        run_cmd.side_effect = apply
+        manifests = [manifest('ConfigMap', f'config-{i}') for i in range(3)] + \
+            [manifest('Deployment', f'worker-{i}') for i in range(3)] + \
+            [manifest('Service', 'api')]
+
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            report = apply_manifests_in_waves(manifests, parallelism=2, chunk_size=2)
+
+        self.assertEqual(run_cmd.call_count, 4)
+        self.assertEqual(report['summary'],
+                         {'waves': 3, 'applied': 5, 'failed': 1, 'skipped': 1})
+        self.assertEqual([(wave['name'], wave['status'], wave.get('chunks'))
+                          for wave in report['waves']],
+                         [('config', 'applied', 2), ('workloads', 'failed', 2),
+                          ('services', 'skipped', None)])
+        self.assertIn('seconds', report['waves'][0])
+        self.assertIn('第 2 批 workloads 应用失败', stderr.getvalue())
+
+
+
+class ManifestIndexTests(unittest.TestCase):
+
+    def test_keys_match_unique_key_and_namespace_is_read_once(self):
+        manifests = [
+            {'kind': 'Namespace', 'metadata': {'name': 'demo'}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'app'}},
+            {'kind': 'Secret', 'metadata': {'name': 'token', 'namespace': 'other'}},
+            None,
+        ]
+
+        with patch.dict(os.environ, {'HELM_NAMESPACE': 'demo'}):
+            with patch('models.helm_model.get_helm_namespace',
+                       return_value='demo') as get_helm_namespace:
+                index = ManifestIndex(manifests)
+                self.assertEqual([index.key_of(manifest) for manifest in manifests[:3]],
+                                 [index.key_of(dict(manifest)) for manifest in manifests[:3]])
+            expected_keys = [get_manifest_unique_key(manifest) for manifest in manifests[:3]]
+
+        get_helm_namespace.assert_called_once_with()
+        self.assertEqual(list(index.keys()), expected_keys)
+        self.assertEqual(len(index), 3)
+        self.assertIs(index['ConfigMap:demo:app'], manifests[1])
+        self.assertEqual(index.records['ConfigMap:demo:app'].namespace, 'demo')
+        self.assertIsNone(index.get('ConfigMap:demo:missing'))
+
+    def test_kind_namespace_and_label_indexes_keep_insertion_order(self):
+        index = ManifestIndex([
+            {'kind': 'ConfigMap', 'metadata': {'name': 'b', 'labels': {'app': 'api'}}},
+            {'kind': 'Secret', 'metadata': {'name': 'a', 'namespace': 'other'}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'a', 'labels': {'app': 'api'}}},
+        ], helm_namespace='demo')
+
+        self.assertEqual([manifest['metadata']['name'] for manifest in index.of_kind('ConfigMap')],
+                         ['b', 'a'])
+        self.assertEqual([manifest['kind'] for manifest in index.in_namespace('other')], ['Secret'])
+        self.assertEqual(index.of_kind('Deployment'), [])
+        self.assertEqual(list(index.by_label[('app', 'api')]),
+                         ['ConfigMap:demo:b', 'ConfigMap:demo:a'])
+
+    def test_selects_manifests_and_matches_services(self):
+        def service(name, selector):
+            return {'kind': 'Service', 'metadata': {'name': name, 'namespace': 'demo'},
+                    'spec': {'selector': selector}}
+
+        manifests = [
+            {'kind': 'ConfigMap', 'metadata': {'name': 'a', 'labels': {'app': 'api', 'tier': 'web'}}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'b', 'labels': {'app': 'api'}}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'c', 'labels': {'app': 'db', 'tier': 'web'}}},
+            service('api', {'app': 'api'}),
+            service('api-web', {'app': 'api', 'tier': 'web'}),
+            service('db', {'app': 'db'}),
+            service('headless', {}),
+        ]
+        index = ManifestIndex(manifests, helm_namespace='demo')
+
+        self.assertEqual([manifest['metadata']['name']
+                          for manifest in index.select({'app': 'api', 'tier': 'web'})], ['a'])
+        self.assertEqual(index.select({'app': 'missing'}), [])
+        self.assertEqual(len(index.select({})), len(manifests))
+        self.assertEqual(index.find_services({'tier': 'web', 'app': 'api', 'extra': 'x'}),
+                         ['Service:demo:api', 'Service:demo:api-web'])
+        self.assertEqual(index.find_services({'tier': 'web'}), [])
+
+    def test_readding_a_key_replaces_manifest_and_its_index_entries(self):
+        index = ManifestIndex([
+            {'kind': 'Service', 'metadata': {'name': 'api', 'labels': {'v': '1'}},
+             'spec': {'selector': {'app': 'api'}}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'app'}},
+        ], helm_namespace='demo')
+        replacement = {'kind': 'Service', 'metadata': {'name': 'api', 'labels': {'v': '2'}},
+                       'spec': {'selector': {'app': 'api-v2'}}}
+
+        index.add(replacement)
+
+        self.assertEqual(list(index.keys()), ['Service:demo:api', 'ConfigMap:demo:app'])
+        self.assertIs(index['Service:demo:api'], replacement)
+        self.assertEqual(index.select({'v': '1'}), [])
+        self.assertEqual(index.select({'v': '2'}), [replacement])
+        self.assertEqual(index.find_services({'app': 'api'}), [])
+        self.assertEqual(index.find_services({'app': 'api-v2'}), ['Service:demo:api'])
+
+    def test_readding_a_key_keeps_its_position_in_secondary_indexes(self):
+        index = ManifestIndex([
+            {'kind': 'ConfigMap', 'metadata': {'name': 'a', 'labels': {'app': 'api'}}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'b', 'labels': {'app': 'api', 'v': '1'}}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'c', 'labels': {'v': '1'}}},
+        ], helm_namespace='demo')
+
+        index.add({'kind': 'ConfigMap', 'metadata': {'name': 'a', 'labels': {'app': 'api', 'v': '1'}}})
+
+        def names(manifests):
+            return [manifest['metadata']['name'] for manifest in manifests]
+
+        self.assertEqual(names(index), ['a', 'b', 'c'])
+        self.assertEqual(names(index.of_kind('ConfigMap')), ['a', 'b', 'c'])
+        self.assertEqual(names(index.in_namespace('demo')), ['a', 'b', 'c'])
+        self.assertEqual(names(index.select({'app': 'api'})), ['a', 'b'])
+        self.assertEqual(names(index.select({'v': '1'})), ['a', 'b', 'c'])
+
+    def test_of_reuses_an_existing_index(self):
+        index = ManifestIndex([], helm_namespace='demo')
+
+        self.assertIs(ManifestIndex.of(index), index)
+        self.assertEqual(len(ManifestIndex.of(None)), 0)
+
+
+
+class SqliteManifestStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manifests = [
+            {'kind': 'Secret', 'metadata': {'name': 'token', 'namespace': 'other'},
+             'data': {'token': 'x' * 200}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'app', 'labels': {'app': 'api'}}},
+            None,
+            {'kind': 'Namespace', 'metadata': {'name': 'demo'}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'db'}},
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trips_manifests_and_matches_index_order(self):
+        with SqliteManifestStore(iter(self.manifests), helm_namespace='demo') as store:
+            index = ManifestIndex(self.manifests, helm_namespace='demo')
+
+            self.assertEqual(len(store), 4)
+            self.assertIn('ConfigMap:demo:app', store)
+            self.assertNotIn('ConfigMap:demo:missing', store)
+            self.assertEqual(store['Secret:other:token'], self.manifests[0])
+            self.assertIsNone(store.get('ConfigMap:demo:missing'))
+            self.assertEqual(
+                [(record.key, record.namespace, record.name, record.labels, record.manifest)
+                 for record in store.iter_sorted_records()],
+                [(record.key, record.namespace, record.name, record.labels, record.manifest)
+                 for record in index.iter_sorted_records()])
+            self.assertEqual([manifest['metadata']['name'] for manifest in store.of_kind('ConfigMap')],
+                             ['app', 'db'])
+            self.assertEqual(list(store.of_kind('Secret', 'demo')), [])
+
+    def test_stores_compressed_bodies_indexed_by_kind_namespace_and_name(self):
+        path = os.path.join(self.temp_dir.name, 'manifests.sqlite')
+        with SqliteManifestStore(self.manifests, path=path, helm_namespace='demo') as store:
+            store.add({'kind': 'ConfigMap', 'metadata': {'name': 'app'}, 'data': {'v': '2'}})
+            self.assertEqual(store['ConfigMap:demo:app']['data'], {'v': '2'})
+            self.assertEqual(len(store), 4)
+
+        connection = sqlite3.connect(path)
+        try:
+            body = connection.execute(
+                "SELECT body FROM manifests WHERE key = 'Secret:other:token'").fetchone()[0]
+            indexes = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'manifests'"
+            ).fetchall()
+        finally:
+            connection.close()
+        self.assertLess(len(body), len(json.dumps(self.manifests[0])))
+        self.assertIn(('manifests_kind_namespace_name',), indexes)
+
+    def test_temporary_file_is_removed_on_close(self):
+        with patch.dict(os.environ, {'FINE_UPGRADE_SPILL_DIR': self.temp_dir.name}):
+            store = SqliteManifestStore(self.manifests, helm_namespace='demo')
+        self.assertEqual(os.listdir(self.temp_dir.name), [os.path.basename(store.path)])
+
+        store.close()
+        store.close()
+
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,16 +1,26 @@
+import contextlib
+import io
 import os
 import sys
+import tempfile
 import unittest
 from unittest.mock import mock_open, patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
-from utils.dict_utils import parse_selector, remove_ignore_fields, set_value
-from utils.manifest_utils import find_and_merge_related_rendered_manifests_of_deployments
-from services.helm_service import (build_state_check, build_upgrade_plan,
+from utils.dict_utils import (compile_ignore_fields, compile_ignore_profiles,
+                              merge_ignore_trees, parse_selector,
+                              project_ignore_fields, remove_ignore_fields,
+                              set_value, values_equal_ignoring_fields)
+from utils.output_utils import FAILURE_EXIT_CODE
+from utils.yaml_utils import load_yaml
+from utils.manifest_utils import (find_and_merge_related_rendered_manifests_of_workloads,
+                                  select_related_rendered_manifests)
+from models.helm_model import ManifestIndex, SqliteManifestStore
+from services.helm_service import (apply_upgrade, build_state_check, build_upgrade_plan,
                                    detect_immutable_field_changes,
                                    manifests_are_equal,
-                                   plan_upgrade)
+                                   plan_upgrade, select_changed_manifests, state_check)
 
 
 class HelmServiceSupportTests(unittest.TestCase):
@@ -56,6 +66,121 @@ class HelmServiceSupportTests(unittest.TestCase):
             'spec': {'ports': [{'name': 'http'}, {'name': 'metrics'}]},
         })
 
+    def test_project_ignore_fields_copies_only_changed_paths(self):
+        manifest = {
+            'metadata': {'name': 'demo', 'uid': 'abc'},
+            'data': {'large': 'x' * 1000},
+            'spec': {'ports': [{'port': 80, 'nodePort': 30080}], 'type': 'NodePort'},
+        }
+        matcher = compile_ignore_fields({
+            'metadata': {'_fields': ['uid']},
+            'spec': {'ports': {'_fields': ['nodePort']}},
+        })
+
+        projected = project_ignore_fields(manifest, matcher)
+
+        self.assertEqual(projected, {
+            'metadata': {'name': 'demo'},
+            'data': {'large': 'x' * 1000},
+            'spec': {'ports': [{'port': 80}], 'type': 'NodePort'},
+        })
+        self.assertIs(projected['data'], manifest['data'])
+        self.assertEqual(manifest['metadata']['uid'], 'abc')
+        self.assertEqual(manifest['spec']['ports'][0]['nodePort'], 30080)
+        self.assertIs(compile_ignore_fields(matcher), matcher)
+        self.assertIs(project_ignore_fields(manifest['data'], matcher), manifest['data'])
+
+    def test_values_equal_ignoring_fields_matches_remove_ignore_fields(self):
+        ignore_config = {
+            '_fields': ['status'],
+            'metadata': {
+                '_fields': ['uid'],
+                'annotations': {'_fields': ['revision']},
+            },
+            'spec': {'ports': {'_fields': ['nodePort']}},
+        }
+        left = {
+            'metadata': {'name': 'demo', 'annotations': {'revision': '1'}},
+            'spec': {'ports': [{'port': 80, 'nodePort': 30080}]},
+        }
+        same = {
+            'metadata': {'name': 'demo', 'uid': 'abc'},
+            'spec': {'ports': [{'port': 80, 'nodePort': 30081}]},
+            'status': {'ready': True},
+        }
+        different = {
+            'metadata': {'name': 'demo'},
+            'spec': {'ports': [{'port': 81}]},
+        }
+
+        self.assertTrue(values_equal_ignoring_fields(left, same, ignore_config))
+        self.assertFalse(values_equal_ignoring_fields(left, different, ignore_config))
+        self.assertEqual(left['metadata']['annotations'], {'revision': '1'})
+        self.assertIn('uid', same['metadata'])
+
+    def test_values_equal_ignoring_fields_is_type_strict(self):
+        self.assertFalse(values_equal_ignoring_fields({'a': True}, {'a': 1}, {}))
+        self.assertFalse(values_equal_ignoring_fields({'a': 1}, {'a': 1.0}, {}))
+        self.assertFalse(values_equal_ignoring_fields({'a': '1'}, {'a': 1}, {}))
+        self.assertTrue(values_equal_ignoring_fields(
+            {'a': 'line  \nnext\n'}, {'a': 'line\nnext'}, {}))
+
+    def test_merge_ignore_trees_unions_fields_without_mutating_inputs(self):
+        global_tree = {'_fields': ['status'], 'metadata': {'_fields': ['uid']}}
+        kind_tree = {'_fields': ['status', 'secrets'],
+                     'metadata': {'labels': {'_fields': ['hash']}}}
+
+        merged = merge_ignore_trees(global_tree, None, kind_tree)
+
+        self.assertEqual(merged, {
+            '_fields': ['status', 'secrets'],
+            'metadata': {'_fields': ['uid'], 'labels': {'_fields': ['hash']}},
+        })
+        self.assertEqual(global_tree, {'_fields': ['status'], 'metadata': {'_fields': ['uid']}})
+
+    def test_ignore_profiles_apply_only_to_matching_kind_and_api_version(self):
+        profiles = compile_ignore_profiles({
+            'ignore_fields': {'_fields': ['status']},
+            'ignore_fields_by_kind': {
+                'Deployment': {'spec': {'_fields': ['replicas']}},
+                'example.com/v1/Widget': {'spec': {'_fields': ['size']}},
+            },
+        })
+        deployment = {'apiVersion': 'apps/v1', 'kind': 'Deployment',
+                      'spec': {'replicas': 1}}
+        widget = {'apiVersion': 'example.com/v1', 'kind': 'Widget',
+                  'spec': {'replicas': 1, 'size': 3}}
+        other_widget = {'apiVersion': 'example.com/v2', 'kind': 'Widget',
+                        'spec': {'size': 3}}
+
+        self.assertTrue(manifests_are_equal(
+            deployment, {**deployment, 'spec': {'replicas': 3}, 'status': {}}, profiles))
+        self.assertFalse(manifests_are_equal(
+            widget, {**widget, 'spec': {'replicas': 3, 'size': 3}}, profiles))
+        self.assertTrue(manifests_are_equal(
+            widget, {**widget, 'spec': {'replicas': 1, 'size': 5}}, profiles))
+        self.assertFalse(manifests_are_equal(
+            other_widget, {**other_widget, 'spec': {'size': 5}}, profiles))
+        self.assertIs(profiles.for_manifest(deployment),
+                      profiles.for_manifest(dict(deployment)))
+
+    def test_default_config_keeps_workload_rules_off_other_kinds(self):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'config.yml')
+        with open(config_path, 'r', encoding='utf-8') as config_file:
+            profiles = compile_ignore_profiles(load_yaml(config_file))
+        deployment = profiles.for_manifest({'apiVersion': 'apps/v1', 'kind': 'Deployment'})
+        stateful_set = profiles.for_manifest({'apiVersion': 'apps/v1', 'kind': 'StatefulSet'})
+        service = profiles.for_manifest({'apiVersion': 'v1', 'kind': 'Service'})
+        custom = profiles.for_manifest({'apiVersion': 'example.com/v1', 'kind': 'Widget'})
+
+        self.assertIn('replicas', deployment.children['spec'].fields)
+        self.assertIn('template', stateful_set.children['spec'].children)
+        self.assertNotIn('clusterIP', deployment.children['spec'].fields)
+        self.assertIn('clusterIP', service.children['spec'].fields)
+        self.assertNotIn('replicas', service.children['spec'].fields)
+        self.assertNotIn('spec', custom.children)
+        self.assertIn('status', custom.fields)
+
     def test_set_value_creates_nested_path(self):
         values = {}
 
@@ -98,14 +223,62 @@ class HelmServiceSupportTests(unittest.TestCase):
             },
         }
 
-        related = find_and_merge_related_rendered_manifests_of_deployments(
-            [deployment], manifest_dict, ['Service:demo:api'])
+        related = find_and_merge_related_rendered_manifests_of_workloads(
+            [deployment], ManifestIndex(manifest_dict.values()))
 
         self.assertEqual([manifest['kind'] for manifest in related], [
             'Namespace', 'StorageClass', 'PersistentVolumeClaim',
             'Secret', 'ConfigMap', 'Deployment', 'Service'
         ])
 
+    def test_select_related_manifests_expands_statefulsets_and_cronjobs(self):
+        def pod_template(app, config_map):
+            return {'metadata': {'labels': {'app': app}},
+                    'spec': {'volumes': [{'configMap': {'name': config_map}}]}}
+
+        manifests = [
+            {'kind': 'ConfigMap', 'metadata': {'name': 'db-config', 'namespace': 'demo'}},
+            {'kind': 'ConfigMap', 'metadata': {'name': 'backup-config', 'namespace': 'demo'}},
+            {'kind': 'StatefulSet',
+             'metadata': {'name': 'db', 'namespace': 'demo', 'labels': {'team': 'data'}},
+             'spec': {'template': pod_template('db', 'db-config')}},
+            {'kind': 'CronJob',
+             'metadata': {'name': 'backup', 'namespace': 'demo', 'labels': {'team': 'data'}},
+             'spec': {'jobTemplate': {'spec': {'template': pod_template('backup', 'backup-config')}}}},
+            {'kind': 'Service', 'metadata': {'name': 'db', 'namespace': 'demo', 'labels': {'team': 'data'}},
+             'spec': {'selector': {'app': 'db'}}},
+            {'kind': 'Deployment', 'metadata': {'name': 'web', 'namespace': 'demo'},
+             'spec': {'template': pod_template('web', 'web-config')}},
+        ]
+
+        selected = select_related_rendered_manifests(manifests, {'team': 'data'})
+
+        self.assertEqual([f"{manifest['kind']}/{manifest['metadata']['name']}" for manifest in selected], [
+            'ConfigMap/db-config', 'ConfigMap/backup-config',
+            'StatefulSet/db', 'CronJob/backup', 'Service/db',
+        ])
+
+    def test_related_services_skip_services_without_selector(self):
+        deployment = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'api', 'namespace': 'demo', 'labels': {'team': 'core'}},
+            'spec': {'template': {'metadata': {'labels': {'app': 'api'}}, 'spec': {}}},
+        }
+        manifests = [
+            deployment,
+            {'kind': 'Service', 'metadata': {'name': 'api', 'namespace': 'demo'},
+             'spec': {'selector': {'app': 'api'}}},
+            {'kind': 'Service', 'metadata': {'name': 'external', 'namespace': 'demo'},
+             'spec': {'ports': [{'port': 80}]}},
+            {'kind': 'Service', 'metadata': {'name': 'empty', 'namespace': 'demo'},
+             'spec': {'selector': {}}},
+        ]
+
+        selected = select_related_rendered_manifests(manifests, {'team': 'core'})
+
+        self.assertEqual([f"{manifest['kind']}/{manifest['metadata']['name']}" for manifest in selected],
+                         ['Deployment/api', 'Service/api'])
+
     def test_detect_immutable_field_changes_for_deployment_selector(self):
         rendered = {
             'kind': 'Deployment',
@@ -149,6 +322,29 @@ class HelmServiceSupportTests(unittest.TestCase):
         self.assertTrue(manifests_are_equal(
             rendered_deployment, runtime_deployment, {}))
 
+    def test_manifest_comparison_does_not_modify_inputs(self):
+        rendered = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'demo', 'uid': 'abc'},
+            'spec': {'template': {'spec': {'containers': [{'name': 'web'}]}}},
+        }
+        runtime = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'demo'},
+            'spec': {'template': {'spec': {'containers': [
+                {'name': 'web', 'resources': {}},
+            ]}}},
+            'status': {'readyReplicas': 1},
+        }
+
+        self.assertTrue(manifests_are_equal(
+            rendered, runtime,
+            {'_fields': ['status'], 'metadata': {'_fields': ['uid']}}))
+        self.assertEqual(rendered['metadata']['uid'], 'abc')
+        self.assertEqual(runtime['status'], {'readyReplicas': 1})
+        self.assertEqual(
+            runtime['spec']['template']['spec']['containers'][0]['resources'], {})
+
     def test_manifest_comparison_keeps_explicit_service_type_and_resources(self):
         rendered_service = {
             'kind': 'Service',
@@ -243,20 +439,24 @@ class HelmServiceSupportTests(unittest.TestCase):
             },
         ]
 
-        def lookup(kind, name, namespace=None):
-            if kind == 'Secret' and name == 'adopt-me' and namespace == 'demo':
-                return {
+        lookup_calls = []
+
+        def lookup(refs):
+            lookup_calls.append(refs)
+            return {
+                ref: {
                     'kind': 'Secret',
                     'metadata': {'name': 'adopt-me', 'namespace': 'demo'},
                     'data': {'token': 'abc'},
                 }
-            return None
+                for ref in refs if ref == ('Secret', 'adopt-me', 'demo')
+            }
 
         plan = build_upgrade_plan(
             rendered_manifests,
             cluster_manifests,
             {'ignore_fields': {}},
-            lookup_manifest_func=lookup)
+            lookup_manifests_func=lookup)
 
         self.assertEqual(plan['summary'], {
             'create': 1,
@@ -275,6 +475,8 @@ class HelmServiceSupportTests(unittest.TestCase):
         self.assertEqual(resource_statuses['Secret:demo:adopt-me'], 'adopt')
         self.assertEqual(resource_statuses['ConfigMap:demo:new'], 'create')
         self.assertEqual(resource_statuses['Service:demo:old'], 'orphan')
+        self.assertEqual(len(lookup_calls), 1)
+        self.assertIn(('Secret', 'adopt-me', 'demo'), lookup_calls[0])
         deployment_plan = [
             resource for resource in plan['resources']
             if resource['key'] == 'Deployment:demo:api'
@@ -283,7 +485,43 @@ class HelmServiceSupportTests(unittest.TestCase):
             'spec.selector'
         ])
 
-    def test_build_state_check_reports_runtime_and_chart_drift(self):
+    def test_build_upgrade_plan_consumes_rendered_stream_and_matches_hash_suffix(self):
+        def rendered_stream():
+            yield {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'app-deadbeef', 'namespace': 'demo'},
+                'data': {'value': 'new'},
+            }
+            yield {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'same', 'namespace': 'demo'},
+                'data': {'value': '1'},
+            }
+
+        cluster_manifests = [
+            {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'app-cafebabe', 'namespace': 'demo'},
+                'data': {'value': 'old'},
+            },
+            {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'same', 'namespace': 'demo'},
+                'data': {'value': '1'},
+            },
+        ]
+
+        plan = build_upgrade_plan(rendered_stream(), cluster_manifests,
+                                  {'ignore_fields': {}},
+                                  lookup_manifests_func=lambda refs: {})
+
+        self.assertEqual(plan['summary']['update'], 1)
+        self.assertEqual(plan['summary']['unchanged'], 1)
+        self.assertEqual(plan['summary']['orphan'], 0)
+        self.assertEqual(plan['resources'][0]['matched_runtime_key'],
+                         'ConfigMap:demo:app-cafebabe')
+
+    def state_check_manifests(self):
         release_manifests = [
             {
                 'kind': 'ConfigMap',
@@ -350,10 +588,10 @@ class HelmServiceSupportTests(unittest.TestCase):
                 'data': {'token': 'abc'},
             },
         ]
+        return release_manifests, runtime_manifests, chart_manifests
 
-        result = build_state_check(
-            release_manifests, runtime_manifests, chart_manifests,
-            {'ignore_fields': {}})
+    def test_build_state_check_reports_runtime_and_chart_drift(self):
+        result = build_state_check(*self.state_check_manifests(), {'ignore_fields': {}})
 
         self.assertEqual(result['summary'], {
             'release_resources': 4,
@@ -379,13 +617,52 @@ class HelmServiceSupportTests(unittest.TestCase):
             result['chart_consistency']['missing_from_chart'][0]['key'],
             'ConfigMap:demo:delete-from-chart')
 
+    def test_build_state_check_streams_sqlite_stores_with_same_result(self):
+        manifest_sets = self.state_check_manifests()
+        expected = build_state_check(*manifest_sets, {'ignore_fields': {}})
+
+        with contextlib.ExitStack() as stores:
+            result = build_state_check(
+                *[stores.enter_context(SqliteManifestStore(manifests, helm_namespace='demo'))
+                  for manifests in manifest_sets],
+                {'ignore_fields': {}})
+
+        self.assertEqual(result, expected)
+
+    @patch('services.helm_service.print_structured_output')
+    @patch('services.helm_service.iter_rendered_chart_manifests')
+    @patch('services.helm_service.get_all_release_api_objects')
+    @patch('services.helm_service.iter_release_manifests')
+    def test_state_check_spill_to_disk_removes_sqlite_files(
+            self, iter_release_manifests, get_all_release_api_objects,
+            iter_rendered_chart_manifests, print_structured_output):
+        release_manifests, runtime_manifests, chart_manifests = self.state_check_manifests()
+        iter_release_manifests.return_value = iter(release_manifests)
+        get_all_release_api_objects.return_value = runtime_manifests
+        iter_rendered_chart_manifests.return_value = iter(chart_manifests)
+        expected = build_state_check(release_manifests, runtime_manifests, chart_manifests,
+                                     {'ignore_fields': {}})
+
+        with tempfile.TemporaryDirectory() as spill_dir, \
+                patch.dict(os.environ, {'FINE_UPGRADE_SPILL_DIR': spill_dir}), \
+                patch('builtins.open', mock_open(read_data='ignore_fields: {}\n')):
+            state_check('release', './chart', None, './config.yml',
+                        output_format='json', spill_to_disk=True)
+            spilled_files = os.listdir(spill_dir)
+
+        self.assertEqual(spilled_files, [])
+        self.assertEqual(print_structured_output.call_args.args[0]['summary'],
+                         dict(expected['summary'], fetch_failed=0))
+        release_store = get_all_release_api_objects.call_args.kwargs['release_manifests']
+        self.assertIsInstance(release_store, SqliteManifestStore)
+
     @patch('services.helm_service.print_structured_output')
     @patch('services.helm_service.get_all_release_api_objects')
-    @patch('services.helm_service.render_chart_manifests')
+    @patch('services.helm_service.iter_rendered_chart_manifests')
     def test_plan_upgrade_fail_on_exits_after_printing_report(
-            self, render_chart_manifests, get_all_release_api_objects,
+            self, iter_rendered_chart_manifests, get_all_release_api_objects,
             print_structured_output):
-        render_chart_manifests.return_value = [
+        iter_rendered_chart_manifests.return_value = [
             {
                 'kind': 'ConfigMap',
                 'metadata': {'name': 'changed', 'namespace': 'demo'},
@@ -409,5 +686,129 @@ class HelmServiceSupportTests(unittest.TestCase):
         print_structured_output.assert_called_once()
 
 
+    @patch('services.helm_service.print_structured_output')
+    @patch('services.helm_service.get_all_release_api_objects')
+    @patch('services.helm_service.iter_rendered_chart_manifests')
+    def test_plan_upgrade_reports_runtime_fetch_failures(
+            self, iter_rendered_chart_manifests, get_all_release_api_objects,
+            print_structured_output):
+        iter_rendered_chart_manifests.return_value = []
+
+        def fetch(release_name, manifests=None, failures=None):
+            failures.append({'kind': 'Secret', 'namespace': 'demo', 'error': 'timeout'})
+            return []
+
+        get_all_release_api_objects.side_effect = fetch
+
+        with patch('builtins.open', mock_open(read_data='ignore_fields: {}\n')):
+            with self.assertRaises(SystemExit):
+                plan_upgrade('./chart', 'release', None, './config.yml', '',
+                             fail_on='fetch_failed')
+
+        plan = print_structured_output.call_args.args[0]
+        self.assertEqual(plan['summary']['fetch_failed'], 1)
+        self.assertEqual(plan['fetch_failures'], [
+            {'kind': 'Secret', 'namespace': 'demo', 'error': 'timeout'},
+        ])
+
+    @patch('services.helm_service.print_structured_output')
+    @patch('services.helm_service.get_api_object_specs', return_value={})
+    @patch('utils.helm_utils.get_release_manifest_profile')
+    @patch('utils.helm_utils.fetch_api_objects')
+    @patch('services.helm_service.iter_rendered_chart_manifests')
+    def test_plan_upgrade_fetches_kinds_only_present_in_render(
+            self, iter_rendered_chart_manifests, fetch_api_objects,
+            get_release_manifest_profile, get_api_object_specs, print_structured_output):
+        annotations = {'meta.helm.sh/release-name': 'release',
+                       'meta.helm.sh/release-namespace': 'demo'}
+        config_map = {'kind': 'ConfigMap',
+                      'metadata': {'name': 'app', 'namespace': 'demo', 'annotations': annotations},
+                      'data': {'value': '1'}}
+        iter_rendered_chart_manifests.return_value = [config_map]
+        get_release_manifest_profile.return_value = {
+            'kinds': ['Deployment'], 'namespaces': ['demo']}
+        fetch_api_objects.side_effect = lambda kind, scope, selector: \
+            [config_map] if kind == 'ConfigMap' else []
+
+        with patch('builtins.open', mock_open(read_data='ignore_fields: {}\n')), \
+                patch.dict(os.environ, {'HELM_NAMESPACE': 'demo'}):
+            plan_upgrade('./chart', 'release', None, './config.yml', '')
+
+        plan = print_structured_output.call_args.args[0]
+        self.assertEqual([resource['status'] for resource in plan['resources']], ['unchanged'])
+        get_api_object_specs.assert_not_called()
+
+    def test_select_changed_manifests_keeps_planned_changes(self):
+        manifests = [
+            {'kind': 'ConfigMap', 'metadata': {'name': name, 'namespace': 'demo'}}
+            for name in ('same', 'changed', 'adopted')
+        ]
+        plan = {'resources': [
+            {'key': 'ConfigMap:demo:same', 'kind': 'ConfigMap', 'status': 'unchanged'},
+            {'key': 'ConfigMap:demo:changed', 'kind': 'ConfigMap', 'status': 'update'},
+            {'key': 'ConfigMap:demo:adopted', 'kind': 'ConfigMap', 'status': 'adopt'},
+            {'key': 'ConfigMap:demo:orphan', 'kind': 'ConfigMap', 'status': 'orphan'},
+        ]}
+
+        changed, skipped = select_changed_manifests(manifests, plan)
+
+        self.assertEqual([manifest['metadata']['name'] for manifest in changed],
+                         ['changed', 'adopted'])
+        self.assertEqual([resource['key'] for resource in skipped], ['ConfigMap:demo:same'])
+
+    @patch('services.helm_service.apply_manifests_and_report')
+    @patch('services.helm_service.get_api_object_specs', return_value={})
+    @patch('services.helm_service.get_complete_release_api_objects')
+    @patch('services.helm_service.render_helm_template_manifests')
+    def test_apply_only_changed_skips_unchanged_resources(
+            self, render_helm_template_manifests, get_complete_release_api_objects,
+            get_api_object_specs, apply_manifests_and_report):
+        def config_map(name, value):
+            return {'kind': 'ConfigMap', 'metadata': {'name': name, 'namespace': 'demo'},
+                    'data': {'value': value}}
+
+        render_helm_template_manifests.return_value = [
+            config_map('same', '1'), config_map('changed', '2'), config_map('new', '3')]
+        get_complete_release_api_objects.return_value = [
+            config_map('same', '1'), config_map('changed', 'old')]
+
+        with patch('builtins.open', mock_open(read_data='ignore_fields: {}\n')), \
+                patch.dict(os.environ, {'DRY_RUN_FLAG': '0', 'HELM_DEBUG': '0'}), \
+                contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            apply_upgrade('./chart', 'release', None, '',
+                          config_path='./config.yml', only_changed=True)
+
+        applied = [manifest['metadata']['name']
+                   for manifest in apply_manifests_and_report.call_args.args[0]]
+        self.assertEqual(applied, ['changed', 'new'])
+        self.assertIn('跳过 1 个未变化的资源: ConfigMap 1', stderr.getvalue())
+        get_api_object_specs.assert_called_once_with([('ConfigMap', 'new', 'demo')])
+
+    @patch('services.helm_service.apply_manifests_and_report')
+    @patch('utils.helm_utils.get_all_release_api_objects')
+    @patch('services.helm_service.render_helm_template_manifests')
+    def test_apply_only_changed_aborts_when_runtime_fetch_fails(
+            self, render_helm_template_manifests, get_all_release_api_objects,
+            apply_manifests_and_report):
+        def fetch(release_name, manifests=None, failures=None):
+            failures.append({'kind': 'ConfigMap', 'namespace': 'demo', 'error': 'forbidden'})
+            return []
+
+        render_helm_template_manifests.return_value = [
+            {'kind': 'ConfigMap', 'metadata': {'name': 'app', 'namespace': 'demo'}}]
+        get_all_release_api_objects.side_effect = fetch
+
+        with patch('builtins.open', mock_open(read_data='ignore_fields: {}\n')), \
+                patch.dict(os.environ, {'DRY_RUN_FLAG': '0'}), \
+                contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()), \
+                self.assertRaises(SystemExit) as raised:
+            apply_upgrade('./chart', 'release', None, '',
+                          config_path='./config.yml', only_changed=True)
+
+        self.assertEqual(raised.exception.code, FAILURE_EXIT_CODE)
+        apply_manifests_and_report.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,20 +1,32 @@
+import contextlib
+import io
+import json
 import os
+import subprocess
 import sys
+import tempfile
 import unittest
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
-from utils.helm_utils import (build_helm_get_manifest_cmd,
+from utils.helm_utils import (K8S_KINDS,
+                              build_helm_get_manifest_cmd,
                               build_kubectl_cmd,
                               build_helm_template_cmd,
+                              chunk_object_names,
                               configure_kube_options,
+                              HashSuffixKeyIndex,
                               find_first_same_object_key_with_different_hash,
+                              get_all_release_api_objects,
+                              get_api_object_specs,
                               get_container_image_versions,
                               get_helm_namespace,
                               get_manifest_namespace,
                               get_manifest_unique_key,
                               get_image_version,
-                              manifests_list_to_dict)
+                              manifests_list_to_dict,
+                              plan_release_api_object_fetch)
 
 
 class HelmUtilsTests(unittest.TestCase):
@@ -27,6 +39,7 @@ class HelmUtilsTests(unittest.TestCase):
                 'FINE_UPGRADE_KUBECONFIG',
                 'FINE_UPGRADE_KUBE_CONTEXT',
                 'FINE_UPGRADE_TIMEOUT',
+                'FINE_UPGRADE_RELEASE_CACHE_DIR',
             )
         }
         for key in self.original_env:
@@ -107,6 +120,195 @@ class HelmUtilsTests(unittest.TestCase):
             }),
             'Namespace::demo')
 
+    def test_chunk_object_names_limits_count_and_bytes(self):
+        self.assertEqual(chunk_object_names(['a', 'b', 'c'], max_names=2),
+                         [['a', 'b'], ['c']])
+        self.assertEqual(chunk_object_names(['aaa', 'bbb', 'c'], max_bytes=6),
+                         [['aaa'], ['bbb', 'c']])
+        self.assertEqual(chunk_object_names([]), [])
+
+    @patch('utils.helm_utils.run_cmd')
+    def test_get_api_object_specs_issues_one_get_per_kind_and_namespace(self, run_cmd):
+        outputs = {
+            ('ConfigMap', 'demo'): json.dumps({'kind': 'List', 'items': [
+                {'kind': 'ConfigMap', 'metadata': {'name': 'a', 'namespace': 'demo'}},
+                {'kind': 'ConfigMap', 'metadata': {'name': 'c', 'namespace': 'demo'}},
+            ]}),
+            ('Secret', 'demo'): json.dumps(
+                {'kind': 'Secret', 'metadata': {'name': 's', 'namespace': 'demo'}}),
+            ('ConfigMap', 'other'): '',
+        }
+        run_cmd.side_effect = lambda cmd: outputs[(cmd[2], cmd[cmd.index('-n') + 1])]
+
+        manifests = get_api_object_specs([
+            ('ConfigMap', 'a', 'demo'),
+            ('ConfigMap', 'b', 'demo'),
+            ('Secret', 's', 'demo'),
+            ('ConfigMap', 'c', 'demo'),
+            ('ConfigMap', 'a', 'demo'),
+            ('ConfigMap', 'x', 'other'),
+        ])
+
+        self.assertEqual(sorted(manifests), [
+            ('ConfigMap', 'a', 'demo'),
+            ('ConfigMap', 'c', 'demo'),
+            ('Secret', 's', 'demo'),
+        ])
+        self.assertEqual(run_cmd.call_count, 3)
+        self.assertEqual(run_cmd.call_args_list[0].args[0], [
+            'kubectl', 'get', 'ConfigMap', 'a', 'b', 'c',
+            '--ignore-not-found', '-o', 'json', '-n', 'demo'
+        ])
+
+    @patch('utils.helm_utils.run_cmd')
+    def test_get_api_object_specs_falls_back_to_single_gets_when_batch_fails(self, run_cmd):
+        def fake_run_cmd(cmd):
+            if 'b' in cmd:
+                return None if 'a' in cmd else json.dumps(
+                    {'kind': 'Secret', 'metadata': {'name': 'b'}})
+            return None
+
+        run_cmd.side_effect = fake_run_cmd
+
+        manifests = get_api_object_specs([('Secret', 'a', 'demo'), ('Secret', 'b', 'demo')])
+
+        self.assertEqual(list(manifests), [('Secret', 'b', 'demo')])
+        self.assertEqual(run_cmd.call_count, 3)
+
+    def test_plan_release_fetch_targets_manifest_namespaces(self):
+        os.environ['HELM_NAMESPACE'] = 'demo'
+        manifests = [
+            {'kind': 'ConfigMap', 'metadata': {
+                'name': 'a', 'labels': {'app.kubernetes.io/instance': 'web'}}},
+            {'kind': 'Secret', 'metadata': {
+                'name': 'b', 'namespace': 'shared',
+                'labels': {'app.kubernetes.io/instance': 'web'}}},
+            {'kind': 'PersistentVolume', 'metadata': {
+                'name': 'pv', 'labels': {'app.kubernetes.io/instance': 'web'}}},
+        ]
+
+        fetch_plan = plan_release_api_object_fetch('web', manifests, release_manifests=[])
+
+        # instance 标签可能在集群中被修改或缺失，不用于服务端过滤
+        self.assertEqual(fetch_plan, {
+            'kinds': ['Secret', 'ConfigMap', 'PersistentVolume'],
+            'namespaces': ['demo', 'shared'],
+            'selector': 'app.kubernetes.io/managed-by=Helm',
+        })
+
+    def test_plan_release_fetch_falls_back_to_all_namespaces_and_kinds(self):
+        fetch_plan = plan_release_api_object_fetch('web', [], release_manifests=[])
+        self.assertIsNone(fetch_plan['namespaces'])
+        self.assertEqual(fetch_plan['kinds'], K8S_KINDS)
+        manifests = [{'kind': 'ConfigMap', 'metadata': {'name': 'a', 'namespace': f'ns-{i}'}}
+                     for i in range(20)]
+        self.assertIsNone(plan_release_api_object_fetch(
+            'web', manifests, release_manifests=[])['namespaces'])
+
+    @patch('utils.helm_utils.open_cmd_stream')
+    def test_get_all_release_api_objects_fetches_each_kind_and_reports_failures(
+            self, open_cmd_stream):
+        os.environ['HELM_NAMESPACE'] = 'demo'
+        def release_annotations(release_name):
+            return {'meta.helm.sh/release-name': release_name,
+                    'meta.helm.sh/release-namespace': 'demo'}
+
+        outputs = {
+            ('ConfigMap', 'demo'): json.dumps({'items': [
+                {'kind': 'ConfigMap', 'metadata': {
+                    'name': 'mine', 'namespace': 'demo', 'annotations': release_annotations('web')}},
+                {'kind': 'ConfigMap', 'metadata': {
+                    'name': 'other', 'namespace': 'demo', 'annotations': release_annotations('api')}},
+            ]}),
+            ('ConfigMap', 'shared'): '{"items": []}',
+            ('Secret', 'demo'): '{"items": []}',
+            ('PersistentVolume', None): json.dumps({'items': [
+                {'kind': 'PersistentVolume', 'metadata': {
+                    'name': 'pv', 'annotations': release_annotations('web')}},
+            ]}),
+        }
+
+        def fake_open_cmd_stream(cmd, quiet=False):
+            namespace = cmd[cmd.index('-n') + 1] if '-n' in cmd else None
+            output = outputs.get((cmd[2], namespace))
+            if output is None:
+                raise subprocess.CalledProcessError(1, cmd, stderr='forbidden\n')
+            return contextlib.nullcontext(io.StringIO(output))
+
+        open_cmd_stream.side_effect = fake_open_cmd_stream
+        failures = []
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            manifests = get_all_release_api_objects(
+                'web', [
+                    {'kind': 'ConfigMap', 'metadata': {'name': 'c'}},
+                    {'kind': 'Secret', 'metadata': {'name': 's', 'namespace': 'shared'}},
+                    {'kind': 'PersistentVolume', 'metadata': {'name': 'pv'}},
+                ],
+                release_manifests=[], failures=failures)
+
+        self.assertEqual(sorted(manifest['metadata']['name'] for manifest in manifests),
+                         ['mine', 'pv'])
+        self.assertEqual(open_cmd_stream.call_count, 5)
+        self.assertFalse(any('--all-namespaces' in call.args[0]
+                             for call in open_cmd_stream.call_args_list))
+        self.assertEqual(failures, [
+            {'kind': 'Secret', 'namespace': 'shared', 'error': 'forbidden'},
+        ])
+
+    @patch('utils.helm_utils.get_release_manifests')
+    @patch('utils.helm_utils.get_release_version')
+    def test_release_manifest_profile_is_cached_per_release_version(self, get_release_version,
+                                                                   get_release_manifests):
+        release_manifests = [
+            {'kind': 'Deployment', 'metadata': {'name': 'api', 'namespace': 'demo'}},
+            {'kind': 'Service', 'metadata': {'name': 'api', 'namespace': 'demo'}},
+        ]
+        get_release_manifests.return_value = release_manifests
+        version = {'revision': 3, 'updated': '2026-01-01T00:00:00Z', 'chart': 'web-1.0.0'}
+        get_release_version.return_value = version
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ['FINE_UPGRADE_RELEASE_CACHE_DIR'] = cache_dir
+
+            first = plan_release_api_object_fetch('web')
+            second = plan_release_api_object_fetch('web')
+            get_release_version.return_value = dict(version, revision=4)
+            plan_release_api_object_fetch('web')
+
+        self.assertEqual(first['kinds'], ['Service', 'Deployment'])
+        self.assertEqual(second, first)
+        self.assertEqual(get_release_manifests.call_count, 2)
+
+    @patch('utils.helm_utils.get_release_manifests')
+    @patch('utils.helm_utils.get_release_version')
+    def test_release_manifest_profile_is_refetched_after_reinstall(self, get_release_version,
+                                                                   get_release_manifests):
+        get_release_manifests.side_effect = [
+            [{'kind': 'Deployment', 'metadata': {'name': 'api', 'namespace': 'demo'}}],
+            [{'kind': 'StatefulSet', 'metadata': {'name': 'db', 'namespace': 'demo'}}],
+        ]
+        version = {'revision': 1, 'updated': '2026-01-01T00:00:00Z', 'chart': 'web-1.0.0'}
+        get_release_version.return_value = version
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ['FINE_UPGRADE_RELEASE_CACHE_DIR'] = cache_dir
+
+            plan_release_api_object_fetch('web')
+            get_release_version.return_value = dict(version, updated='2026-02-01T00:00:00Z')
+            reinstalled = plan_release_api_object_fetch('web')
+
+        self.assertEqual(reinstalled['kinds'], ['StatefulSet'])
+        self.assertEqual(get_release_manifests.call_count, 2)
+
+    @patch('utils.helm_utils.get_release_manifests')
+    @patch('utils.helm_utils.get_release_version', return_value=None)
+    def test_plan_release_fetch_skips_manifest_read_for_missing_release(
+            self, _, get_release_manifests):
+        fetch_plan = plan_release_api_object_fetch(
+            'web', [{'kind': 'ConfigMap', 'metadata': {'name': 'a'}}])
+
+        self.assertEqual(fetch_plan['kinds'], ['ConfigMap'])
+        get_release_manifests.assert_not_called()
+
     def test_find_first_same_object_key_with_different_hash(self):
         keys = {
             'ConfigMap:demo:app-cafebabe',
@@ -118,6 +320,25 @@ class HelmUtilsTests(unittest.TestCase):
 
         self.assertEqual(result, 'ConfigMap:demo:app-cafebabe')
 
+    def test_hash_suffix_key_index_matches_base_and_hash_length(self):
+        index = HashSuffixKeyIndex([
+            'ConfigMap:demo:app-cafebabe',
+            'ConfigMap:demo:app-0123456789',
+            'ConfigMap:demo:app-config',
+            'ConfigMap:demo:app-feedface',
+        ])
+
+        self.assertEqual(index.find('ConfigMap:demo:app-deadbeef'), 'ConfigMap:demo:app-cafebabe')
+        self.assertEqual(index.find('ConfigMap:demo:app-abcdefabcd'),
+                         'ConfigMap:demo:app-0123456789')
+        self.assertIsNone(index.find('ConfigMap:demo:app-secret'))
+        self.assertIsNone(index.find('Secret:demo:app-deadbeef'))
+
+        index.discard('ConfigMap:demo:app-cafebabe')
+        self.assertEqual(index.find('ConfigMap:demo:app-deadbeef'), 'ConfigMap:demo:app-feedface')
+        index.discard('ConfigMap:demo:app-feedface')
+        self.assertIsNone(index.find('ConfigMap:demo:app-deadbeef'))
+
     def test_get_container_image_versions_supports_multiple_containers(self):
         manifest = {
             'spec': {
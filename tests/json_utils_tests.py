@@ -0,0 +1,52 @@
+import importlib
+import io
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from utils import json_utils
+
+
+class JsonUtilsTests(unittest.TestCase):
+
+    def tearDown(self):
+        importlib.reload(json_utils)
+
+    def assert_round_trip(self):
+        data = {'kind': 'List', 'items': [{'name': '中文', 'replicas': 2, 'ready': True}]}
+
+        self.assertEqual(json_utils.loads_json(json_utils.dumps_json(data)), data)
+        self.assertEqual(json_utils.load_json(io.StringIO('{"a": 1.5}')), {'a': 1.5})
+        self.assertEqual(json_utils.loads_json(b'[1, null]'), [1, None])
+        with self.assertRaises(ValueError):
+            json_utils.loads_json('{broken')
+
+    def test_loads_and_dumps_with_active_backend(self):
+        self.assertIn(json_utils.JSON_BACKEND, ('orjson', 'json'))
+        self.assert_round_trip()
+
+    def test_backend_falls_back_to_standard_library_without_orjson(self):
+        with patch.dict(sys.modules, {'orjson': None}):
+            importlib.reload(json_utils)
+
+        self.assertEqual(json_utils.JSON_BACKEND, 'json')
+        self.assert_round_trip()
+
+    def test_iter_json_documents_splits_kubectl_watch_output(self):
+        stream = io.StringIO(''.join(
+            json.dumps({'metadata': {'name': 'api', 'resourceVersion': str(version)},
+                        'status': {'replicas': 1}}, indent=4) + '\n'
+            for version in range(3)))
+
+        documents = list(json_utils.iter_json_documents(stream))
+
+        self.assertEqual([document['metadata']['resourceVersion'] for document in documents],
+                         ['0', '1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
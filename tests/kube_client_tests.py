@@ -0,0 +1,294 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import utils.helm_utils as helm_utils
+from utils.helm_utils import fetch_api_objects, get_api_object_specs
+from utils.kube_client import (API_RESOURCES, KubeApiError, KubeClientUnavailable,
+                               create_kube_client, parse_timeout)
+from utils.kube_ops_utils import (DeploymentReadinessTracker, apply_manifests,
+                                  is_deployment_ready)
+
+
+class StubApiServer(ThreadingHTTPServer):
+    """按路径返回预置对象的 API Server 桩，记录请求和客户端连接数"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubApiHandler)
+        self.objects = {}
+        for api_version, plural, _ in API_RESOURCES.values():
+            path = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+            discovery = self.objects.setdefault(path, {'kind': 'APIResourceList', 'resources': []})
+            discovery['resources'].append({'name': plural})
+        self.watch_events = {}
+        self.requests = []
+        self.client_addresses = set()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_request(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.client_addresses.add(self.client_address)
+        self.server.requests.append({
+            'method': self.command,
+            'path': parsed.path,
+            'query': dict(urllib.parse.parse_qsl(parsed.query)),
+            'headers': dict(self.headers),
+            'body': body,
+        })
+        if self.command == 'PATCH':
+            self.server.objects[parsed.path] = body
+        if self.server.requests[-1]['query'].get('watch') == 'true':
+            self.send_watch_events(self.server.watch_events.get(parsed.path) or [])
+            return
+        document = self.server.objects.get(parsed.path)
+        if document is None:
+            self.send_json(404, {'kind': 'Status', 'message': f'{parsed.path} not found'})
+        else:
+            self.send_json(200, document)
+
+    def send_json(self, status, document):
+        data = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_watch_events(self, events):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in events:
+            data = json.dumps(event).encode('utf-8') + b'\n'
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    do_GET = handle_request
+    do_PATCH = handle_request
+
+
+class KubeClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.original_env = {
+            key: os.environ.get(key)
+            for key in (
+                'FINE_UPGRADE_KUBECONFIG',
+                'FINE_UPGRADE_KUBE_CONTEXT',
+                'FINE_UPGRADE_TIMEOUT',
+                'FINE_UPGRADE_NATIVE_CLIENT',
+            )
+        }
+        self.server = StubApiServer()
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.kubeconfig = self.write_kubeconfig({'token': 'secret-token'})
+        helm_utils._native_kube_clients.clear()
+
+    def tearDown(self):
+        for client in helm_utils._native_kube_clients.values():
+            if client is not None:
+                client.close()
+        helm_utils._native_kube_clients.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+        for key, value in self.original_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def write_kubeconfig(self, user, server=None):
+        path = os.path.join(self.temp_dir.name, 'kubeconfig.yaml')
+        with open(path, 'w', encoding='utf-8') as output_file:
+            json.dump({
+                'current-context': 'dev',
+                'clusters': [{'name': 'dev', 'cluster': {'server': server or self.server.url}}],
+                'users': [{'name': 'dev', 'user': user}],
+                'contexts': [{'name': 'dev', 'context': {
+                    'cluster': 'dev', 'user': 'dev', 'namespace': 'demo'}}],
+            }, output_file)
+        return path
+
+    def enable_native_client(self):
+        os.environ['FINE_UPGRADE_NATIVE_CLIENT'] = '1'
+        os.environ['FINE_UPGRADE_KUBECONFIG'] = self.kubeconfig
+        os.environ.pop('FINE_UPGRADE_KUBE_CONTEXT', None)
+        os.environ.pop('FINE_UPGRADE_TIMEOUT', None)
+
+    def test_parse_timeout_accepts_kubectl_durations(self):
+        self.assertEqual(parse_timeout('30s'), 30)
+        self.assertEqual(parse_timeout('2m'), 120)
+        self.assertEqual(parse_timeout('500ms'), 0.5)
+        self.assertEqual(parse_timeout('15'), 15)
+        self.assertIsNone(parse_timeout('0'))
+        self.assertIsNone(parse_timeout(None))
+
+    def test_exec_credentials_are_not_supported(self):
+        kubeconfig = self.write_kubeconfig({'exec': {'command': 'aws'}})
+
+        with self.assertRaises(KubeClientUnavailable):
+            create_kube_client(kubeconfig)
+
+    def test_get_uses_context_namespace_token_and_one_pooled_connection(self):
+        self.server.objects['/apis/apps/v1/namespaces/demo/deployments/api'] = {
+            'kind': 'Deployment', 'metadata': {'name': 'api', 'namespace': 'demo'}}
+        client = create_kube_client(self.kubeconfig)
+
+        for _ in range(3):
+            self.assertEqual(client.get('Deployment', 'api')['metadata']['name'], 'api')
+        self.assertIsNone(client.get('Deployment', 'missing', 'demo'))
+        client.close()
+
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(len(self.server.client_addresses), 1)
+        self.assertEqual(self.server.requests[0]['headers']['Authorization'],
+                         'Bearer secret-token')
+
+    def test_list_adds_kind_and_passes_label_selector(self):
+        self.server.objects['/api/v1/secrets'] = {
+            'apiVersion': 'v1', 'kind': 'SecretList',
+            'items': [{'metadata': {'name': 'token', 'namespace': 'other'}}]}
+        client = create_kube_client(self.kubeconfig)
+
+        items = client.list('Secret', label_selector='app.kubernetes.io/managed-by=Helm')
+        client.close()
+
+        self.assertEqual(items, [{'kind': 'Secret', 'apiVersion': 'v1',
+                                  'metadata': {'name': 'token', 'namespace': 'other'}}])
+        self.assertEqual(self.server.requests[0]['query'],
+                         {'labelSelector': 'app.kubernetes.io/managed-by=Helm'})
+
+    def test_api_errors_carry_status_message(self):
+        client = create_kube_client(self.kubeconfig)
+
+        with self.assertRaises(KubeApiError) as context:
+            client.list('ConfigMap', 'demo')
+        client.close()
+
+        self.assertEqual(context.exception.status, 404)
+        self.assertIn('not found', context.exception.message)
+
+    def test_helm_utils_fetch_and_lookup_use_native_client(self):
+        self.enable_native_client()
+        self.server.objects['/api/v1/namespaces/demo/configmaps'] = {
+            'apiVersion': 'v1', 'items': [{'metadata': {'name': 'app', 'namespace': 'demo'}}]}
+        self.server.objects['/api/v1/namespaces/demo/configmaps/app'] = {
+            'kind': 'ConfigMap', 'metadata': {'name': 'app', 'namespace': 'demo'}}
+
+        with patch('utils.helm_utils.open_cmd_stream') as open_cmd_stream, \
+                patch('utils.helm_utils.run_cmd') as run_cmd:
+            items = fetch_api_objects('ConfigMap', ['-n', 'demo'], 'a=b')
+            manifests = get_api_object_specs([
+                ('ConfigMap', 'app', 'demo'), ('ConfigMap', 'missing', None)])
+
+        open_cmd_stream.assert_not_called()
+        run_cmd.assert_not_called()
+        self.assertEqual(items[0]['kind'], 'ConfigMap')
+        self.assertEqual(list(manifests), [('ConfigMap', 'app', 'demo')])
+
+    def test_apply_uses_kubectl_and_readiness_uses_native_client(self):
+        self.enable_native_client()
+        deployment = {
+            'apiVersion': 'apps/v1',
+            'kind': 'Deployment',
+            'metadata': {'name': 'api'},
+            'spec': {'replicas': 1},
+        }
+        self.server.objects['/apis/apps/v1/namespaces/demo/deployments/api'] = dict(
+            deployment, status={'readyReplicas': 1, 'updatedReplicas': 1, 'availableReplicas': 1})
+
+        with patch('utils.kube_ops_utils.run_cmd', return_value='deployment.apps/api configured') \
+                as run_cmd, contextlib.redirect_stdout(io.StringIO()):
+            apply_manifests([deployment])
+
+        self.assertEqual(run_cmd.call_args.args[0][1:4], ['apply', '-f', '-'])
+        self.assertTrue(is_deployment_ready('api', 'demo'))
+        self.assertEqual({request['method'] for request in self.server.requests}, {'GET'})
+
+    def test_readiness_tracker_watches_namespace_with_native_client(self):
+        self.enable_native_client()
+        deployment = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'api', 'namespace': 'demo', 'generation': 2},
+            'spec': {'replicas': 1},
+            'status': {'observedGeneration': 1},
+        }
+        self.server.objects['/apis/apps/v1/namespaces/demo/deployments/api'] = deployment
+        self.server.watch_events['/apis/apps/v1/namespaces/demo/deployments'] = [
+            {'type': 'ADDED', 'object': dict(deployment, status={'observedGeneration': 2})},
+            {'type': 'MODIFIED', 'object': dict(deployment, status={
+                'observedGeneration': 2, 'readyReplicas': 1,
+                'updatedReplicas': 1, 'availableReplicas': 1})},
+        ]
+
+        with patch('utils.kube_ops_utils.open_cmd_stream') as open_cmd_stream:
+            self.assertIsNotNone(DeploymentReadinessTracker().wait('api', 'demo', timeout=30))
+
+        open_cmd_stream.assert_not_called()
+        watch_requests = [request for request in self.server.requests
+                          if request['query'].get('watch') == 'true']
+        self.assertEqual(watch_requests[0]['path'], '/apis/apps/v1/namespaces/demo/deployments')
+        self.assertNotIn('fieldSelector', watch_requests[0]['query'])
+        self.assertNotIn('resourceVersion', watch_requests[0]['query'])
+
+    def test_falls_back_to_kubectl_for_api_versions_the_cluster_does_not_serve(self):
+        self.enable_native_client()
+        del self.server.objects['/apis/autoscaling/v2']
+        self.server.objects['/api/v1/namespaces/demo/secrets/token'] = {'kind': 'Secret'}
+
+        with patch('utils.helm_utils.run_cmd',
+                   return_value='{"kind": "HorizontalPodAutoscaler"}') as run_cmd:
+            autoscaler = helm_utils.get_api_object_spec('HorizontalPodAutoscaler', 'api', 'demo')
+            secret = helm_utils.get_api_object_spec('Secret', 'token', 'demo')
+
+        self.assertEqual(autoscaler, {'kind': 'HorizontalPodAutoscaler'})
+        self.assertEqual(secret, {'kind': 'Secret'})
+        self.assertEqual(run_cmd.call_count, 1)
+        paths = [request['path'] for request in self.server.requests]
+        self.assertNotIn('/apis/autoscaling/v2/namespaces/demo/horizontalpodautoscalers/api', paths)
+        self.assertEqual(paths.count('/apis/autoscaling/v2'), 1)
+
+    def test_falls_back_to_kubectl_when_api_server_is_unreachable(self):
+        self.kubeconfig = self.write_kubeconfig({'token': 'x'}, server='http://127.0.0.1:1')
+        self.enable_native_client()
+
+        with patch('utils.helm_utils.run_cmd', return_value='{"kind": "Secret"}') as run_cmd, \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            first = helm_utils.get_api_object_spec('Secret', 'token', 'demo')
+            second = helm_utils.get_api_object_spec('Secret', 'token', 'demo')
+
+        self.assertEqual(first, {'kind': 'Secret'})
+        self.assertEqual(second, {'kind': 'Secret'})
+        self.assertEqual(run_cmd.call_count, 2)
+        self.assertEqual(stderr.getvalue().count('改用 kubectl'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
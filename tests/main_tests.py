@@ -7,8 +7,10 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 
 from main import (
     CONFIRMATION_REQUIRED_EXIT_CODE,
+    USAGE_ERROR_EXIT_CODE,
     build_parser,
     configure_runtime_options,
+    validate_chart_option,
     validate_safety_options,
 )
 
@@ -25,6 +27,11 @@ class MainCliTests(unittest.TestCase):
                 'FINE_UPGRADE_TIMEOUT',
                 'DRY_RUN_FLAG',
                 'HELM_DEBUG',
+                'FINE_UPGRADE_NO_RENDER_CACHE',
+                'FINE_UPGRADE_PARALLELISM',
+                'FINE_UPGRADE_NATIVE_CLIENT',
+                'FINE_UPGRADE_ROLLOUT_TIMEOUT',
+                'FINE_UPGRADE_NAMESPACE_OPTION',
             )
         }
         for key in self.original_env:
@@ -82,16 +89,25 @@ class MainCliTests(unittest.TestCase):
             '--timeout', '30s',
             '--dry-run',
             '--debug',
+            '--no-render-cache',
+            '--parallelism', '8',
+            '--native-client',
+            '--rollout-timeout', '600',
         ])
 
         configure_runtime_options(args)
 
         self.assertEqual(os.environ['HELM_NAMESPACE'], 'demo')
+        self.assertEqual(os.environ['FINE_UPGRADE_NAMESPACE_OPTION'], 'demo')
         self.assertEqual(os.environ['FINE_UPGRADE_KUBECONFIG'], './kubeconfig.yaml')
         self.assertEqual(os.environ['FINE_UPGRADE_KUBE_CONTEXT'], 'dev')
         self.assertEqual(os.environ['FINE_UPGRADE_TIMEOUT'], '30s')
         self.assertEqual(os.environ['DRY_RUN_FLAG'], '1')
         self.assertEqual(os.environ['HELM_DEBUG'], '1')
+        self.assertEqual(os.environ['FINE_UPGRADE_NO_RENDER_CACHE'], '1')
+        self.assertEqual(os.environ['FINE_UPGRADE_PARALLELISM'], '8')
+        self.assertEqual(os.environ['FINE_UPGRADE_NATIVE_CLIENT'], '1')
+        self.assertEqual(os.environ['FINE_UPGRADE_ROLLOUT_TIMEOUT'], '600')
 
     def test_mutating_command_requires_yes_without_dry_run_in_noninteractive_mode(self):
         args = build_parser().parse_args([
@@ -156,6 +172,68 @@ class MainCliTests(unittest.TestCase):
 
         validate_safety_options(args)
 
+    def test_rolling_update_pod_labels_parses_rollout_limits(self):
+        args = build_parser().parse_args([
+            'rolling-update-pod-labels', 'release', './chart',
+            '--max-concurrent-rollouts', '10',
+            '--max-rollouts-per-namespace', '2',
+            '--max-failures', '1',
+        ])
+
+        self.assertEqual(args.max_concurrent_rollouts, 10)
+        self.assertEqual(args.max_rollouts_per_namespace, 2)
+        self.assertEqual(args.max_failures, 1)
+
+    def test_apply_parses_only_changed(self):
+        args = build_parser().parse_args(['apply', 'release', './chart', '--only-changed'])
+
+        self.assertTrue(args.only_changed)
+
+    def test_state_check_parses_spill_to_disk(self):
+        args = build_parser().parse_args(['state-check', 'release', '--spill-to-disk'])
+
+        self.assertTrue(args.spill_to_disk)
+        self.assertIsNone(args.chart)
+
+    def test_snapshot_subcommand_parses_output_path_and_optional_chart(self):
+        args = build_parser().parse_args([
+            'snapshot', 'release', '--out', './release.snapshot.json.gz',
+        ])
+
+        self.assertEqual(args.action, 'snapshot')
+        self.assertIsNone(args.chart)
+        self.assertEqual(args.out, './release.snapshot.json.gz')
+
+    def test_plan_allows_missing_chart_with_snapshot(self):
+        args = build_parser().parse_args([
+            'plan', 'release', '--from-snapshot', './release.snapshot.json.gz',
+        ])
+
+        validate_chart_option(args)
+        self.assertIsNone(args.chart)
+        self.assertEqual(args.from_snapshot, './release.snapshot.json.gz')
+
+    def test_plan_requires_chart_without_snapshot(self):
+        args = build_parser().parse_args(['plan', 'release'])
+        output_stream = io.StringIO()
+
+        with self.assertRaises(SystemExit) as context:
+            validate_chart_option(args, output_stream=output_stream)
+
+        self.assertEqual(context.exception.code, USAGE_ERROR_EXIT_CODE)
+        self.assertIn('--from-snapshot', output_stream.getvalue())
+
+    def test_apply_accepts_saved_plan_instead_of_chart(self):
+        args = build_parser().parse_args(['apply', 'release', '--plan', './plan.bin'])
+
+        validate_chart_option(args)
+        self.assertEqual(args.plan_path, './plan.bin')
+
+        args = build_parser().parse_args(['apply', 'release', './chart', '--plan', './plan.bin'])
+        with self.assertRaises(SystemExit) as context:
+            validate_chart_option(args, output_stream=io.StringIO())
+        self.assertEqual(context.exception.code, USAGE_ERROR_EXIT_CODE)
+
 
 if __name__ == '__main__':
     unittest.main()
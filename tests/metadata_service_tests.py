@@ -1,12 +1,30 @@
+import contextlib
+import io
+import json
 import os
+import shlex
 import sys
 import unittest
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
 from services.metadata_service import (build_adopt_plan,
-                                       build_set_ownership_commands,
-                                       get_ownership_metadata)
+                                       build_ownership_patch,
+                                       build_set_ownership_command,
+                                       get_ownership_metadata,
+                                       run_ownership_patches,
+                                       set_ownership_metadata)
+
+OWNERSHIP_PATCH = {
+    'metadata': {
+        'annotations': {
+            'meta.helm.sh/release-name': 'release',
+            'meta.helm.sh/release-namespace': 'demo',
+        },
+        'labels': {'app.kubernetes.io/managed-by': 'Helm'},
+    },
+}
 
 
 class MetadataServiceTests(unittest.TestCase):
@@ -38,18 +56,45 @@ class MetadataServiceTests(unittest.TestCase):
             'managed_by': 'Helm',
         })
 
-    def test_build_set_ownership_commands_includes_namespace_for_namespaced_resource(self):
-        commands = build_set_ownership_commands(
-            'ConfigMap', 'app', 'demo', 'release', 'demo')
-
-        self.assertEqual(commands, [
-            ['kubectl', 'annotate', 'ConfigMap', 'app',
-             'meta.helm.sh/release-name=release', '--overwrite', '-n', 'demo'],
-            ['kubectl', 'annotate', 'ConfigMap', 'app',
-             'meta.helm.sh/release-namespace=demo', '--overwrite', '-n', 'demo'],
-            ['kubectl', 'label', 'ConfigMap', 'app',
-             'app.kubernetes.io/managed-by=Helm', '--overwrite', '-n', 'demo'],
-        ])
+    def test_build_ownership_patch_sets_only_missing_metadata(self):
+        self.assertEqual(build_ownership_patch(
+            {'release_name': None, 'release_namespace': None, 'managed_by': None},
+            'release', 'demo'), OWNERSHIP_PATCH)
+        self.assertEqual(build_ownership_patch(
+            {'release_name': 'release', 'release_namespace': 'demo', 'managed_by': None},
+            'release', 'demo'),
+            {'metadata': {'labels': {'app.kubernetes.io/managed-by': 'Helm'}}})
+        self.assertIsNone(build_ownership_patch(
+            {'release_name': 'release', 'release_namespace': 'demo', 'managed_by': 'Helm'},
+            'release', 'demo'))
+
+    def test_build_set_ownership_command_patches_several_objects(self):
+        command = build_set_ownership_command('ConfigMap', ['a', 'b'], 'demo', OWNERSHIP_PATCH)
+
+        self.assertEqual(command[:7], ['kubectl', 'patch', 'ConfigMap', 'a', 'b',
+                                       '--type', 'merge'])
+        self.assertEqual(json.loads(command[8]), OWNERSHIP_PATCH)
+        self.assertEqual(command[9:], ['-n', 'demo'])
+
+    @patch('services.metadata_service.run_cmd')
+    def test_run_ownership_patches_batches_and_retries_failed_batches(self, run_cmd):
+        def patch_objects(cmd):
+            return None if 'broken' in cmd else 'patched'
+        run_cmd.side_effect = patch_objects
+        patches = [('ConfigMap', name, 'demo', OWNERSHIP_PATCH) for name in ('a', 'b')] + \
+            [('Secret', name, 'demo', OWNERSHIP_PATCH) for name in ('c', 'broken')]
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            summary = run_ownership_patches(patches, parallelism=2)
+
+        self.assertEqual(summary['patched'], 3)
+        self.assertEqual(summary['failed'], 1)
+        commands = [call.args[0][:6] for call in run_cmd.call_args_list]
+        self.assertIn(['kubectl', 'patch', 'ConfigMap', 'a', 'b', '--type'], commands)
+        self.assertIn(['kubectl', 'patch', 'Secret', 'c', 'broken', '--type'], commands)
+        self.assertEqual(run_cmd.call_count, 4)
+        self.assertIn('Secret/broken (namespace: demo) 更新失败', stdout.getvalue())
+        self.assertIn('成功 3 个，失败 1 个', stdout.getvalue())
 
     def test_build_adopt_plan_classifies_ownership_states(self):
         rendered_manifests = [
@@ -60,7 +105,7 @@ class MetadataServiceTests(unittest.TestCase):
             {'kind': 'ConfigMap', 'metadata': {'name': 'missing'}},
         ]
 
-        def lookup(kind, name, namespace=None):
+        def lookup_one(kind, name, namespace=None):
             manifests = {
                 'managed': {
                     'kind': kind,
@@ -103,8 +148,11 @@ class MetadataServiceTests(unittest.TestCase):
             }
             return manifests.get(name)
 
+        def lookup(refs):
+            return {ref: lookup_one(*ref) for ref in refs if lookup_one(*ref) is not None}
+
         plan = build_adopt_plan(
-            rendered_manifests, 'release', lookup_manifest_func=lookup)
+            rendered_manifests, 'release', lookup_manifests_func=lookup)
 
         self.assertEqual(plan['summary'], {
             'managed': 1,
@@ -128,15 +176,46 @@ class MetadataServiceTests(unittest.TestCase):
             resource for resource in plan['resources']
             if resource['name'] == 'adoptable'
         ][0]
-        self.assertEqual(adoptable['commands'][0],
-                         'kubectl annotate ConfigMap adoptable '
-                         'meta.helm.sh/release-name=release --overwrite -n demo')
+        self.assertEqual(len(adoptable['commands']), 1)
+        self.assertTrue(adoptable['commands'][0].startswith(
+            'kubectl patch ConfigMap adoptable --type merge -p '))
+        self.assertTrue(adoptable['commands'][0].endswith(' -n demo'))
+        # merge patch 的 JSON 需要加引号，命令才能直接粘贴到 shell 中执行
+        adoptable_args = shlex.split(adoptable['commands'][0])
+        self.assertEqual(adoptable_args[:6],
+                         ['kubectl', 'patch', 'ConfigMap', 'adoptable', '--type', 'merge'])
+        self.assertEqual(json.loads(adoptable_args[7]), OWNERSHIP_PATCH)
+        needs_update = [
+            resource for resource in plan['resources']
+            if resource['name'] == 'needs-update'
+        ][0]
+        self.assertNotIn('release-name"', needs_update['commands'][0])
         conflict = [
             resource for resource in plan['resources']
             if resource['name'] == 'conflict'
         ][0]
         self.assertNotIn('commands', conflict)
 
+    @patch('services.metadata_service.get_api_object_specs')
+    @patch('services.metadata_service.get_complete_release_api_objects', return_value=[])
+    @patch('services.metadata_service.render_helm_template_manifests')
+    def test_set_ownership_metadata_dry_run_prints_quoted_commands(
+            self, render_helm_template_manifests, get_complete_release_api_objects,
+            get_api_object_specs):
+        render_helm_template_manifests.return_value = [
+            {'kind': 'ConfigMap', 'metadata': {'name': 'app', 'namespace': 'demo'}}]
+        get_api_object_specs.return_value = {
+            ('ConfigMap', 'app', 'demo'): {
+                'kind': 'ConfigMap', 'metadata': {'name': 'app', 'namespace': 'demo'}}}
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            set_ownership_metadata('./chart', 'release', None, '', True)
+
+        command = stdout.getvalue().splitlines()[-1]
+        args = shlex.split(command)
+        self.assertEqual(args[:4], ['kubectl', 'patch', 'ConfigMap', 'app'])
+        self.assertEqual(json.loads(args[args.index('-p') + 1]), OWNERSHIP_PATCH)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,137 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from services.helm_service import apply_plan, plan_upgrade
+from services.plan_artifact_service import load_plan_artifact
+from utils.output_utils import FAILURE_EXIT_CODE
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'config.yml'))
+
+
+def config_map(name, value, resource_version=None):
+    manifest = {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': name, 'namespace': 'demo'},
+        'data': {'value': value},
+    }
+    if resource_version is not None:
+        manifest['metadata']['resourceVersion'] = resource_version
+    return manifest
+
+
+class PlanArtifactTests(unittest.TestCase):
+
+    def setUp(self):
+        self.original_namespace = os.environ.get('HELM_NAMESPACE')
+        os.environ['HELM_NAMESPACE'] = 'demo'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.plan_path = os.path.join(self.temp_dir.name, 'plan.bin')
+        self.adopted = config_map('adopted', 'same', resource_version='7')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        if self.original_namespace is None:
+            os.environ.pop('HELM_NAMESPACE', None)
+        else:
+            os.environ['HELM_NAMESPACE'] = self.original_namespace
+
+    @patch('services.helm_service.print_structured_output')
+    @patch('services.helm_service.get_api_object_specs')
+    @patch('services.helm_service.get_all_release_api_objects')
+    @patch('services.helm_service.iter_rendered_chart_manifests')
+    def write_plan(self, iter_rendered_chart_manifests, get_all_release_api_objects,
+                   get_api_object_specs, print_structured_output):
+        iter_rendered_chart_manifests.return_value = iter([
+            config_map('same', '1'), config_map('changed', '2'),
+            config_map('new', '3'), config_map('adopted', 'same')])
+        get_all_release_api_objects.return_value = [
+            config_map('same', '1', resource_version='10'),
+            config_map('changed', 'old', resource_version='11')]
+        get_api_object_specs.side_effect = lambda refs: {
+            ref: self.adopted for ref in refs if ref[1] == 'adopted'}
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            plan_upgrade('./chart', 'release', None, CONFIG_PATH, '', plan_out=self.plan_path)
+
+    def test_plan_out_saves_changed_manifests_and_resource_versions(self):
+        self.write_plan()
+
+        artifact = load_plan_artifact(self.plan_path, 'release')
+
+        self.assertEqual(
+            [(resource['key'], resource['status'], resource['resource_version'])
+             for resource in artifact['resources']],
+            [('ConfigMap:demo:changed', 'update', '11'),
+             ('ConfigMap:demo:new', 'create', None),
+             ('ConfigMap:demo:adopted', 'adopt', '7')])
+        self.assertEqual(artifact['resources'][0]['manifest'], config_map('changed', '2'))
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertIsNone(load_plan_artifact(self.plan_path, 'other'))
+
+    @patch('services.helm_service.apply_manifests_and_report')
+    @patch('services.helm_service.render_helm_template_manifests')
+    def test_apply_plan_applies_saved_manifests_without_rendering(
+            self, render_helm_template_manifests, apply_manifests_and_report):
+        self.write_plan()
+        current = {
+            ('ConfigMap', 'changed', 'demo'): config_map('changed', 'old', resource_version='11'),
+            ('ConfigMap', 'adopted', 'demo'): self.adopted,
+        }
+
+        with patch('services.helm_service.get_api_object_specs',
+                   return_value=current) as get_api_object_specs, \
+                patch.dict(os.environ, {'DRY_RUN_FLAG': '0'}), \
+                contextlib.redirect_stderr(io.StringIO()):
+            apply_plan(self.plan_path, 'release')
+
+        render_helm_template_manifests.assert_not_called()
+        get_api_object_specs.assert_called_once()
+        self.assertEqual([manifest['metadata']['name']
+                          for manifest in apply_manifests_and_report.call_args.args[0]],
+                         ['changed', 'new', 'adopted'])
+
+    @patch('services.helm_service.apply_manifests_and_report')
+    def test_apply_plan_fails_when_resource_version_moved(self, apply_manifests_and_report):
+        self.write_plan()
+        current = {
+            ('ConfigMap', 'changed', 'demo'): config_map('changed', 'old', resource_version='12'),
+            ('ConfigMap', 'new', 'demo'): config_map('new', '3', resource_version='13'),
+            ('ConfigMap', 'adopted', 'demo'): self.adopted,
+        }
+
+        with patch('services.helm_service.get_api_object_specs', return_value=current), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr, \
+                self.assertRaises(SystemExit) as context:
+            apply_plan(self.plan_path, 'release')
+
+        self.assertEqual(context.exception.code, FAILURE_EXIT_CODE)
+        apply_manifests_and_report.assert_not_called()
+        self.assertIn('ConfigMap:demo:changed: resourceVersion 11 -> 12', stderr.getvalue())
+        self.assertIn('ConfigMap:demo:new: resourceVersion - -> 13', stderr.getvalue())
+
+
+    @patch('services.helm_service.apply_manifests_and_report')
+    def test_apply_plan_rejects_different_namespace_option(self, apply_manifests_and_report):
+        self.write_plan()
+
+        with patch.dict(os.environ, {'FINE_UPGRADE_NAMESPACE_OPTION': 'other'}), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr, \
+                self.assertRaises(SystemExit) as context:
+            apply_plan(self.plan_path, 'release')
+
+        self.assertEqual(context.exception.code, FAILURE_EXIT_CODE)
+        apply_manifests_and_report.assert_not_called()
+        self.assertIn('--namespace other', stderr.getvalue())
+        with patch.dict(os.environ, {'FINE_UPGRADE_NAMESPACE_OPTION': 'demo'}):
+            self.assertIsNotNone(load_plan_artifact(self.plan_path, 'release'))
+
+if __name__ == '__main__':
+    unittest.main()
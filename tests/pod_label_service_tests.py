@@ -0,0 +1,174 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import call, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from services.pod_label_service import rolling_update_worker, run_rollouts
+from utils.rollout_journal import RolloutJournal
+
+
+class RunRolloutsTests(unittest.TestCase):
+
+    def run_all(self, rollouts, worker, **kwargs):
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            outcomes = list(run_rollouts(rollouts, worker, **kwargs))
+        return outcomes, stderr.getvalue()
+
+    def test_results_stream_in_completion_order(self):
+        def worker(delay, name):
+            time.sleep(delay)
+            return name
+
+        outcomes, stderr = self.run_all(
+            [('demo', 'slow', (0.2, 'slow')), ('demo', 'fast', (0.01, 'fast'))], worker)
+
+        self.assertEqual([outcome['result'] for outcome in outcomes], ['fast', 'slow'])
+        self.assertIn('开始滚动更新 demo:slow', stderr)
+
+    def test_concurrency_caps_apply_globally_and_per_namespace(self):
+        lock = threading.Lock()
+        running = {'total': 0, 'a': 0, 'b': 0}
+        peaks = {'total': 0, 'a': 0, 'b': 0}
+
+        def worker(namespace):
+            with lock:
+                for key in ('total', namespace):
+                    running[key] += 1
+                    peaks[key] = max(peaks[key], running[key])
+            time.sleep(0.02)
+            with lock:
+                running['total'] -= 1
+                running[namespace] -= 1
+
+        rollouts = [(namespace, f'app-{i}', (namespace,))
+                    for i in range(4) for namespace in ('a', 'b')]
+        outcomes, _ = self.run_all(rollouts, worker, max_concurrent_rollouts=3,
+                                   max_rollouts_per_namespace=1)
+
+        self.assertEqual(len(outcomes), 8)
+        self.assertEqual(peaks, {'total': 2, 'a': 1, 'b': 1})
+
+    def test_failure_budget_stops_new_rollouts(self):
+        def worker(name):
+            raise Exception(f'{name} 部署失败！')
+
+        rollouts = [('demo', f'app-{i}', (f'app-{i}',)) for i in range(4)]
+        outcomes, stderr = self.run_all(rollouts, worker, max_concurrent_rollouts=1,
+                                        max_failures=2)
+
+        self.assertEqual([outcome['status'] for outcome in outcomes],
+                         ['failed', 'failed', 'skipped', 'skipped'])
+        self.assertEqual(outcomes[0]['error'], 'app-0 部署失败！')
+        self.assertIn('失败数量达到 2', stderr)
+
+
+class RolloutJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.temp_dir.name, 'journal.jsonl')
+        self.rendered = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'api', 'namespace': 'demo'},
+            'spec': {'selector': {'matchLabels': {'app': 'api-v2'}}},
+        }
+        self.cluster = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'api', 'namespace': 'demo'},
+            'spec': {'selector': {'matchLabels': {'app': 'api'}},
+                     'template': {'metadata': {'labels': {'app': 'api'}}}},
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_journal_keeps_last_step_and_ignores_truncated_lines(self):
+        journal = RolloutJournal(self.journal_path)
+        journal.record('demo', 'api', 'started', manifest=self.cluster, target={'app': 'v2'})
+        journal.record('demo', 'api', 'temp-ready')
+        with open(self.journal_path, 'a', encoding='utf-8') as journal_file:
+            journal_file.write('{"namespace": "demo", "name": "api", "st')
+
+        state = RolloutJournal(self.journal_path).get('demo', 'api')
+
+        self.assertEqual(state['step'], 'temp-ready')
+        self.assertEqual(state['manifest'], self.cluster)
+        self.assertEqual(state['target'], {'app': 'v2'})
+
+    @patch('services.pod_label_service.run_cmd')
+    @patch('services.pod_label_service.delete_deployment')
+    @patch('services.pod_label_service.apply_deployment', return_value=1.0)
+    def test_worker_records_every_step(self, apply_deployment, delete_deployment, run_cmd):
+        journal = RolloutJournal(self.journal_path)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            rolling_update_worker(self.rendered, self.cluster, {'demo:api': {'kind': 'Service'}},
+                                  ['kubectl', 'apply', '-f', '-'], journal=journal)
+
+        self.assertEqual(RolloutJournal(self.journal_path).get('demo', 'api')['step'], 'done')
+        temp_manifest = apply_deployment.call_args_list[0].args[0]
+        self.assertEqual(temp_manifest['metadata']['name'], 'api-rolling-temp')
+        self.assertEqual(self.cluster['metadata']['name'], 'api')
+        self.assertEqual(delete_deployment.call_args_list,
+                         [call('demo', 'api'), call('demo', 'api-rolling-temp')])
+
+    @patch('services.pod_label_service.run_cmd')
+    @patch('services.pod_label_service.delete_deployment')
+    @patch('services.pod_label_service.apply_deployment', return_value=1.0)
+    def test_worker_resumes_after_old_deployment_was_deleted(
+            self, apply_deployment, delete_deployment, run_cmd):
+        journal = RolloutJournal(self.journal_path)
+        journal.record('demo', 'api', 'started', manifest=self.cluster, target={'app': 'api-v2'})
+        journal.record('demo', 'api', 'temp-ready')
+        journal.record('demo', 'api', 'old-deleted')
+
+        message = rolling_update_worker(self.rendered, self.cluster, {},
+                                        ['kubectl', 'apply', '-f', '-'],
+                                        journal=journal, completed_step='old-deleted')
+
+        self.assertEqual(len(apply_deployment.call_args_list), 1)
+        new_manifest = apply_deployment.call_args.args[0]
+        self.assertEqual(new_manifest['metadata']['name'], 'api')
+        self.assertEqual(new_manifest['spec']['selector']['matchLabels'], {'app': 'api-v2'})
+        delete_deployment.assert_called_once_with('demo', 'api-rolling-temp')
+        run_cmd.assert_not_called()
+        self.assertIn('old-deleted', message)
+        self.assertEqual(journal.get('demo', 'api')['step'], 'done')
+
+    @patch('services.pod_label_service.run_cmd')
+    @patch('services.pod_label_service.delete_deployment', return_value=None)
+    @patch('services.pod_label_service.apply_deployment', return_value=1.0)
+    def test_failed_delete_is_not_recorded(self, apply_deployment, delete_deployment, run_cmd):
+        journal = RolloutJournal(self.journal_path)
+
+        with self.assertRaises(Exception) as context:
+            rolling_update_worker(self.rendered, self.cluster, {},
+                                  ['kubectl', 'apply', '-f', '-'], journal=journal)
+
+        self.assertIn('old-deleted', str(context.exception))
+        self.assertEqual(RolloutJournal(self.journal_path).get('demo', 'api')['step'], 'temp-ready')
+        self.assertEqual(len(apply_deployment.call_args_list), 1)
+
+    @patch('services.pod_label_service.run_cmd', return_value=None)
+    @patch('services.pod_label_service.delete_deployment', return_value='')
+    @patch('services.pod_label_service.apply_deployment', return_value=1.0)
+    def test_failed_service_apply_is_not_recorded(self, apply_deployment, delete_deployment, run_cmd):
+        journal = RolloutJournal(self.journal_path)
+
+        with self.assertRaises(Exception):
+            rolling_update_worker(self.rendered, self.cluster, {'demo:api': {'kind': 'Service'}},
+                                  ['kubectl', 'apply', '-f', '-'], journal=journal)
+
+        self.assertEqual(RolloutJournal(self.journal_path).get('demo', 'api')['step'], 'new-ready')
+        delete_deployment.assert_called_once_with('demo', 'api')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from utils.render_cache import (DEFAULT_RENDER_CACHE_MAX_BYTES, build_render_cache_key,
+                                evict_render_cache, get_render_cache_max_bytes,
+                                get_render_cache_path, open_render_cache,
+                                render_cache_writer)
+from utils.helm_utils import iter_helm_template_manifests
+
+
+class RenderCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.original_env = {
+            key: os.environ.get(key)
+            for key in (
+                'HELM_NAMESPACE',
+                'FINE_UPGRADE_RENDER_CACHE_DIR',
+                'FINE_UPGRADE_RENDER_CACHE_MAX_BYTES',
+                'FINE_UPGRADE_NO_RENDER_CACHE',
+            )
+        }
+        for key in self.original_env:
+            os.environ.pop(key, None)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.chart_dir = os.path.join(self.temp_dir.name, 'chart')
+        os.makedirs(os.path.join(self.chart_dir, 'templates'))
+        self.write_file(os.path.join(self.chart_dir, 'Chart.yaml'), 'name: demo\n')
+        self.write_file(os.path.join(self.chart_dir, 'templates', 'cm.yaml'),
+                        'kind: ConfigMap\n')
+        self.values_path = os.path.join(self.temp_dir.name, 'values.yaml')
+        self.write_file(self.values_path, 'image: {tag: "1"}\n')
+        os.environ['FINE_UPGRADE_RENDER_CACHE_DIR'] = os.path.join(
+            self.temp_dir.name, 'cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        for key, value in self.original_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def write_file(self, path, content):
+        with open(path, 'w', encoding='utf-8') as output_file:
+            output_file.write(content)
+
+    def write_cache(self, key, content):
+        with render_cache_writer(key) as cache_file:
+            cache_file.write(content)
+
+    def read_cache(self, key):
+        cache_file = open_render_cache(key)
+        if cache_file is None:
+            return None
+        with cache_file:
+            return cache_file.read()
+
+    def build_key(self, cmd=None):
+        return build_render_cache_key(cmd or ['helm', 'template', 'demo'],
+                                      self.chart_dir, self.values_path, 'v3.15.0')
+
+    def test_cache_key_changes_with_chart_values_command_and_helm_version(self):
+        key = self.build_key()
+
+        self.assertEqual(key, self.build_key())
+        self.assertNotEqual(key, self.build_key(['helm', 'template', 'other']))
+        self.assertNotEqual(key, build_render_cache_key(
+            ['helm', 'template', 'demo'], self.chart_dir, self.values_path, 'v4.0.0'))
+
+        self.write_file(self.values_path, 'image: {tag: "2"}\n')
+        values_key = self.build_key()
+        self.assertNotEqual(key, values_key)
+
+        self.write_file(os.path.join(self.chart_dir, 'templates', 'cm.yaml'),
+                        'kind: Secret\n')
+        self.assertNotEqual(values_key, self.build_key())
+
+    def test_cache_key_is_none_for_remote_chart_reference(self):
+        self.assertIsNone(build_render_cache_key(
+            ['helm', 'template', 'demo'], 'repo/chart', None, 'v3.15.0'))
+
+    def test_evict_render_cache_removes_least_recently_used_entries(self):
+        self.write_cache('old', 'a' * 10)
+        self.write_cache('new', 'b' * 10)
+        now = time.time()
+        os.utime(get_render_cache_path('old'), (now - 100, now - 100))
+        os.utime(get_render_cache_path('new'), (now, now))
+
+        removed = evict_render_cache(15)
+
+        self.assertEqual(removed, [get_render_cache_path('old')])
+        self.assertIsNone(self.read_cache('old'))
+        self.assertEqual(self.read_cache('new'), 'b' * 10)
+
+    def test_render_cache_writer_discards_content_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with render_cache_writer('broken') as cache_file:
+                cache_file.write('partial')
+                raise RuntimeError('render failed')
+
+        self.assertIsNone(self.read_cache('broken'))
+        self.assertEqual(os.listdir(os.environ['FINE_UPGRADE_RENDER_CACHE_DIR']), [])
+
+    def test_malformed_max_bytes_falls_back_to_default(self):
+        os.environ['FINE_UPGRADE_RENDER_CACHE_MAX_BYTES'] = '512MiB'
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            max_bytes = get_render_cache_max_bytes()
+
+        self.assertEqual(max_bytes, DEFAULT_RENDER_CACHE_MAX_BYTES)
+        self.assertIn('FINE_UPGRADE_RENDER_CACHE_MAX_BYTES', stderr.getvalue())
+
+    @patch('utils.helm_utils.get_helm_version')
+    @patch('utils.helm_utils.open_cmd_stream')
+    def test_repository_chart_skips_helm_version(self, open_cmd_stream, get_helm_version):
+        open_cmd_stream.side_effect = lambda cmd: contextlib.nullcontext(
+            io.StringIO('kind: ConfigMap\n'))
+
+        list(iter_helm_template_manifests('demo', 'repo/demo', self.values_path))
+
+        get_helm_version.assert_not_called()
+        self.assertFalse(os.path.isdir(os.environ['FINE_UPGRADE_RENDER_CACHE_DIR']))
+
+    @patch('utils.helm_utils.get_helm_version', return_value='v3.15.0')
+    @patch('utils.helm_utils.open_cmd_stream')
+    def test_iter_helm_template_manifests_reuses_cached_output(self, open_cmd_stream, _):
+        open_cmd_stream.side_effect = lambda cmd: contextlib.nullcontext(
+            io.StringIO('kind: ConfigMap\n---\n---\nkind: Secret\n'))
+
+        first = list(iter_helm_template_manifests('demo', self.chart_dir, self.values_path))
+        second = list(iter_helm_template_manifests('demo', self.chart_dir, self.values_path))
+
+        self.assertEqual(first, [{'kind': 'ConfigMap'}, {'kind': 'Secret'}])
+        self.assertEqual(second, first)
+        open_cmd_stream.assert_called_once()
+
+    @patch('utils.helm_utils.get_helm_version', return_value='v3.15.0')
+    @patch('utils.helm_utils.open_cmd_stream')
+    def test_iter_helm_template_manifests_skips_cache_when_disabled(self, open_cmd_stream, _):
+        os.environ['FINE_UPGRADE_NO_RENDER_CACHE'] = '1'
+        open_cmd_stream.side_effect = lambda cmd: contextlib.nullcontext(
+            io.StringIO('kind: ConfigMap\n'))
+
+        list(iter_helm_template_manifests('demo', self.chart_dir, self.values_path))
+        list(iter_helm_template_manifests('demo', self.chart_dir, self.values_path))
+
+        self.assertEqual(open_cmd_stream.call_count, 2)
+        self.assertFalse(os.path.isdir(os.environ['FINE_UPGRADE_RENDER_CACHE_DIR']))
+
+
+if __name__ == '__main__':
+    unittest.main()
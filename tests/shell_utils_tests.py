@@ -0,0 +1,57 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from utils.shell_utils import open_cmd_stream
+from utils.yaml_utils import iter_yaml_documents
+
+
+class ShellUtilsTests(unittest.TestCase):
+
+    def test_open_cmd_stream_yields_documents_incrementally(self):
+        script = (
+            'import sys\n'
+            'for i in range(3):\n'
+            '    sys.stdout.write(f"---\\nkind: ConfigMap\\nmetadata: {{name: cm-{i}}}\\n")\n'
+        )
+
+        with open_cmd_stream([sys.executable, '-c', script]) as stream:
+            names = [manifest['metadata']['name']
+                     for manifest in iter_yaml_documents(stream)]
+
+        self.assertEqual(names, ['cm-0', 'cm-1', 'cm-2'])
+
+    def test_open_cmd_stream_raises_when_command_fails(self):
+        script = 'import sys; sys.stderr.write("boom"); sys.exit(3)'
+        output = io.StringIO()
+
+        with redirect_stdout(output):
+            with self.assertRaises(subprocess.CalledProcessError) as context:
+                with open_cmd_stream([sys.executable, '-c', script]) as stream:
+                    stream.read()
+
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(context.exception.stderr, 'boom')
+        self.assertIn('boom', output.getvalue())
+
+    def test_open_cmd_stream_kills_command_on_early_exit(self):
+        script = 'import sys, time\nprint("ready", flush=True)\ntime.sleep(30)\n'
+
+        with open_cmd_stream([sys.executable, '-c', script], kill_on_exit=True) as stream:
+            self.assertEqual(stream.readline(), 'ready\n')
+
+    def test_open_cmd_stream_raises_after_timeout(self):
+        script = 'import time; time.sleep(30)'
+
+        with self.assertRaises(subprocess.TimeoutExpired):
+            with open_cmd_stream([sys.executable, '-c', script], timeout=0.2) as stream:
+                stream.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from services.helm_service import plan_upgrade
+from services.snapshot_service import (SNAPSHOT_FORMAT, SNAPSHOT_VERSION,
+                                       build_snapshot_lookup, load_snapshot,
+                                       read_snapshot, write_snapshot)
+from utils.output_utils import FAILURE_EXIT_CODE
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'config.yml'))
+
+
+def build_snapshot(**overrides):
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created_at': '2026-01-01T00:00:00+00:00',
+        'release': {'name': 'release', 'namespace': 'demo'},
+        'release_manifests': [],
+        'rendered_manifests': [
+            {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'changed', 'namespace': 'demo'},
+                'data': {'value': 'new'},
+            },
+            {
+                'kind': 'Secret',
+                'metadata': {'name': 'adopt-me'},
+                'data': {'token': 'abc'},
+            },
+        ],
+        'runtime_manifests': [
+            {
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'changed', 'namespace': 'demo'},
+                'data': {'value': 'old'},
+            },
+        ],
+        'lookup_manifests': [
+            {
+                'kind': 'Secret',
+                'metadata': {'name': 'adopt-me', 'namespace': 'demo'},
+                'data': {'token': 'abc'},
+            },
+            {
+                'kind': 'ClusterRole',
+                'metadata': {'name': 'reader'},
+            },
+        ],
+        'fetch_failures': [],
+    }
+    snapshot.update(overrides)
+    return snapshot
+
+
+class SnapshotServiceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.original_namespace = os.environ.pop('HELM_NAMESPACE', None)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.temp_dir.name, 'release.snapshot.json.gz')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        if self.original_namespace is None:
+            os.environ.pop('HELM_NAMESPACE', None)
+        else:
+            os.environ['HELM_NAMESPACE'] = self.original_namespace
+
+    def test_write_and_read_snapshot_round_trip(self):
+        snapshot = build_snapshot()
+
+        write_snapshot(snapshot, self.snapshot_path)
+
+        self.assertEqual(read_snapshot(self.snapshot_path), snapshot)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['release.snapshot.json.gz'])
+
+    def test_read_snapshot_rejects_unsupported_version(self):
+        with gzip.open(self.snapshot_path, 'wt', encoding='utf-8') as snapshot_file:
+            json.dump(build_snapshot(version=SNAPSHOT_VERSION + 1), snapshot_file)
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertIsNone(read_snapshot(self.snapshot_path))
+        self.assertIn('不支持的快照版本', stderr.getvalue())
+
+    def test_load_snapshot_checks_release_and_uses_snapshot_namespace(self):
+        write_snapshot(build_snapshot(), self.snapshot_path)
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertIsNone(load_snapshot(self.snapshot_path, 'other'))
+        self.assertIsNotNone(load_snapshot(self.snapshot_path, 'release'))
+        self.assertEqual(os.environ['HELM_NAMESPACE'], 'demo')
+
+    def test_load_snapshot_rejects_different_namespace_option(self):
+        write_snapshot(build_snapshot(), self.snapshot_path)
+
+        with patch.dict(os.environ, {'FINE_UPGRADE_NAMESPACE_OPTION': 'other'}), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr, \
+                self.assertRaises(SystemExit) as context:
+            load_snapshot(self.snapshot_path, 'release')
+
+        self.assertEqual(context.exception.code, FAILURE_EXIT_CODE)
+        self.assertIn('--namespace other', stderr.getvalue())
+        self.assertNotIn('HELM_NAMESPACE', os.environ)
+
+    def test_snapshot_lookup_resolves_default_and_cluster_scoped_namespaces(self):
+        lookup = build_snapshot_lookup(build_snapshot())
+
+        manifests = lookup([
+            ('Secret', 'adopt-me', None),
+            ('ClusterRole', 'reader', 'demo'),
+            ('ConfigMap', 'missing', 'demo'),
+        ])
+
+        self.assertEqual(set(manifests), {
+            ('Secret', 'adopt-me', None),
+            ('ClusterRole', 'reader', 'demo'),
+        })
+
+    @patch('services.helm_service.print_structured_output')
+    @patch('services.helm_service.get_api_object_specs')
+    @patch('services.helm_service.get_all_release_api_objects')
+    def test_plan_upgrade_replays_snapshot_without_cluster_access(
+            self, get_all_release_api_objects, get_api_object_specs,
+            print_structured_output):
+        write_snapshot(build_snapshot(fetch_failures=[
+            {'kind': 'Job', 'namespace': 'demo', 'error': 'timeout'},
+        ]), self.snapshot_path)
+
+        plan_upgrade(None, 'release', None, CONFIG_PATH, '',
+                     snapshot_path=self.snapshot_path)
+
+        get_all_release_api_objects.assert_not_called()
+        get_api_object_specs.assert_not_called()
+        plan = print_structured_output.call_args.args[0]
+        statuses = {resource['key']: resource['status'] for resource in plan['resources']}
+        self.assertEqual(statuses['ConfigMap:demo:changed'], 'update')
+        self.assertEqual(statuses['Secret:demo:adopt-me'], 'adopt')
+        self.assertEqual(plan['summary']['fetch_failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
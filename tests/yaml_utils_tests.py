@@ -0,0 +1,51 @@
+import importlib
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from utils import yaml_utils
+
+
+class YamlUtilsTests(unittest.TestCase):
+
+    def tearDown(self):
+        importlib.reload(yaml_utils)
+
+    def test_dump_yaml_uses_pipe_style_for_multiline_strings(self):
+        yaml_utils.init_yaml_representer()
+
+        output = yaml_utils.dump_yaml({'data': 'line one  \nline two\n'},
+                                      allow_unicode=True)
+
+        self.assertEqual(output, 'data: |-\n  line one\n  line two\n')
+        self.assertEqual(yaml_utils.load_yaml(output),
+                         {'data': 'line one\nline two'})
+
+    def test_backend_prefers_libyaml_when_available(self):
+        if not yaml.__with_libyaml__:
+            self.skipTest('libyaml is not installed')
+
+        self.assertEqual(yaml_utils.YAML_BACKEND, 'libyaml')
+        self.assertIs(yaml_utils.SafeLoader, yaml.CSafeLoader)
+        self.assertIs(yaml_utils.SafeDumper, yaml.CSafeDumper)
+
+    def test_backend_falls_back_to_pure_python_without_libyaml(self):
+        with patch.object(yaml, '__with_libyaml__', False):
+            importlib.reload(yaml_utils)
+
+        self.assertEqual(yaml_utils.YAML_BACKEND, 'python')
+        self.assertIs(yaml_utils.SafeLoader, yaml.SafeLoader)
+        yaml_utils.init_yaml_representer()
+        self.assertEqual(
+            list(yaml_utils.iter_yaml_documents('a: 1\n---\n---\nb: |\n  x\n  y\n')),
+            [{'a': 1}, {'b': 'x\ny\n'}])
+        self.assertIn('|', yaml_utils.dump_yaml({'b': 'x\ny'}))
+
+
+if __name__ == '__main__':
+    unittest.main()